@@ -0,0 +1,100 @@
+"""
+Open-loop load test of admission control at a multiple of the simulated capacity.
+
+The endpoint holds one of `--capacity` upstream slots for `--service-ms`, so it
+serves about capacity / service time requests per second. Half of the traffic is
+from guests, half from known users. The run is repeated without and with
+`AdmissionMiddleware`; with it, p99 of admitted requests should stay bounded.
+
+    python -m bench.admission_load --overload 3 --seconds 10
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, sleep, create_task, gather, Semaphore, Task
+from os import environ
+from random import expovariate, random
+from time import perf_counter
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient, ASGITransport
+
+from bench.utils import summarize
+
+environ.setdefault("POCKETBASE_URL", "http://127.0.0.1:4123")
+
+from server.config import Config, Roles  # noqa: E402
+from server.services.auth_service import AuthorizationMiddleware  # noqa: E402
+from server.services.admission_service import AdmissionMiddleware, admission_controller  # noqa: E402
+
+USER_TOKEN = "bench-user-token"
+
+
+def build_app(admission: bool, capacity: int, service: float) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(AuthorizationMiddleware)
+    if admission:
+        app.add_middleware(AdmissionMiddleware)
+    upstream = Semaphore(capacity)
+
+    async def stream():
+        async with upstream:
+            await sleep(service)
+        yield '{"type": "ai-thinking"}\n'
+
+    @app.get("/api/query/thinking")
+    async def query_thinking():
+        return StreamingResponse(stream(), media_type="application/json")
+
+    return app
+
+
+async def measure(name: str, app: FastAPI, rps: float, seconds: float):
+    transport = ASGITransport(app=app)
+    latencies: dict[str, list[float]] = {"guest": [], "user": []}
+    statuses: dict[int, int] = {}
+
+    async with AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+
+        async def one(kind: str):
+            headers = {"Authorization": f"Bearer {USER_TOKEN}"} if kind == "user" else {}
+            start = perf_counter()
+            response = await client.get("/api/query/thinking", headers=headers)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                latencies[kind].append(perf_counter() - start)
+
+        tasks: list[Task[None]] = []
+        start = perf_counter()
+        while perf_counter() - start < seconds:
+            tasks.append(create_task(one("guest" if random() < 0.5 else "user")))
+            await sleep(expovariate(rps))
+        await gather(*tasks)
+        elapsed = perf_counter() - start
+
+    print(f"{name}: statuses {dict(sorted(statuses.items()))}")
+    for kind, values in latencies.items():
+        print(summarize(f"{name} {kind} admitted", values, 0, elapsed))
+
+
+async def main(capacity: int, service_ms: float, overload: float, seconds: float):
+    service = service_ms / 1000
+    rps = capacity / service * overload
+    Config.ADMISSION_SOFT_IN_FLIGHT = capacity
+    Config.ADMISSION_HARD_IN_FLIGHT = capacity * 2
+    Config.RATE_LIMIT_GUEST = Config.RATE_LIMIT_USER = (rps * 10, rps * 10)
+    admission_controller.remember_role(USER_TOKEN, Roles.USER.id)
+    print(f"capacity {capacity / service:.0f} rps, offered {rps:.0f} rps")
+
+    await measure("no admission", build_app(False, capacity, service), rps, seconds)
+    await measure("admission", build_app(True, capacity, service), rps, seconds)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--service-ms", type=float, default=100)
+    parser.add_argument("--overload", type=float, default=3)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    run(main(args.capacity, args.service_ms, args.overload, args.seconds))
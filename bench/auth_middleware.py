@@ -0,0 +1,125 @@
+"""
+Compares throughput and time-to-first-byte of a streaming `/api/query/thinking`
+behind the old `BaseHTTPMiddleware`-based auth and the pure ASGI middleware.
+
+PocketBase auth and the upstream model are simulated with fixed delays, so only
+the middleware and streaming path differ between the two runs.
+
+    python -m bench.auth_middleware --requests 500 --concurrency 50
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, sleep, create_task, gather, Semaphore
+from os import environ
+from time import perf_counter
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.requests import Request
+from uvicorn import Config as UvicornConfig, Server
+
+from bench.utils import summarize, LatencySummary
+
+environ.setdefault("POCKETBASE_URL", "http://127.0.0.1:4123")
+
+from server.services.auth_service import AuthorizationMiddleware  # noqa: E402
+from server.models import ServerResponseAi, ServerResponseType, CompletionChunkResponse  # noqa: E402
+
+
+class LegacyAuthorizationMiddleware(BaseHTTPMiddleware):
+    """The middleware before the change, with PocketBase auth replaced by a delay."""
+
+    auth_delay = 0.0
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+        if "api" in request.url.path:
+            await sleep(self.auth_delay)
+        return await call_next(request)
+
+
+def build_app(legacy: bool, auth_delay: float, chunks: int, chunk_delay: float) -> FastAPI:
+    app = FastAPI()
+    if legacy:
+        LegacyAuthorizationMiddleware.auth_delay = auth_delay
+        app.add_middleware(LegacyAuthorizationMiddleware)
+    else:
+        app.add_middleware(AuthorizationMiddleware)
+
+    async def stream():
+        for i in range(chunks):
+            yield ServerResponseAi.create(
+                type=ServerResponseType.AiThinking,
+                data=CompletionChunkResponse(stopped=i == chunks - 1, content="之"),
+            ).to_jsonl_str()
+            await sleep(chunk_delay)
+
+    @app.get("/api/query/thinking")
+    async def query_thinking():
+        if not legacy:
+            # The handler authenticates (lazily) before checking the balance.
+            await sleep(auth_delay)
+        return StreamingResponse(stream(), media_type="application/json")
+
+    return app
+
+
+async def measure(
+    name: str, app: FastAPI, port: int, requests: int, concurrency: int
+) -> tuple[LatencySummary, LatencySummary]:
+    server = Server(UvicornConfig(app, port=port, log_level="warning", lifespan="off"))
+    serve_task = create_task(server.serve())
+    while not server.started:
+        await sleep(0.01)
+
+    semaphore = Semaphore(concurrency)
+    first_bytes: list[float] = []
+    totals: list[float] = []
+    errors = 0
+
+    async with AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = perf_counter()
+                try:
+                    async with client.stream("GET", "/api/query/thinking") as response:
+                        first = True
+                        async for _ in response.aiter_raw():
+                            if first:
+                                first_bytes.append(perf_counter() - start)
+                                first = False
+                    totals.append(perf_counter() - start)
+                except Exception:
+                    errors += 1
+
+        start = perf_counter()
+        await gather(*(one() for _ in range(requests)))
+        seconds = perf_counter() - start
+
+    server.should_exit = True
+    await serve_task
+    return (
+        summarize(f"{name} ttfb", first_bytes, errors, seconds),
+        summarize(f"{name} total", totals, errors, seconds),
+    )
+
+
+async def main(requests: int, concurrency: int, auth_ms: float, chunks: int, chunk_ms: float):
+    for index, (name, legacy) in enumerate([("legacy", True), ("asgi", False)]):
+        app = build_app(legacy, auth_ms / 1000, chunks, chunk_ms / 1000)
+        for summary in await measure(name, app, 18_400 + index, requests, concurrency):
+            print(summary)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--auth-ms", type=float, default=5)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--chunk-ms", type=float, default=1)
+    args = parser.parse_args()
+    run(main(args.requests, args.concurrency, args.auth_ms, args.chunks, args.chunk_ms))
@@ -0,0 +1,143 @@
+"""
+Checks the cache backends of `server.services.cache_service` against the same
+expectations and times their operations. The Redis-protocol backend runs against
+`RespStandIn` from `tests.resp_standin`, a small in-process server speaking enough
+RESP2 for it (or against a real server with `--redis-url`). Each backend is opened
+twice, as two workers would, to check that entries and locks are shared.
+
+    python -m bench.cache_backends --ops 2000
+    python -m bench.cache_backends --redis-url redis://127.0.0.1:6379/15
+"""
+
+from argparse import ArgumentParser
+from asyncio import gather, run, sleep
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable
+
+from server.services.cache_service import (
+    CacheBackend,
+    LockTimeoutError,
+    MemoryCacheBackend,
+    RespCacheBackend,
+    SqliteCacheBackend,
+)
+from tests.resp_standin import RespStandIn
+
+STANDIN_PORT = 8783
+
+
+async def check(name: str, first: CacheBackend, second: CacheBackend) -> list[str]:
+    """Runs the shared expectations; returns the failures."""
+    failures: list[str] = []
+
+    def expect(what: str, ok: bool) -> None:
+        if not ok:
+            failures.append(what)
+
+    key = f"bench:{name}:{perf_counter()}"
+    await first.set(key, "之 — 代词", 60)
+    expect("get after set", await first.get(key) == "之 — 代词")
+    expect("missing key", await first.get(key + ":missing") is None)
+    if first.shared:
+        expect("shared between workers", await second.get(key) == "之 — 代词")
+    await first.delete(key)
+    expect("delete", await first.get(key) is None)
+
+    await first.set(key, "short", 0.05)
+    await sleep(0.1)
+    expect("expiry", await first.get(key) is None)
+
+    lock = f"lock:{key}"
+    token = await first.acquire(lock, 5, 1)
+    expect("acquire", token is not None)
+    contender = second if first.shared else first
+
+    async def is_held() -> bool:
+        try:
+            await contender.acquire(lock, 5, 0.05)
+            return False
+        except LockTimeoutError:
+            return True
+
+    expect("lock excludes others", await is_held())
+    await contender.release(lock, "not-the-owner")
+    expect("release needs the token", await is_held())
+    assert token is not None
+    await first.release(lock, token)
+    expect("acquire after release", await contender.acquire(lock, 0.05, 1) is not None)
+    await sleep(0.1)
+    expect("lease expires", await first.acquire(lock, 5, 0.5) is not None)
+
+    # Many tasks on both "workers" increment one counter under the lock; none may be lost.
+    counter = f"counter:{key}"
+    await first.set(counter, "0", 60)
+
+    async def increment(backend: CacheBackend) -> None:
+        for _ in range(5):
+            held = await backend.acquire(f"lock:{counter}", 5, 10)
+            assert held is not None
+            value = int(await backend.get(counter) or 0)
+            await sleep(0)
+            await backend.set(counter, str(value + 1), 60)
+            await backend.release(f"lock:{counter}", held)
+
+    workers = [first, contender] * 4
+    await gather(*(increment(backend) for backend in workers))
+    expect("mutual exclusion", await first.get(counter) == str(5 * len(workers)))
+    return failures
+
+
+async def measure(backend: CacheBackend, ops: int) -> dict[str, float]:
+    """Mean milliseconds per operation, run one at a time."""
+    value = "x" * 2048  # about one zdic entry
+
+    async def timed(operation: Callable[[int], Any]) -> float:
+        started = perf_counter()
+        for i in range(ops):
+            await operation(i)
+        return (perf_counter() - started) * 1000 / ops
+
+    return {
+        "set": await timed(lambda i: backend.set(f"bench:{i}", value, 60)),
+        "get": await timed(lambda i: backend.get(f"bench:{i}")),
+        "lock": await timed(lambda i: backend.acquire(f"bench:lock:{i}", 5, 1)),
+    }
+
+
+async def main(ops: int, redis_url: str | None):
+    with TemporaryDirectory() as directory:
+        path = str(Path(directory) / "cache.db")
+        if redis_url is None:
+            standin = RespStandIn(password="bench")
+            await standin.start(STANDIN_PORT)
+            redis_url = f"redis://:bench@127.0.0.1:{STANDIN_PORT}/2"
+        backends = {
+            "memory": (memory := MemoryCacheBackend(10000), memory),
+            "sqlite": (SqliteCacheBackend(path), SqliteCacheBackend(path)),
+            "resp": (RespCacheBackend(redis_url, 8, 1.0), RespCacheBackend(redis_url, 8, 1.0)),
+        }
+        print(f"{'backend':<8} {'set':>8} {'get':>8} {'lock':>8}  checks")
+        failed = False
+        for name, (first, second) in backends.items():
+            failures = await check(name, first, second)
+            timings = await measure(first, ops)
+            failed = failed or bool(failures)
+            print(f"{name:<8} " + " ".join(f"{timings[op]:>6.3f}ms" for op in ("set", "get", "lock"))
+                  + ("  ok" if not failures else f"  FAILED: {', '.join(failures)}"))
+
+        # An unreachable server degrades to misses instead of errors.
+        down = RespCacheBackend(f"redis://127.0.0.1:{STANDIN_PORT + 1}/0", 1, 0.2)
+        await down.set("key", "value", 60)
+        print(f"unreachable resp: get -> {await down.get('key')!r}, lock -> {await down.acquire('lock', 5, 1)!r}")
+        if failed:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--redis-url", help="a real Redis-protocol server instead of the stand-in")
+    args = parser.parse_args()
+    run(main(args.ops, args.redis_url))
@@ -0,0 +1,95 @@
+"""
+Measures what stopping the thinking stream at the completed `**答案**` line saves,
+on the evaluation dataset and the real upstream model. Each completion runs to
+the end once; the point where the answer line completes is recorded on the way.
+
+    python -m bench.early_stop --samples 50 --concurrency 4 [--deep]
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, gather, Semaphore
+from time import perf_counter
+
+from bench.utils import summarize, load_dataset
+from server.config import Config
+from server.services.answer_service import AnswerLineParser
+from server.services.key_pool_service import PooledKey, api_key_pool
+
+
+async def main(samples: int, concurrency: int, deep: bool):
+    model = Config.WYW_THINKING_MODEL_DEEP if deep else Config.WYW_THINKING_MODEL
+    rows = load_dataset(samples)
+    semaphore = Semaphore(concurrency)
+    answer_latencies: list[float] = []
+    full_latencies: list[float] = []
+    tokens_full = tokens_saved = 0
+    without_answer = errors = 0
+
+    async def one(row: dict[str, str]):
+        nonlocal tokens_full, tokens_saved, without_answer, errors
+        user_prompt = f"请解释古文“{row['context']}”中，“{row['query']}”的含义。"
+
+        async def send(key: PooledKey):
+            return await key.client.chat.completions.create(
+                model=model.id,
+                messages=[
+                    {"role": "system", "content": Config.PROMPT_AI_THOUGHT},
+                    {"role": "user", "content": user_prompt},
+                ],
+                stream=True,
+                temperature=0.5,
+                stream_options={"include_usage": True},
+                extra_body={"enable_search": False, "enable_thinking": model.thinking},
+            )
+
+        async with semaphore:
+            parser = AnswerLineParser()
+            start = perf_counter()
+            answered_at: float | None = None
+            chars_at_answer = chars = 0
+            completion_tokens = 0
+            try:
+                stream = await api_key_pool.call(1000, send)
+                async for chunk in stream:
+                    if chunk.usage:
+                        completion_tokens = chunk.usage.completion_tokens
+                        continue
+                    delta = chunk.choices[0].delta
+                    content = delta.content or ""
+                    chars += len(content) + len(getattr(delta, "reasoning_content", None) or "")
+                    if content and parser.feed(content) is not None:
+                        answered_at = perf_counter() - start
+                        chars_at_answer = chars
+            except Exception:
+                errors += 1
+                return
+            full_latencies.append(perf_counter() - start)
+            tokens_full += completion_tokens
+            if answered_at is None:
+                without_answer += 1
+                return
+            answer_latencies.append(answered_at)
+            # Tokens are not reported per chunk, so split the total by characters.
+            tokens_saved += round(completion_tokens * (1 - chars_at_answer / max(chars, 1)))
+
+    start = perf_counter()
+    await gather(*(one(row) for row in rows))
+    seconds = perf_counter() - start
+
+    print(summarize("answer line complete", answer_latencies, errors, seconds))
+    print(summarize("stream complete", full_latencies, errors, seconds))
+    print(f"answer line not found: {without_answer}/{len(rows)}")
+    if tokens_full:
+        print(
+            f"completion tokens: {tokens_full}, saved by early stop: {tokens_saved} "
+            f"({tokens_saved / tokens_full:.1%})"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--deep", action="store_true")
+    args = parser.parse_args()
+    run(main(args.samples, args.concurrency, args.deep))
@@ -0,0 +1,214 @@
+"""
+Local stand-ins for the two upstreams, so load tests burn no API credits and
+never hit zdic.net:
+
+- an OpenAI-compatible `/v1/chat/completions` that streams a canned answer
+  (in the format of the prompt it gets) after `--ttft` seconds, at
+  `--tokens-per-second`, with usage in the last chunk like DashScope;
+- a zdic `/hans/{word}` serving the pages recorded in `--pages`, or a
+  synthetic page of `--page-kb` with the same structure for other words.
+
+Point the server at them with `AI_BASE_URL=http://127.0.0.1:8766/v1` and
+`ZDIC_URL=http://127.0.0.1:8767/hans/`. To record real pages once:
+
+    python -m bench.fake_upstreams --record 200 --pages bench/zdic-pages
+    python -m bench.fake_upstreams --ai-port 8766 --zdic-port 8767 --ttft 0.5 --tokens-per-second 40
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, sleep, create_task, Event, Task
+from json import dumps, loads
+from pathlib import Path
+from time import perf_counter, time
+from urllib.parse import quote
+
+from httpx import AsyncClient
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, StreamingResponse
+from starlette.routing import Route
+from uvicorn import Config as UvicornConfig, Server
+
+from bench.utils import load_words
+from server.config import Config
+
+THOUGHT = "句中说此人数年之间屡次升迁，结合汉典义项，此处应取提拔之意，且为被动用法。"
+EXPLANATION = "六年后被提拔为四川按察使，以公平宽和著称。"
+ANSWER = "提拔；被提拔"
+RAMBLE = "此外，该字在其他语境中亦可表示选拔、拔取等意思，此处不再赘述。"
+FLASH_ANSWER = "提拔，被提拔"
+
+
+def split_tokens(text: str) -> list[str]:
+    """About one token per two characters, as Qwen tokenizes Chinese."""
+    return [text[i : i + 2] for i in range(0, len(text), 2)]
+
+
+class FakeAi:
+    """Streams answers shaped like the ones each prompt asks for."""
+
+    def __init__(self, ttft: float, tokens_per_second: float):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.requests = 0
+
+    def get_answer(self, system_prompt: str, user_prompt: str, thinking: bool) -> tuple[str, str]:
+        """(reasoning, content) of the answer."""
+        if system_prompt == Config.PROMPT_FLASH:
+            return "", FLASH_ANSWER
+        if system_prompt == Config.PROMPT_FLASH_PACKED:
+            words = loads(user_prompt[user_prompt.index("[") :])
+            answers = [{"word": word, "answer": FLASH_ANSWER} for word in words]
+            return "", dumps(answers, ensure_ascii=False)
+        if thinking:
+            # DashScope streams the thought as reasoning_content, without the heading.
+            return THOUGHT, f"\n**解释**：{EXPLANATION}\n**答案**：{ANSWER}\n{RAMBLE}"
+        return "", f"**思考**：{THOUGHT}\n**解释**：{EXPLANATION}\n**答案**：{ANSWER}\n{RAMBLE}"
+
+    def chunk(self, model: str, delta: dict | None, finish: str | None = None, usage: dict | None = None) -> str:
+        choices = [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish}]
+        body = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time()),
+            "model": model,
+            "choices": choices,
+            "usage": usage,
+        }
+        return f"data: {dumps(body, ensure_ascii=False)}\n\n"
+
+    async def completions(self, request: Request):
+        self.requests += 1
+        body = await request.json()
+        messages = body["messages"]
+        system_prompt = messages[0]["content"] if messages[0]["role"] == "system" else ""
+        user_prompt = messages[-1]["content"]
+        reasoning, content = self.get_answer(system_prompt, user_prompt, bool(body.get("enable_thinking")))
+        pieces = [("reasoning_content", token) for token in split_tokens(reasoning)]
+        pieces += [("content", token) for token in split_tokens(content)]
+        usage = {
+            "prompt_tokens": (len(system_prompt) + len(user_prompt)) // 2,
+            "completion_tokens": len(pieces),
+            "total_tokens": (len(system_prompt) + len(user_prompt)) // 2 + len(pieces),
+        }
+
+        if not body.get("stream"):
+            await sleep(self.ttft + len(pieces) / self.tokens_per_second)
+            message = {"role": "assistant", "content": content}
+            if reasoning:
+                message["reasoning_content"] = reasoning
+            return JSONResponse(
+                {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time()),
+                    "model": body["model"],
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                    "usage": usage,
+                }
+            )
+
+        async def stream():
+            started = perf_counter()
+            for i, (field, token) in enumerate(pieces):
+                # A fixed schedule, so slow reads on our side do not slow the "model" down.
+                delay = started + self.ttft + i / self.tokens_per_second - perf_counter()
+                if delay > 0:
+                    await sleep(delay)
+                finish = "stop" if i == len(pieces) - 1 else None
+                yield self.chunk(body["model"], {"role": "assistant", field: token}, finish)
+            if body.get("stream_options", {}).get("include_usage"):
+                yield self.chunk(body["model"], None, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    def build_app(self) -> Starlette:
+        return Starlette(routes=[Route("/v1/chat/completions", self.completions, methods=["POST"])])
+
+
+def make_zdic_page(word: str, size_kb: int) -> str:
+    """A page with the structure `parse_zdic_html` reads, padded to about the size of a real one."""
+    basic = "".join(f"<li>{word}的第{i + 1}个基本义项。</li>" for i in range(6))
+    detailed = "".join(f"<p>{word}的第{i + 1}个详细义项，附有例句。</p>" for i in range(20))
+    phrase = "".join(f"<p>{word}{i}：词语解释。</p>" for i in range(4))
+    padding = '<div class="nav"><a href="/hans/">汉典</a><span>导航</span></div>\n'
+    body = (
+        f'<div class="zdict"><div class="content definitions jnr"><ol>{basic}</ol></div></div>'
+        f'<div id="xxjs"><div class="content definitions xnr">{detailed}</div></div>'
+        f'<div class="nr-box"><div class="content definitions"><div class="jnr">{phrase}</div></div></div>'
+    )
+    filler = padding * max(0, (size_kb * 1024 - len(body.encode())) // len(padding.encode()))
+    return f"<html><head><title>{word}</title></head><body>{filler}{body}</body></html>"
+
+
+class FakeZdic:
+    def __init__(self, pages: Path | None, latency: float, page_kb: int):
+        self.pages = pages
+        self.latency = latency
+        self.page_kb = page_kb
+        self.requests = 0
+
+    async def lookup(self, request: Request):
+        self.requests += 1
+        word = request.path_params["word"]
+        await sleep(self.latency)
+        if self.pages is not None:
+            path = self.pages / f"{word}.html"
+            if path.is_file():
+                return HTMLResponse(path.read_text(encoding="utf-8"))
+        return HTMLResponse(make_zdic_page(word, self.page_kb))
+
+    def build_app(self) -> Starlette:
+        return Starlette(routes=[Route("/hans/{word}", self.lookup)])
+
+
+async def record_zdic_pages(words: list[str], directory: Path) -> None:
+    """Saves the real zdic.net page of each word, once, for the fake to replay."""
+    directory.mkdir(parents=True, exist_ok=True)
+    async with AsyncClient(timeout=10) as client:
+        for word in words:
+            path = directory / f"{word}.html"
+            if path.exists():
+                continue
+            response = await client.get("https://www.zdic.net/hans/" + quote(word))
+            if response.status_code == 200:
+                path.write_text(response.text, encoding="utf-8")
+            print(f"{word}: {response.status_code}")
+            await sleep(1.0)  # be polite
+
+
+async def serve(app: Starlette, port: int) -> tuple[Server, Task[None]]:
+    server = Server(UvicornConfig(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await sleep(0.01)
+    return server, task
+
+
+async def main(ai_port: int, zdic_port: int, ttft: float, tokens_per_second: float,
+               pages: Path | None, latency: float, page_kb: int):
+    await serve(FakeAi(ttft, tokens_per_second).build_app(), ai_port)
+    await serve(FakeZdic(pages, latency, page_kb).build_app(), zdic_port)
+    print(f"AI_BASE_URL=http://127.0.0.1:{ai_port}/v1 ZDIC_URL=http://127.0.0.1:{zdic_port}/hans/")
+    await Event().wait()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--ai-port", type=int, default=8766)
+    parser.add_argument("--zdic-port", type=int, default=8767)
+    parser.add_argument("--ttft", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--pages", type=Path)
+    parser.add_argument("--zdic-latency", type=float, default=0.15)
+    parser.add_argument("--page-kb", type=int, default=80)
+    parser.add_argument("--record", type=int, metavar="WORDS", help="record this many real pages and exit")
+    args = parser.parse_args()
+    if args.record:
+        run(record_zdic_pages(load_words(args.record), args.pages or Path("bench/zdic-pages")))
+    else:
+        run(main(args.ai_port, args.zdic_port, args.ttft, args.tokens_per_second,
+                 args.pages, args.zdic_latency, args.page_kb))
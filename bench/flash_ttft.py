@@ -0,0 +1,76 @@
+"""
+Compares time-to-first-token of the streaming `/api/query/flash` with the
+time-to-full-answer of the single-chunk mode, against a running server and the
+real upstream model. Every request is billed to the given account.
+
+    python -m bench.flash_ttft --url http://localhost:4122 --token <pocketbase token> --samples 30
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, gather, Semaphore
+from json import loads
+from time import perf_counter
+
+from httpx import AsyncClient
+
+from bench.utils import summarize, load_dataset
+
+
+async def measure(client: AsyncClient, rows: list[dict[str, str]], stream: int, concurrency: int):
+    semaphore = Semaphore(concurrency)
+    first_tokens: list[float] = []
+    totals: list[float] = []
+    errors = 0
+
+    async def one(row: dict[str, str]):
+        nonlocal errors
+        async with semaphore:
+            start = perf_counter()
+            first = None
+            try:
+                async with client.stream(
+                    "GET",
+                    "/api/query/flash",
+                    params={"q": row["query"], "context": row["context"], "stream": stream},
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if first is None and line and loads(line)["type"] == "ai-flash":
+                            first = perf_counter() - start
+            except Exception:
+                errors += 1
+                return
+            if first is None:
+                errors += 1
+                return
+            first_tokens.append(first)
+            totals.append(perf_counter() - start)
+
+    start = perf_counter()
+    await gather(*(one(row) for row in rows))
+    seconds = perf_counter() - start
+    name = "stream" if stream else "single"
+    return (
+        summarize(f"{name} first token", first_tokens, errors, seconds),
+        summarize(f"{name} full answer", totals, errors, seconds),
+    )
+
+
+async def main(url: str, token: str, samples: int, concurrency: int):
+    rows = load_dataset(samples)
+    async with AsyncClient(
+        base_url=url, headers={"Authorization": f"Bearer {token}"}, timeout=60
+    ) as client:
+        for stream in (0, 1):
+            for summary in await measure(client, rows, stream, concurrency):
+                print(summary)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:4122")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--samples", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    run(main(args.url, args.token, args.samples, args.concurrency))
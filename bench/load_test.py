@@ -0,0 +1,311 @@
+"""
+End-to-end load test of `/api/query/flash`, `/api/query/thinking`, `/api/zdic`
+and `/api/query/freq-info` against a server wired to local stand-ins only: the
+fake model and zdic of `bench.fake_upstreams` and a throwaway PocketBase from
+`db/pb_migrations` (see `bench.local_pocketbase`), started on a free port and
+removed afterwards. Nothing is billed upstream. `--pocketbase-url` (with
+POCKETBASE_EMAIL and POCKETBASE_PASSWORD set) uses a running instance instead.
+
+Each endpoint is driven closed-loop by `--concurrency` workers for `--seconds`,
+spread over as many bench users (admins, so balances and rate limits do not
+interfere). It reports RPS, latency percentiles, time to first byte and error
+rates; `--save` writes them as JSON and `--compare` diffs a run against such a
+baseline, exiting 1 when something regressed past `--tolerance`.
+
+    python -m bench.load_test --pocketbase-bin ~/bin/pocketbase --seconds 30 \
+        --concurrency 16 --save bench/baselines/main.json --compare bench/baselines/main.json
+
+The first run against a fresh PocketBase waits for the server to upload the
+corpus; pass `--pocketbase-dir` to keep the data for the next runs.
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, sleep, gather, create_subprocess_exec
+from asyncio.subprocess import Process
+from collections import Counter
+from datetime import datetime, timezone
+from os import environ
+from pathlib import Path
+from random import Random
+from subprocess import run as run_process
+from sys import executable, exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable
+
+from httpx import AsyncClient, HTTPError
+from pydantic import BaseModel
+
+from bench.fake_upstreams import FakeAi, FakeZdic, serve
+from bench.local_pocketbase import LocalPocketBase
+from bench.utils import LatencySummary, load_dataset, percentile, summarize
+
+ENDPOINTS: dict[str, tuple[str, Callable[[dict[str, str]], dict[str, Any]]]] = {
+    "flash": ("/api/query/flash", lambda row: {"q": row["query"], "context": row["context"], "stream": 1}),
+    "thinking": ("/api/query/thinking", lambda row: {"q": row["query"], "context": row["context"], "deep": 1}),
+    "zdic": ("/api/zdic", lambda row: {"q": row["query"]}),
+    "freq": ("/api/query/freq-info", lambda row: {"q": row["query"]}),
+}
+USER_PASSWORD = "bench-user-password"
+
+
+class EndpointResult(BaseModel):
+    summary: LatencySummary
+    error_rate: float
+    first_byte_p50_ms: float
+    first_byte_p95_ms: float
+    statuses: dict[str, int]
+
+
+class LoadBaseline(BaseModel):
+    created: str
+    commit: str | None
+    settings: dict[str, Any]
+    results: dict[str, EndpointResult]
+
+
+async def create_users(count: int) -> list[str]:
+    """Tokens of `count` admin users, created through PocketBase as superuser."""
+    from server.config import Roles
+    from server.services.pocketbase_service import PocketBaseService
+
+    superuser = PocketBaseService()
+    if not await superuser.auth_superuser():
+        raise RuntimeError("PocketBase superuser login failed")
+    await superuser.init_roles()
+
+    async def create(index: int) -> str:
+        email = f"bench-{index}@example.com"
+        pb = PocketBaseService()
+        await pb.auth_superuser()
+        result = await pb.auth_register(email, USER_PASSWORD, Roles.ADMIN)
+        if result is None:  # created by an earlier run on the same data
+            result = await PocketBaseService().auth_login(email, USER_PASSWORD)
+        return result.token
+
+    return list(await gather(*(create(i) for i in range(count))))
+
+
+async def start_server(port: int, env: dict[str, str], timeout: float) -> Process:
+    process = await create_subprocess_exec(
+        executable, "-m", "uvicorn", "server.main:app",
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        env={**environ, **env},
+    )
+    async with AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+        for _ in range(int(timeout / 0.2)):
+            if process.returncode is not None:
+                raise RuntimeError("server exited during startup")
+            try:
+                # Any answer will do; the status pages are admin-only.
+                await client.get("/api/status/upstream")
+                return process
+            except HTTPError:
+                pass
+            await sleep(0.2)
+    process.terminate()
+    raise TimeoutError("server did not start")
+
+
+async def wait_for_corpus(client: AsyncClient, token: str, word: str, timeout: float) -> None:
+    """The server uploads the corpus in the background on a fresh PocketBase."""
+    started = perf_counter()
+    while perf_counter() - started < timeout:
+        response = await client.get(
+            "/api/query/freq-info", params={"q": word}, headers={"Authorization": f"Bearer {token}"}
+        )
+        if response.status_code == 200:
+            return
+        print(f"waiting for the corpus upload ({perf_counter() - started:.0f}s)")
+        await sleep(5.0)
+    raise TimeoutError("corpus not ready")
+
+
+async def drive(
+    client: AsyncClient,
+    name: str,
+    rows: list[dict[str, str]],
+    tokens: list[str],
+    concurrency: int,
+    seconds: float,
+) -> EndpointResult:
+    path, get_params = ENDPOINTS[name]
+    latencies: list[float] = []
+    first_bytes: list[float] = []
+    statuses: Counter[str] = Counter()
+    errors = 0
+
+    async def worker(index: int):
+        nonlocal errors
+        rng = Random(index)
+        headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"}
+        while perf_counter() < deadline:
+            row = rng.choice(rows)
+            start = perf_counter()
+            first = None
+            failed = False
+            try:
+                async with client.stream("GET", path, params=get_params(row), headers=headers) as response:
+                    statuses[str(response.status_code)] += 1
+                    failed = response.status_code >= 400
+                    async for line in response.aiter_lines():
+                        if first is None:
+                            first = perf_counter() - start
+                        # Streams report upstream failures as an error event under a 200.
+                        failed = failed or line.startswith('{"type":"error"')
+            except HTTPError as e:
+                statuses[type(e).__name__] += 1
+                failed = True
+            if failed:
+                errors += 1
+                continue
+            latencies.append(perf_counter() - start)
+            if first is not None:
+                first_bytes.append(first)
+
+    started = perf_counter()
+    deadline = started + seconds
+    await gather(*(worker(i) for i in range(concurrency)))
+    summary = summarize(name, latencies, errors, perf_counter() - started)
+    return EndpointResult(
+        summary=summary,
+        error_rate=errors / summary.requests if summary.requests else 0.0,
+        first_byte_p50_ms=percentile(first_bytes, 0.50) * 1000,
+        first_byte_p95_ms=percentile(first_bytes, 0.95) * 1000,
+        statuses=dict(statuses),
+    )
+
+
+def compare(baseline: LoadBaseline, current: LoadBaseline, tolerance: float) -> bool:
+    """Prints the changes per endpoint; returns whether anything regressed past `tolerance`."""
+    regressed = False
+    for name, result in current.results.items():
+        before = baseline.results.get(name)
+        if before is None:
+            continue
+        changes: list[str] = []
+        for field, higher_is_better in (("rps", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False)):
+            old = getattr(before.summary, field)
+            new = getattr(result.summary, field)
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = " !" if worse > tolerance else ""
+            regressed = regressed or bool(flag)
+            changes.append(f"{field} {old:.1f}->{new:.1f} ({change:+.0%}){flag}")
+        error_flag = " !" if result.error_rate > before.error_rate + 0.01 else ""
+        regressed = regressed or bool(error_flag)
+        changes.append(f"errors {before.error_rate:.1%}->{result.error_rate:.1%}{error_flag}")
+        print(f"  {name:<9} " + "  ".join(changes))
+    return regressed
+
+
+def get_commit() -> str | None:
+    result = run_process(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+async def run_endpoints(args, pb_env: dict[str, str], sqlite_path: str, directory: Path) -> dict[str, EndpointResult]:
+    server = await start_server(
+        args.port,
+        {
+            **pb_env,
+            "AI_BASE_URL": f"http://127.0.0.1:{args.ai_port}/v1",
+            "ZDIC_URL": f"http://127.0.0.1:{args.zdic_port}/hans/",
+            # Explicit, so keys and paths from a local .env never leak into the run.
+            "API_KEY": "bench",
+            "API_KEYS": "bench",
+            "PB_SQLITE_PATH": sqlite_path,
+            "LOG_PATH": str(directory / "server.log"),
+        },
+        args.startup_timeout,
+    )
+    try:
+        rows = load_dataset(args.rows)
+        tokens = await create_users(args.users or args.concurrency)
+        async with AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=120) as client:
+            await wait_for_corpus(client, tokens[0], rows[0]["query"], args.startup_timeout)
+            results: dict[str, EndpointResult] = {}
+            for name in args.endpoints:
+                results[name] = await drive(client, name, rows, tokens, args.concurrency, args.seconds)
+                print(f"{results[name].summary}  ttfb p50={results[name].first_byte_p50_ms:.1f}ms  "
+                      f"statuses={results[name].statuses}")
+        return results
+    finally:
+        server.terminate()
+        await server.wait()
+
+
+async def main(args) -> bool:
+    fake_ai = FakeAi(args.ttft, args.tokens_per_second)
+    fake_zdic = FakeZdic(args.zdic_pages, args.zdic_latency, args.page_kb)
+    await serve(fake_ai.build_app(), args.ai_port)
+    await serve(fake_zdic.build_app(), args.zdic_port)
+
+    with TemporaryDirectory(prefix="load-test-") as directory:
+        if args.pocketbase_url is None:
+            pocketbase = LocalPocketBase(args.pocketbase_bin, args.pocketbase_port, args.pocketbase_dir)
+            await pocketbase.start()
+            pb_env = pocketbase.get_env()
+        else:
+            pocketbase = None
+            pb_env = {
+                "POCKETBASE_URL": args.pocketbase_url,
+                "POCKETBASE_EMAIL": environ["POCKETBASE_EMAIL"],
+                "POCKETBASE_PASSWORD": environ["POCKETBASE_PASSWORD"],
+            }
+        try:
+            environ.update(pb_env)
+            sqlite_path = str(pocketbase.data_dir / "data.db") if args.sqlite and pocketbase else ""
+            results = await run_endpoints(args, pb_env, sqlite_path, Path(directory))
+        finally:
+            if pocketbase is not None:
+                await pocketbase.stop()
+
+    print(f"upstream calls: model {fake_ai.requests}, zdic {fake_zdic.requests}")
+    current = LoadBaseline(
+        created=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        commit=get_commit(),
+        settings={
+            key: value for key, value in vars(args).items()
+            if key in ("seconds", "concurrency", "users", "ttft", "tokens_per_second", "zdic_latency", "page_kb", "sqlite")
+        },
+        results=results,
+    )
+
+    regressed = False
+    if args.compare is not None and args.compare.exists():
+        baseline = LoadBaseline.model_validate_json(args.compare.read_text(encoding="utf-8"))
+        print(f"against {args.compare} ({baseline.commit}, {baseline.created}):")
+        regressed = compare(baseline, current, args.tolerance)
+    if args.save is not None:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(current.model_dump_json(indent=2), encoding="utf-8")
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, help="defaults to --concurrency")
+    parser.add_argument("--rows", type=int, default=500, help="dataset rows to draw queries from")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--ai-port", type=int, default=8766)
+    parser.add_argument("--zdic-port", type=int, default=8767)
+    parser.add_argument("--ttft", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--zdic-pages", type=Path)
+    parser.add_argument("--zdic-latency", type=float, default=0.15)
+    parser.add_argument("--page-kb", type=int, default=80)
+    parser.add_argument("--pocketbase-bin", default=environ.get("POCKETBASE_BIN", "pocketbase"))
+    parser.add_argument("--pocketbase-port", type=int, help="defaults to a free port")
+    parser.add_argument("--pocketbase-dir", type=Path)
+    parser.add_argument("--pocketbase-url", help="use this PocketBase (POCKETBASE_EMAIL/PASSWORD) instead")
+    parser.add_argument("--sqlite", action="store_true", help="enable the PB_SQLITE_PATH read path")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--save", type=Path)
+    parser.add_argument("--compare", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+    exit(1 if run(main(args)) else 0)
@@ -0,0 +1,134 @@
+"""
+Runs a throwaway PocketBase with the collections of `db/pb_migrations`, for load
+tests that must not touch a real database. Needs the PocketBase binary (the
+version of `Dockerfile.pocketbase`), given as `--bin` or `POCKETBASE_BIN`:
+
+    python -m bench.local_pocketbase --bin ~/bin/pocketbase
+
+It applies the migrations to a fresh `--dir`, creates a superuser, serves on a
+free port (or `--port`) and prints the environment the server needs to reach it.
+Without `--dir` the data lives in a temporary directory and is gone afterwards;
+keep one to skip the corpus upload on the next run.
+"""
+
+from argparse import ArgumentParser
+from asyncio import Event, create_subprocess_exec, run, sleep, wait_for
+from asyncio import TimeoutError as AsyncTimeoutError
+from asyncio.subprocess import DEVNULL, PIPE, STDOUT, Process
+from os import environ
+from pathlib import Path
+from shutil import rmtree
+from socket import socket
+from tempfile import mkdtemp
+
+from httpx import AsyncClient, HTTPError
+
+MIGRATIONS = Path(__file__).resolve().parent.parent / "db" / "pb_migrations"
+
+
+def get_free_port() -> int:
+    with socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class LocalPocketBase:
+    def __init__(
+        self,
+        binary: str,
+        port: int | None = None,
+        directory: Path | None = None,
+        email: str = "bench@example.com",
+        password: str = "bench-password-1234",
+    ):
+        self.binary = binary
+        self.port = port or get_free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.email = email
+        self.password = password
+        self._temporary = directory is None
+        self.directory = directory or Path(mkdtemp(prefix="pb-bench-"))
+        self._process: Process | None = None
+
+    @property
+    def data_dir(self) -> Path:
+        return self.directory / "pb_data"
+
+    def get_env(self) -> dict[str, str]:
+        """What `PocketBaseService` needs to reach this instance as superuser."""
+        return {
+            "POCKETBASE_URL": self.url,
+            "POCKETBASE_EMAIL": self.email,
+            "POCKETBASE_PASSWORD": self.password,
+        }
+
+    async def _run(self, *args: str) -> None:
+        process = await create_subprocess_exec(self.binary, *args, stdout=PIPE, stderr=STDOUT)
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"pocketbase {' '.join(args[:2])} failed:\n{output.decode(errors='replace')}")
+
+    async def start(self, timeout: float = 30.0) -> None:
+        """Migrates, creates the superuser and serves; stops again if any step fails."""
+        data = f"--dir={self.data_dir}"
+        migrations = f"--migrationsDir={MIGRATIONS}"
+        try:
+            await self._run("migrate", "up", data, migrations)
+            # Creates the superuser, or resets its password in a kept `--dir`.
+            await self._run("superuser", "upsert", self.email, self.password, data)
+            self._process = await create_subprocess_exec(
+                self.binary, "serve", f"--http=127.0.0.1:{self.port}", data, migrations,
+                stdout=DEVNULL,
+            )
+            await self._wait_healthy(timeout)
+        except BaseException:
+            await self.stop()
+            raise
+
+    async def _wait_healthy(self, timeout: float) -> None:
+        assert self._process is not None
+        async with AsyncClient(base_url=self.url) as client:
+            for _ in range(int(timeout / 0.1)):
+                if self._process.returncode is not None:
+                    raise RuntimeError(f"pocketbase exited during startup ({self._process.returncode})")
+                try:
+                    if (await client.get("/api/health")).status_code == 200:
+                        return
+                except HTTPError:
+                    pass
+                await sleep(0.1)
+        raise TimeoutError("pocketbase did not become healthy")
+
+    async def stop(self) -> None:
+        process, self._process = self._process, None
+        if process is not None and process.returncode is None:
+            process.terminate()
+            try:
+                await wait_for(process.wait(), 10)
+            except AsyncTimeoutError:
+                process.kill()
+                await process.wait()
+        if self._temporary:
+            rmtree(self.directory, ignore_errors=True)
+
+    async def __aenter__(self) -> "LocalPocketBase":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+
+async def main(binary: str, port: int | None, directory: Path | None):
+    async with LocalPocketBase(binary, port, directory) as pocketbase:
+        print(" ".join(f"{key}={value}" for key, value in pocketbase.get_env().items()))
+        await Event().wait()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--bin", default=environ.get("POCKETBASE_BIN", "pocketbase"))
+    parser.add_argument("--port", type=int, help="defaults to a free port")
+    parser.add_argument("--dir", type=Path)
+    args = parser.parse_args()
+    run(main(args.bin, args.port, args.dir))
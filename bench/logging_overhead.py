@@ -0,0 +1,135 @@
+"""
+Measures how long logging blocks the event loop under load: the previous
+synchronous setup (StreamHandler + FileHandler, written from the loop) against
+the queue hand-off of `logging_service`, with and without category sampling.
+Each run has `--workers` coroutines logging a request line per simulated request,
+while a probe measures how late the loop wakes a 1 ms sleeper. `--write-latency`
+makes every write to the sinks take that long, like a slow disk or a full stderr pipe.
+
+    python -m bench.logging_overhead --workers 50 --lines 400 --write-latency 0.0002
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, gather, sleep
+from logging import Formatter, Handler, Logger, StreamHandler, getLogger, INFO
+from logging.handlers import QueueListener
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep as block
+from typing import TextIO
+
+from bench.utils import percentile
+from server.services.logging_service import JsonFormatter, attach_queue, request_id
+
+
+class SlowStream:
+    """A file whose writes block for `latency` seconds."""
+
+    def __init__(self, file: TextIO, latency: float):
+        self.file = file
+        self.latency = latency
+
+    def write(self, text: str) -> int:
+        if self.latency > 0:
+            block(self.latency)
+        return self.file.write(text)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def slow_handler(path: Path, latency: float) -> StreamHandler:
+    return StreamHandler(SlowStream(open(path, "w", encoding="utf-8"), latency))  # type: ignore
+
+
+def sync_logger(directory: Path, latency: float) -> tuple[Logger, list[Handler]]:
+    logger = getLogger("bench.sync")
+    formatter = Formatter("%(levelname)s [main] %(module)s:%(lineno)d | %(message)s")
+    handlers: list[Handler] = [
+        slow_handler(directory / "console-sync.log", latency),
+        slow_handler(directory / "sync.log", latency),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger, handlers
+
+
+def queue_logger(directory: Path, name: str, latency: float) -> tuple[Logger, QueueListener]:
+    logger = getLogger(f"bench.{name}")
+    console = slow_handler(directory / f"console-{name}.log", latency)
+    console.setFormatter(Formatter("%(levelname)s [main] %(module)s:%(lineno)d %(request_id)s | %(message)s"))
+    file = slow_handler(directory / f"{name}.log", latency)
+    file.setFormatter(JsonFormatter())
+    return logger, attach_queue(logger, console, file)
+
+
+async def measure(name: str, logger: Logger, workers: int, lines: int, category: str | None):
+    logger.setLevel(INFO)
+    logger.propagate = False
+    call_times: list[float] = []
+    lags: list[float] = []
+    done = False
+
+    async def probe():
+        while not done:
+            start = perf_counter()
+            await sleep(0.001)
+            lags.append(perf_counter() - start - 0.001)
+
+    async def worker(index: int):
+        for line in range(lines):
+            request_id.set(f"{index:04x}{line:04x}")
+            start = perf_counter()
+            logger.info(
+                f"Request from 10.0.{index}.{line % 256}",
+                extra=None if category is None else {"category": category},
+            )
+            call_times.append(perf_counter() - start)
+            await sleep(0)
+
+    async def workload():
+        nonlocal done
+        await gather(*(worker(i) for i in range(workers)))
+        done = True
+
+    start = perf_counter()
+    await gather(probe(), workload())
+    seconds = perf_counter() - start
+
+    print(
+        f"{name:<18} lines={len(call_times):<7} on-loop total={sum(call_times) * 1000:>8.1f}ms "
+        f"call p50={percentile(call_times, 0.5) * 1e6:>6.1f}us p99={percentile(call_times, 0.99) * 1e6:>7.1f}us "
+        f"lag p99={percentile(lags, 0.99) * 1000:>6.2f}ms max={max(lags, default=0) * 1000:>6.2f}ms "
+        f"wall={seconds:.2f}s"
+    )
+
+
+async def main(workers: int, lines: int, latency: float):
+    with TemporaryDirectory() as directory:
+        path = Path(directory)
+
+        logger, handlers = sync_logger(path, latency)
+        await measure("sync handlers", logger, workers, lines, None)
+        for handler in handlers:
+            handler.close()
+
+        logger, listener = queue_logger(path, "queue", latency)
+        await measure("queue", logger, workers, lines, None)
+        listener.stop()
+
+        logger, listener = queue_logger(path, "queue-sampled", latency)
+        await measure("queue + sampling", logger, workers, lines, "request")
+        listener.stop()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=400)
+    parser.add_argument("--write-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    run(main(args.workers, args.lines, args.write_latency))
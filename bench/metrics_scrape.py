@@ -0,0 +1,147 @@
+"""
+Scrapes `/metrics` and checks it is valid Prometheus text exposition: every sample
+belongs to a declared family, label sets parse, histogram buckets are cumulative
+and end in `+Inf` equal to `_count`. Against a running server:
+
+    python -m bench.metrics_scrape --url http://127.0.0.1:8000/metrics [--token ...]
+
+Without `--url`, the collectors are driven in-process (PocketBase calls through a
+mock transport, zdic lookups, LLM timings) and the cost of recording is measured.
+"""
+
+from argparse import ArgumentParser
+from asyncio import run
+from os import environ
+from re import compile
+from time import perf_counter
+
+from httpx import AsyncClient, MockTransport, Request, Response
+
+environ.setdefault("POCKETBASE_URL", "http://127.0.0.1:4123")
+
+from server.services.metrics_service import (  # noqa: E402
+    metrics_registry,
+    pocketbase_request_seconds,
+    zdic_lookups_total,
+    llm_first_token_seconds,
+)
+from server.services.pocketbase_service import PocketBaseService  # noqa: E402
+
+SAMPLE = compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+LABEL = compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def check_exposition(text: str) -> tuple[int, int]:
+    """Raises ValueError on the first problem; returns (families, samples)."""
+    types: dict[str, str] = {}
+    buckets: dict[tuple[str, tuple[tuple[str, str], ...]], list[tuple[float, float]]] = {}
+    counts: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+    samples = 0
+
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line:
+            continue
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ", 3)
+            if name in types:
+                raise ValueError(f"line {number}: {name} declared twice")
+            types[name] = kind
+            continue
+        if line.startswith("#"):
+            continue
+
+        match = SAMPLE.match(line)
+        if match is None:
+            raise ValueError(f"line {number}: not a sample: {line!r}")
+        name, label_text, value_text = match.groups()
+        value = float(value_text)
+        labels = LABEL.findall(label_text or "")
+        samples += 1
+
+        family = name
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and types.get(name[: -len(suffix)]) == "histogram":
+                family = name[: -len(suffix)]
+        if family not in types:
+            raise ValueError(f"line {number}: {name} has no TYPE")
+        if types[family] == "counter" and value < 0:
+            raise ValueError(f"line {number}: negative counter")
+
+        if family != name:
+            series = tuple(sorted((key, label) for key, label in labels if key != "le"))
+            if name.endswith("_bucket"):
+                le = dict(labels).get("le")
+                if le is None:
+                    raise ValueError(f"line {number}: bucket without le")
+                buckets.setdefault((family, series), []).append((float(le), value))
+            elif name.endswith("_count"):
+                counts[(family, series)] = value
+
+    for key, series_buckets in buckets.items():
+        bounds = [bound for bound, _ in series_buckets]
+        values = [value for _, value in series_buckets]
+        if bounds != sorted(bounds) or bounds[-1] != float("inf"):
+            raise ValueError(f"{key}: buckets out of order or missing +Inf")
+        if values != sorted(values):
+            raise ValueError(f"{key}: buckets not cumulative")
+        if counts.get(key) != values[-1]:
+            raise ValueError(f"{key}: +Inf bucket differs from _count")
+    return len(types), samples
+
+
+async def drive_collectors() -> None:
+    def pocketbase(request: Request) -> Response:
+        if request.url.path.endswith("/records"):
+            return Response(200, json={"page": 1, "perPage": 1, "totalItems": 0, "totalPages": 0, "items": []})
+        return Response(404, json={"message": "Not found"})
+
+    pb = PocketBaseService()
+    pb.pb._inners.client = AsyncClient(base_url=pb.pocketbase_url or "", transport=MockTransport(pocketbase))
+    for word in ("之", "其", 'quote"d\nword'):
+        await pb.zdc_search(word)
+        zdic_lookups_total.inc("miss")
+    llm_first_token_seconds.observe(0.42, "qwen-plus-latest")
+
+
+def measure_overhead(iterations: int) -> None:
+    start = perf_counter()
+    for i in range(iterations):
+        pocketbase_request_seconds.observe(0.003, "users", "view", "200")
+    observe = (perf_counter() - start) / iterations
+    start = perf_counter()
+    for i in range(iterations):
+        zdic_lookups_total.inc("hit")
+    inc = (perf_counter() - start) / iterations
+    start = perf_counter()
+    text = metrics_registry.render()
+    render = perf_counter() - start
+    print(f"histogram observe {observe * 1e9:.0f}ns, counter inc {inc * 1e9:.0f}ns, "
+          f"render {render * 1000:.2f}ms for {len(text)} bytes")
+
+
+async def main(url: str | None, token: str | None, iterations: int):
+    if url is None:
+        await drive_collectors()
+        measure_overhead(iterations)
+        text = metrics_registry.render()
+    else:
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        async with AsyncClient() as client:
+            response = await client.get(url, headers=headers)
+        response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "")
+        if not content_type.startswith("text/plain") or "version=0.0.4" not in content_type:
+            raise ValueError(f"unexpected Content-Type {content_type!r}")
+        text = response.text
+
+    families, samples = check_exposition(text)
+    print(f"ok: {families} metric families, {samples} samples")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--url")
+    parser.add_argument("--token")
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+    run(main(args.url, args.token, args.iterations))
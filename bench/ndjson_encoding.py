@@ -0,0 +1,88 @@
+"""
+Measures the cost of streaming an answer as NDJSON events, offline: CPU per stream
+for `model_dump_json` vs the prefixed delta encoding, events and bytes with and without
+delta coalescing (`Config.STREAM_COALESCE_*`), and the bytes on the wire when gzipped
+with a sync flush per chunk as `CancellableStreamingResponse` does.
+
+    python -m bench.ndjson_encoding --tokens 400 --streams 200 --token-interval 0.005
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, sleep
+from random import Random
+from time import process_time
+from typing import AsyncIterator
+from zlib import compressobj, Z_SYNC_FLUSH
+
+from server.config import Config
+from server.models import ServerResponseAi, ServerResponseItem, ServerResponseType
+from server.services.streaming_service import coalesce_deltas
+
+WORDS = ["拔擢", "提拔", "之", "，", "意思是", "被", "。", "**答案**：", "此处", "句中", "\n", "亦"]
+
+
+def make_deltas(tokens: int, seed: int = 0) -> list[ServerResponseAi]:
+    rng = Random(seed)
+    deltas = [
+        ServerResponseAi.create_delta(ServerResponseType.AiThinking, rng.choice(WORDS), False)
+        for _ in range(tokens - 1)
+    ]
+    deltas.append(ServerResponseAi.create_delta(ServerResponseType.AiThinking, "", True))
+    return deltas
+
+
+def encode_cpu(events: list[ServerResponseItem], streams: int, generic: bool) -> float:
+    """CPU seconds per stream to encode its events."""
+    start = process_time()
+    for _ in range(streams):
+        if generic:
+            "".join(ServerResponseItem.to_jsonl_str(event) for event in events)
+        else:
+            "".join(event.to_jsonl_str() for event in events)
+    return (process_time() - start) / streams
+
+
+async def paced(deltas: list[ServerResponseAi], token_interval: float) -> AsyncIterator[ServerResponseAi]:
+    for delta in deltas:
+        await sleep(token_interval)
+        yield delta
+
+
+async def collect(
+    deltas: list[ServerResponseAi], token_interval: float, coalesce: bool
+) -> list[ServerResponseAi]:
+    items: AsyncIterator[ServerResponseAi] = paced(deltas, token_interval)
+    if coalesce:
+        items = coalesce_deltas(items, Config.STREAM_COALESCE_INTERVAL, Config.STREAM_COALESCE_BYTES)
+    return [item async for item in items]
+
+
+def gzipped_size(chunks: list[bytes]) -> int:
+    compressor = compressobj(Config.STREAM_GZIP_LEVEL, wbits=31)
+    size = sum(len(compressor.compress(chunk) + compressor.flush(Z_SYNC_FLUSH)) for chunk in chunks)
+    return size + len(compressor.flush())
+
+
+async def main(tokens: int, streams: int, token_interval: float):
+    deltas = make_deltas(tokens)
+    print(f"{tokens} deltas, one every {token_interval * 1000:.1f}ms; coalescing "
+          f"{Config.STREAM_COALESCE_BYTES} bytes / {Config.STREAM_COALESCE_INTERVAL * 1000:.0f}ms")
+    for coalesce in (False, True):
+        events = await collect(deltas, token_interval, coalesce)
+        chunks = [event.to_jsonl_str().encode() for event in events]
+        generic = encode_cpu(events, streams, generic=True)
+        prefixed = encode_cpu(events, streams, generic=False)
+        print(
+            f"  {'coalesced' if coalesce else 'per delta':<10} events={len(events):<5} "
+            f"bytes={sum(len(chunk) for chunk in chunks):<7} gzip={gzipped_size(chunks):<7} "
+            f"CPU/stream: model_dump_json {generic * 1000:.3f}ms, prefixed {prefixed * 1000:.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--token-interval", type=float, default=0.005)
+    args = parser.parse_args()
+    run(main(args.tokens, args.streams, args.token_interval))
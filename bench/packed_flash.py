@@ -0,0 +1,114 @@
+"""
+Compares asking several words of one context in a single packed flash completion
+(`Config.PROMPT_FLASH_PACKED`) with one flash completion per word, on the contexts
+of the evaluation dataset that have several queries, against the real upstream.
+
+    python -m bench.packed_flash --contexts 20 --min-words 2 --concurrency 4
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, gather, Semaphore
+from json import dumps
+from time import perf_counter
+
+from openai.types.chat import ChatCompletion
+
+from bench.utils import summarize, load_dataset
+from server.config import Config
+from server.services.answer_service import parse_packed_answers
+from server.services.key_pool_service import PooledKey, api_key_pool
+
+
+async def complete(system_prompt: str, user_prompt: str, max_tokens: int) -> ChatCompletion:
+    async def send(key: PooledKey):
+        return await key.client.chat.completions.create(
+            model=Config.WYW_FLASH_MODEL.id,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.3,
+            top_p=0.95,
+            max_tokens=max_tokens,
+            extra_body={"enable_thinking": False},
+        )
+
+    return await api_key_pool.call(max_tokens, send)
+
+
+async def main(contexts: int, min_words: int, concurrency: int):
+    groups: dict[str, list[str]] = {}
+    for row in load_dataset(10**6):
+        words = groups.setdefault(row["context"], [])
+        if row["query"] not in words:
+            words.append(row["query"])
+    packs = [
+        (context, words[: Config.FLASH_PACK_SIZE])
+        for context, words in groups.items()
+        if len(words) >= min_words
+    ][:contexts]
+
+    semaphore = Semaphore(concurrency)
+    packed_latencies: list[float] = []
+    separate_latencies: list[float] = []
+    packed_prompt = packed_completion = separate_prompt = separate_completion = 0
+    words_total = words_parsed = errors = 0
+
+    async def one(context: str, words: list[str]):
+        nonlocal packed_prompt, packed_completion, separate_prompt, separate_completion
+        nonlocal words_total, words_parsed, errors
+        async with semaphore:
+            try:
+                start = perf_counter()
+                response = await complete(
+                    Config.PROMPT_FLASH_PACKED,
+                    f"请解释古文“{context}”中，以下词语的含义：{dumps(words, ensure_ascii=False)}",
+                    Config.FLASH_PACK_TOKENS_PER_WORD * len(words),
+                )
+                packed_latencies.append(perf_counter() - start)
+
+                # The separate calls run concurrently, as a batch would run them.
+                start = perf_counter()
+                responses = await gather(
+                    *(
+                        complete(Config.PROMPT_FLASH, f"请解释古文“{context}”中，“{q}”的含义。", 100)
+                        for q in words
+                    )
+                )
+                separate_latencies.append(perf_counter() - start)
+            except Exception:
+                errors += 1
+                return
+
+        assert response.usage is not None
+        packed_prompt += response.usage.prompt_tokens
+        packed_completion += response.usage.completion_tokens
+        for single in responses:
+            assert single.usage is not None
+            separate_prompt += single.usage.prompt_tokens
+            separate_completion += single.usage.completion_tokens
+        words_total += len(words)
+        words_parsed += len(parse_packed_answers(response.choices[0].message.content or "", words))
+
+    start = perf_counter()
+    await gather(*(one(context, words) for context, words in packs))
+    seconds = perf_counter() - start
+
+    print(summarize("packed completion", packed_latencies, errors, seconds))
+    print(summarize("separate completions", separate_latencies, errors, seconds))
+    if words_total:
+        print(f"contexts: {len(packs)}, words: {words_total}, parsed from packed JSON: {words_parsed}")
+        print(
+            f"prompt tokens: packed {packed_prompt}, separate {separate_prompt} "
+            f"(saved {1 - packed_prompt / max(separate_prompt, 1):.1%})"
+        )
+        print(f"completion tokens: packed {packed_completion}, separate {separate_completion}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--contexts", type=int, default=20)
+    parser.add_argument("--min-words", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    run(main(args.contexts, args.min_words, args.concurrency))
@@ -0,0 +1,77 @@
+"""
+Compares PocketBase lookups through the HTTP API with the read-only SQLite path.
+
+    POCKETBASE_URL=http://localhost:4123 PB_SQLITE_PATH=db/pb_data/data.db \
+        python -m bench.pocketbase_read --words 200 --concurrency 16
+"""
+
+from argparse import ArgumentParser
+from asyncio import run
+from os import getenv
+
+from pocketbase import PocketBase
+from pocketbase.models.errors import PocketBaseNotFoundError
+
+from bench.utils import run_concurrently, load_words
+from server.config import Config, Roles
+from server.services.sqlite_reader_service import SqliteReaderService
+
+
+async def main(word_count: int, repeat: int, concurrency: int):
+    pocketbase_url = getenv("POCKETBASE_URL")
+    if pocketbase_url is None or not Config.PB_SQLITE_PATH:
+        raise KeyError("Both POCKETBASE_URL and PB_SQLITE_PATH must be set.")
+
+    pb = PocketBase(pocketbase_url)
+    reader = SqliteReaderService(Config.PB_SQLITE_PATH)
+    words = load_words(word_count) * repeat
+    role_ids = [role.id for role in Config.ROLES] * (len(words) // len(Config.ROLES))
+
+    async def http_zdic(word: str):
+        try:
+            await pb.collection("zdicCache").get_first(
+                options={"filter": f"query='{word}'"}
+            )
+        except PocketBaseNotFoundError:
+            pass
+
+    async def http_corpus(word: str):
+        try:
+            await pb.collection("corpusStats").get_first(
+                options={"filter": f"query='{word}'"}
+            )
+        except PocketBaseNotFoundError:
+            return
+        await pb.collection("corpus").get_list(
+            page=1, per_page=15, options={"filter": f"query~'{word}'"}
+        )
+
+    async def http_role(id: str):
+        await pb.collection("roles").get_one(id)
+
+    async def sqlite_corpus(word: str):
+        if await reader.corpus_stats_get(word) is not None:
+            await reader.corpus_list(word, 1, 15)
+
+    # Warm up both paths so connection setup is not measured.
+    await http_role(Roles.GUEST.id)
+    await reader.roles_get(Roles.GUEST.id)
+
+    for summary in [
+        await run_concurrently("http zdicCache", http_zdic, words, concurrency),
+        await run_concurrently("sqlite zdicCache", reader.zdc_search, words, concurrency),
+        await run_concurrently("http corpus", http_corpus, words, concurrency),
+        await run_concurrently("sqlite corpus", sqlite_corpus, words, concurrency),
+        await run_concurrently("http roles", http_role, role_ids, concurrency),
+        await run_concurrently("sqlite roles", reader.roles_get, role_ids, concurrency),
+    ]:
+        print(summary)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    run(main(args.words, args.repeat, args.concurrency))
@@ -0,0 +1,94 @@
+"""
+Checks the record/replay transport end to end, offline: streams completions from
+the fake model of `bench.fake_upstreams` through an `AsyncOpenAI` client while
+recording, then replays them at the original pace and at `--speed`. Answers must
+match byte for byte, and replayed chunk timing should follow the recording.
+
+    python -m bench.replay_check --requests 5 --speed 10
+"""
+
+from argparse import ArgumentParser
+from asyncio import run
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from httpx import AsyncClient
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from bench.fake_upstreams import FakeAi, FakeZdic, serve
+from server.config import Config
+from server.services.recording_service import RecordingMissError, RecordingStore, RecordReplayTransport
+
+AI_PORT = 8781
+ZDIC_PORT = 8782
+
+
+async def ask(transport: RecordReplayTransport, question: str) -> tuple[str, float, float]:
+    """(answer, seconds to first token, seconds in total)."""
+    client = AsyncOpenAI(
+        api_key="bench",
+        base_url=f"http://127.0.0.1:{AI_PORT}/v1",
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(transport=transport),
+    )
+    start = perf_counter()
+    first = None
+    parts: list[str] = []
+    stream = await client.chat.completions.create(
+        model="qwen-long-latest",
+        messages=[{"role": "system", "content": Config.PROMPT_FLASH}, {"role": "user", "content": question}],
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            first = first or perf_counter() - start
+            parts.append(chunk.choices[0].delta.content)
+    await client.close()
+    return "".join(parts), first or 0.0, perf_counter() - start
+
+
+async def fetch_page(transport: RecordReplayTransport, word: str) -> bytes:
+    async with AsyncClient(transport=transport) as client:
+        return (await client.get(f"http://127.0.0.1:{ZDIC_PORT}/hans/{word}")).content
+
+
+async def main(requests: int, speed: float):
+    await serve(FakeAi(0.3, 40).build_app(), AI_PORT)
+    await serve(FakeZdic(None, 0.05, 80).build_app(), ZDIC_PORT)
+    questions = [f"句子：六年擢四川按察使 词语：擢 ({i})" for i in range(requests)]
+
+    with TemporaryDirectory() as directory:
+        store = RecordingStore(Path(directory))
+        runs: dict[str, list[tuple[str, float, float]]] = {}
+        pages: dict[str, bytes] = {}
+        for name, mode, pace in (("live + record", "record", 1.0), ("replay 1x", "replay", 1.0),
+                                 (f"replay {speed:g}x", "replay", speed)):
+            transport = RecordReplayTransport(RecordingStore(store.root), mode, pace)
+            runs[name] = [await ask(transport, question) for question in questions]
+            pages[name] = await fetch_page(transport, "之")
+
+        blobs = sum(1 for _ in (store.root / "blobs").rglob("*") if _.is_file())
+        print(f"{requests} completions + 1 page recorded, {blobs} blobs")
+        recorded = runs["live + record"]
+        for name, results in runs.items():
+            same = all(answer == expected[0] for (answer, _, _), expected in zip(results, recorded))
+            ttft = sum(first for _, first, _ in results) / len(results)
+            total = sum(seconds for _, _, seconds in results) / len(results)
+            print(f"  {name:<14} identical={same and pages[name] == pages['live + record']}  "
+                  f"ttft={ttft * 1000:>6.0f}ms  total={total * 1000:>6.0f}ms")
+
+        try:
+            await ask(RecordReplayTransport(store, "replay", 0), "never recorded")
+        except Exception as e:
+            cause = e.__cause__ or e
+            print(f"  miss -> {type(cause).__name__ if isinstance(cause, RecordingMissError) else repr(e)}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--speed", type=float, default=10.0)
+    args = parser.parse_args()
+    run(main(args.requests, args.speed))
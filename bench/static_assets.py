@@ -0,0 +1,78 @@
+"""
+Measures first-load transfer size and RPS of the built client, served by plain
+`StaticFiles` and by `PrecompressedStaticFiles`.
+
+    cd client && pnpm run build && cd .. && python scripts/precompress.py client/dist
+    python -m bench.static_assets --requests 2000 --concurrency 32
+"""
+
+from argparse import ArgumentParser
+from asyncio import run
+from re import findall
+
+from httpx import AsyncClient, ASGITransport
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+from bench.utils import run_concurrently
+from server.services.static_service import PrecompressedStaticFiles
+
+DIST = "client/dist"
+BROWSER_HEADERS = {"Accept-Encoding": "br, gzip, deflate"}
+
+
+def build_app(static: StaticFiles) -> Starlette:
+    return Starlette(routes=[Mount("/", static)])
+
+
+def get_first_load_paths() -> list[str]:
+    with open(f"{DIST}/index.html", "r", encoding="utf-8") as f:
+        html = f.read()
+    references = findall(r'(?:src|href)="(/[^"]+)"', html)
+    return ["/index.html"] + [ref for ref in references if not ref.startswith("//")]
+
+
+async def measure(name: str, static: StaticFiles, requests: int, concurrency: int):
+    paths = get_first_load_paths()
+    transport = ASGITransport(app=build_app(static))
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        wire_bytes = 0
+        revalidations = 0
+        for path in paths:
+            response = await client.get(path, headers=BROWSER_HEADERS)
+            wire_bytes += response.num_bytes_downloaded
+            if "immutable" not in response.headers.get("Cache-Control", ""):
+                revalidations += 1
+
+        async def fetch(path: str):
+            response = await client.get(path, headers=BROWSER_HEADERS)
+            await response.aread()
+
+        summary = await run_concurrently(
+            name, fetch, (paths[i % len(paths)] for i in range(requests)), concurrency
+        )
+
+    print(
+        f"{name}: first load {len(paths)} files, {wire_bytes / 1024:.1f} KB on the wire, "
+        f"{revalidations} requests on repeat visit"
+    )
+    print(summary)
+
+
+async def main(requests: int, concurrency: int):
+    await measure("StaticFiles", StaticFiles(directory=DIST), requests, concurrency)
+    await measure(
+        "PrecompressedStaticFiles",
+        PrecompressedStaticFiles(directory=DIST),
+        requests,
+        concurrency,
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    run(main(args.requests, args.concurrency))
@@ -0,0 +1,96 @@
+from time import perf_counter
+from asyncio import gather, Semaphore
+from statistics import mean
+from typing import Callable, Coroutine, Any, Iterable
+from json import loads
+from csv import DictReader
+
+from pydantic import BaseModel
+
+from server.config import Config
+
+
+class LatencySummary(BaseModel):
+    name: str
+    requests: int
+    errors: int
+    seconds: float
+    rps: float
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name:<24} n={self.requests:<6} err={self.errors:<4} "
+            f"rps={self.rps:>9.1f}  mean={self.mean_ms:>8.2f}ms  "
+            f"p50={self.p50_ms:>8.2f}ms  p95={self.p95_ms:>8.2f}ms  p99={self.p99_ms:>8.2f}ms"
+        )
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name: str, latencies: list[float], errors: int, seconds: float) -> LatencySummary:
+    return LatencySummary(
+        name=name,
+        requests=len(latencies) + errors,
+        errors=errors,
+        seconds=seconds,
+        rps=(len(latencies) + errors) / seconds if seconds > 0 else 0.0,
+        mean_ms=mean(latencies) * 1000 if latencies else 0.0,
+        p50_ms=percentile(latencies, 0.50) * 1000,
+        p95_ms=percentile(latencies, 0.95) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+    )
+
+
+async def run_concurrently(
+    name: str,
+    func: Callable[[Any], Coroutine[Any, Any, Any]],
+    args: Iterable[Any],
+    concurrency: int,
+) -> LatencySummary:
+    """Runs `func(arg)` for every arg with at most `concurrency` calls in flight."""
+    semaphore = Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def run_one(arg: Any):
+        nonlocal errors
+        async with semaphore:
+            start = perf_counter()
+            try:
+                await func(arg)
+                latencies.append(perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = perf_counter()
+    await gather(*(run_one(arg) for arg in args))
+    return summarize(name, latencies, errors, perf_counter() - start)
+
+
+def load_words(limit: int) -> list[str]:
+    words: list[str] = []
+    with open(Config.FREQUENCY_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            words.append(loads(line)["word"])
+            if len(words) >= limit:
+                break
+    return words
+
+
+DATASET_PATH = "train/evaluation-dataset/dataset.csv"
+
+
+def load_dataset(limit: int) -> list[dict[str, str]]:
+    """Rows of the evaluation dataset, with `context`, `query` and the reference `answer`."""
+    with open(DATASET_PATH, "r", encoding="utf-8") as f:
+        return list(DictReader(f))[:limit]
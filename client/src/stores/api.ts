@@ -1,9 +1,12 @@
 import { update_from_query } from './utils';
 import { defineStore } from 'pinia';
-import { type ResponseChunk, type FrontendHandler, SearchTarget, User, FreqResult } from './types';
+import { type ResponseChunk, type FrontendHandler, type BatchItem, SearchTarget, User, FreqResult } from './types';
 import { useUserStore } from './user';
 import { Sha256 } from '@aws-crypto/sha256-js';
 
+const RESUME_ATTEMPTS = 3;
+const RESUME_DELAY_MS = 1000;
+
 export const useApiStore = defineStore("api", () => {
     const abortControllers = new Map<string, AbortController>();
 
@@ -66,23 +69,41 @@ export const useApiStore = defineStore("api", () => {
         return fetch(url, options);
     }
 
+    /**
+     * Reads NDJSON lines until the stream ends. Returns the number of complete lines
+     * handled, and whether the connection broke (as opposed to ending or being aborted).
+     * Batch streams pass a function picking the handler by the `id` of each line.
+     */
     async function readStream(
         reader: ReadableStreamDefaultReader<Uint8Array>,
         decoder: TextDecoder,
-        frontendHandler: FrontendHandler,
+        frontendHandler: FrontendHandler | ((id: string) => FrontendHandler | undefined),
     ) {
         let done = false;
+        let broken = false;
+        let lines = 0;
+        let pending = "";
         while (!done) {
             try {
                 const { value, done: streamDone } = await reader.read();
                 done = streamDone;
                 if (value) {
-                    const data = decoder.decode(value, { stream: true });
-                    const chunks = data.trim().split("\n");
+                    pending += decoder.decode(value, { stream: true });
+                    const chunks = pending.split("\n");
+                    pending = chunks.pop() ?? "";
                     for (const chunk of chunks) {
+                        lines++;
+                        if (!chunk.trim()) {
+                            continue;
+                        }
                         try {
-                            const responseChunk: ResponseChunk = JSON.parse(chunk);
-                            update_from_query(responseChunk, frontendHandler);
+                            const responseChunk: ResponseChunk & { id?: string } = JSON.parse(chunk);
+                            const handler = typeof frontendHandler === 'function'
+                                ? frontendHandler(responseChunk.id ?? '')
+                                : frontendHandler;
+                            if (handler) {
+                                update_from_query(responseChunk, handler);
+                            }
                         } catch (error) {
                             console.error('Error parsing JSON chunk:', error);
                         }
@@ -91,10 +112,58 @@ export const useApiStore = defineStore("api", () => {
             } catch (error) {
                 if (!isAbortError(error)) {
                     console.error('Error reading stream:', error);
+                    broken = true;
                 }
                 done = true;
             }
         }
+        return { lines, broken };
+    }
+
+    /**
+     * Reads a buffered server stream (`X-Stream-Id`), resuming it from the last
+     * complete line if the connection drops. Resuming neither regenerates nor charges.
+     */
+    async function readResumableStream(
+        response: Response,
+        reader: ReadableStreamDefaultReader<Uint8Array>,
+        decoder: TextDecoder,
+        frontendHandler: FrontendHandler,
+        requestId?: string,
+    ) {
+        const streamId = response.headers.get("X-Stream-Id");
+        let offset = 0;
+        for (let attempt = 0; ; attempt++) {
+            const { lines, broken } = await readStream(reader, decoder, frontendHandler);
+            offset += lines;
+            if (!broken || !streamId || attempt >= RESUME_ATTEMPTS) {
+                return;
+            }
+            await new Promise(resolve => setTimeout(resolve, RESUME_DELAY_MS * (attempt + 1)));
+
+            const userStore = useUserStore();
+            const headers = new Headers({ "Last-Event-ID": offset.toString() });
+            if (userStore.token) {
+                headers.append("Authorization", `Bearer ${userStore.token}`);
+            }
+            const options: RequestInit = { headers };
+            if (requestId) {
+                options.signal = getAbortController(requestId).signal;
+            }
+            try {
+                const resumed = await fetch(`/api/query/resume?id=${encodeURIComponent(streamId)}`, options);
+                if (!resumed.ok || !resumed.body) {
+                    return;
+                }
+                reader = resumed.body.getReader();
+            } catch (error) {
+                if (isAbortError(error)) {
+                    return;
+                }
+                console.error('Error resuming stream:', error);
+                // `reader` is still the broken one; the next read fails at once and retries.
+            }
+        }
     }
 
     async function guardJsonResponse(fetched: Promise<Response>, allowStatus: number[], requestId?: string) {
@@ -233,13 +302,13 @@ export const useApiStore = defineStore("api", () => {
         requestId?: string
     ) {
         try {
-            const { reader, decoder } = await guardStreamingResponse(
+            const { reader, decoder, response } = await guardStreamingResponse(
                 call_get(`/api/query/thinking?q=${encodeURIComponent(queryWord)}&context=${encodeURIComponent(querySentence)}&deep=${enableDeepThinking}`, requestId),
                 [], requestId,
             );
 
-            if (reader && decoder) {
-                await readStream(reader, decoder, frontendHandler);
+            if (reader && decoder && response) {
+                await readResumableStream(response, reader, decoder, frontendHandler, requestId);
             }
         } catch (error) {
             if (!isAbortError(error)) {
@@ -264,6 +333,26 @@ export const useApiStore = defineStore("api", () => {
         }
     }
 
+    async function queryBatch(
+        items: BatchItem[],
+        getFrontendHandler: (id: string) => FrontendHandler | undefined,
+        requestId?: string
+    ) {
+        try {
+            const { reader, decoder } = await guardStreamingResponse(
+                call_post(`/api/batch`, { items }, requestId), [], requestId
+            );
+
+            if (reader && decoder) {
+                await readStream(reader, decoder, getFrontendHandler);
+            }
+        } catch (error) {
+            if (!isAbortError(error)) {
+                console.error('Error in queryBatch:', error);
+            }
+        }
+    }
+
     async function queryFreq(query: string, page: number, requestId?: string): Promise<FreqResult> {
         const response = await guardJsonResponse(
             call_get(`/api/query/freq-info?q=${encodeURIComponent(query)}&page=${page}`, requestId),
@@ -274,7 +363,10 @@ export const useApiStore = defineStore("api", () => {
             return FreqResult.empty();
         }
 
-        const result = new FreqResult(response);
+        return sortFreqNotes(new FreqResult(response));
+    }
+
+    function sortFreqNotes(result: FreqResult): FreqResult {
         result.notes.sort((a, b) => {
             if (a.query.length !== b.query.length) {
                 return a.query.length - b.query.length;
@@ -331,6 +423,8 @@ export const useApiStore = defineStore("api", () => {
         queryThinking,
         queryFreq,
         extractModelTest,
+        queryBatch,
+        sortFreqNotes,
         getBalanceDetails,
         register,
         login,
@@ -7,6 +7,7 @@ import { format_front, parse_ai_thought_response } from './utils';
 import { useApiStore } from './api';
 import { useHistoryStore } from './history';
 import { useUserStore } from './user';
+import { useSessionStore } from './session';
 
 const exampleText = "工欲善其事，必先利其器。";
 
@@ -53,6 +54,8 @@ export const useQueryStore = defineStore("query", () => {
     const aiInstantResponse = ref("");
     const aiThoughtResponse = ref("");
     const currentRecorded = ref(true);
+    const queuePosition = ref(0);
+    const errorMessage = ref("");
     const zdicResponse = ref({ basic_explanations: new Array<string>(), detailed_explanations: new Array<string>(), phrase_explanations: new Array<string>() });
 
     const requestIds = {
@@ -122,6 +125,7 @@ export const useQueryStore = defineStore("query", () => {
     async function query() {
         const apiStore = useApiStore();
         const userStore = useUserStore();
+        const sessionStore = useSessionStore();
 
         currentRecorded.value = false;
         lastQuery.sentence = querySentence.value;
@@ -131,13 +135,35 @@ export const useQueryStore = defineStore("query", () => {
         for (const requestId of [requestIds.queryFlash, requestIds.queryThinking, requestIds.queryFreq]) {
             if (requestId) {
                 apiStore.abortRequest(requestId);
+                sessionStore.cancel(requestId);
             }
         }
 
+        queuePosition.value = 0;
+        errorMessage.value = "";
         requestIds.queryFreq = nanoid();
         requestIds.queryFlash = nanoid();
         requestIds.queryThinking = nanoid();
 
+        if (await sessionStore.connect()) {
+            // One socket carries the short queries, authenticated once. The thinking query
+            // stays on HTTP, whose stream can be resumed by id after a dropped connection.
+            const q = queryWord.value;
+            const context = querySentence.value;
+            await Promise.all([
+                sessionStore.query({ id: requestIds.queryFreq, kind: "freq", q, page: 1 }, {
+                    ...getFrontendHandler(),
+                    updateFreq: (freqResult) => {
+                        freqInfo.value = apiStore.sortFreqNotes(freqResult);
+                    },
+                }),
+                sessionStore.query({ id: requestIds.queryFlash, kind: "flash", q, context }, getFrontendHandler()),
+                apiStore.queryThinking(q, context, userStore.deepThinking, getFrontendHandler(), requestIds.queryThinking),
+            ]);
+            console.log("Request Ended");
+            return;
+        }
+
         await Promise.all([
             queryFrequency(queryWord.value, 1, requestIds.queryFreq),
             apiStore.queryFlash(queryWord.value, querySentence.value, getFrontendHandler(), requestIds.queryFlash),
@@ -159,14 +185,28 @@ export const useQueryStore = defineStore("query", () => {
             };
         }
 
+        function leaveQueue<T>(updater: (value: T) => void) {
+            return (value: T) => {
+                queuePosition.value = 0;
+                updater(value);
+            };
+        }
+
         return {
-            updateFlash: getLazyEmptyUpdater(aiInstantResponse),
-            updateThinking: getLazyEmptyUpdater(aiThoughtResponse),
+            updateFlash: leaveQueue(getLazyEmptyUpdater(aiInstantResponse)),
+            updateThinking: leaveQueue(getLazyEmptyUpdater(aiThoughtResponse)),
             updateUsage: useUserStore().updateUsage,
             updateZdic: (zdicResult) => {
                 zdicResponse.value = zdicResult;
             },
             updateExtract: () => { },
+            updateQueued: (queuedInfo) => {
+                queuePosition.value = queuedInfo.position;
+            },
+            updateError: (errorInfo) => {
+                queuePosition.value = 0;
+                errorMessage.value = errorInfo.message;
+            },
         };
     }
 
@@ -257,6 +297,8 @@ export const useQueryStore = defineStore("query", () => {
         aiThoughtStructured,
         zdicResponse,
         currentRecorded,
+        queuePosition,
+        errorMessage,
         chars,
         paragraphs,
         adopt_answer,
@@ -0,0 +1,124 @@
+import { defineStore } from 'pinia';
+import { watch } from 'vue';
+import { type ResponseChunk, type FrontendHandler } from './types';
+import { update_from_query } from './utils';
+import { useUserStore } from './user';
+
+export interface SessionQuery {
+    id: string;
+    kind: "flash" | "thinking" | "freq";
+    q: string;
+    context?: string;
+    deep?: number;
+    page?: number;
+}
+
+interface PendingQuery {
+    handler: FrontendHandler;
+    resolve: () => void;
+}
+
+/**
+ * One WebSocket (`/api/session`) for all queries of the page: authenticated once,
+ * events routed by query id, cancellation by message, and balance pushed after charges.
+ */
+export const useSessionStore = defineStore("session", () => {
+    const pending = new Map<string, PendingQuery>();
+    let socket: WebSocket | null = null;
+    let opening: Promise<WebSocket | null> | null = null;
+
+    function finish(id: string) {
+        pending.get(id)?.resolve();
+        pending.delete(id);
+    }
+
+    function onMessage(event: MessageEvent) {
+        let responseChunk: ResponseChunk & { id?: string };
+        try {
+            responseChunk = JSON.parse(event.data);
+        } catch (error) {
+            console.error('Error parsing session message:', error);
+            return;
+        }
+        if (responseChunk.type === "balance") {
+            useUserStore().updateBalance(responseChunk.data);
+            return;
+        }
+        const id = responseChunk.id ?? '';
+        const query = pending.get(id);
+        if (!query) {
+            return;
+        }
+        update_from_query(responseChunk, query.handler);
+        if (responseChunk.type === "done") {
+            finish(id);
+        }
+    }
+
+    /** Resolves to the open socket, or null if the session is unavailable (use HTTP then). */
+    function connect(): Promise<WebSocket | null> {
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            return Promise.resolve(socket);
+        }
+        if (opening) {
+            return opening;
+        }
+        opening = new Promise(resolve => {
+            const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+            const ws = new WebSocket(`${protocol}//${location.host}/api/session`);
+            ws.onopen = () => {
+                ws.send(JSON.stringify({ op: "auth", token: useUserStore().token || null }));
+                socket = ws;
+                opening = null;
+                resolve(ws);
+            };
+            ws.onerror = () => {
+                opening = null;
+                resolve(null);
+            };
+            ws.onclose = () => {
+                if (socket === ws) {
+                    socket = null;
+                }
+                // Queries in flight died with the connection.
+                Array.from(pending.keys()).forEach(finish);
+            };
+            ws.onmessage = onMessage;
+        });
+        return opening;
+    }
+
+    function query(sessionQuery: SessionQuery, handler: FrontendHandler): Promise<void> {
+        return new Promise(resolve => {
+            if (!socket || socket.readyState !== WebSocket.OPEN) {
+                resolve();
+                return;
+            }
+            pending.set(sessionQuery.id, { handler, resolve });
+            socket.send(JSON.stringify({ op: "query", query: sessionQuery }));
+        });
+    }
+
+    function cancel(id: string) {
+        if (!pending.has(id)) {
+            return;
+        }
+        finish(id);
+        socket?.send(JSON.stringify({ op: "cancel", id }));
+    }
+
+    function close() {
+        socket?.close();
+        socket = null;
+    }
+
+    // The session is authenticated as whoever was logged in when it opened.
+    watch(() => useUserStore().token, close);
+
+    return {
+        connect,
+        query,
+        cancel,
+        close,
+    };
+});
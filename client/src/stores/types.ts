@@ -127,6 +127,7 @@ export interface AiResult {
 export interface AiUsageResult {
     prompt_tokens: number;
     completion_tokens: number;
+    estimated?: boolean;
 }
 
 export interface ZdicResult {
@@ -135,7 +136,52 @@ export interface ZdicResult {
     phrase_explanations: string[];
 }
 
-export type ResponseChunk = { type: "ai-flash", data: string } | { type: "ai-thinking", data: AiResult } | { type: "ai-usage", data: AiUsageResult } | { type: "zdic", data: ZdicResult } | { type: 'ai-extract', data: AiResult };
+export interface QueuedInfo {
+    position: number;
+    waited: number;
+}
+
+export interface AnswerInfo {
+    answer: string;
+    answers: string[];
+}
+
+export interface BatchItem {
+    id: string;
+    context: string;
+    q: string;
+    mode: "flash" | "thinking" | "deep";
+}
+
+export interface ExtractRow {
+    type: string;
+    context: string;
+    query: string;
+    answer: string;
+}
+
+export interface BalanceInfo {
+    balance: number;
+    total_spent: number;
+}
+
+export interface TimingSpan {
+    name: string;
+    duration_ms: number;
+    count: number;
+}
+
+export interface TimingInfo {
+    total_ms: number;
+    spans: TimingSpan[];
+}
+
+export interface ErrorInfo {
+    message: string;
+    retry_after: number | null;
+}
+
+export type ResponseChunk = { type: "ai-flash", data: string } | { type: "ai-thinking", data: AiResult } | { type: "ai-usage", data: AiUsageResult } | { type: "zdic", data: ZdicResult } | { type: 'ai-extract', data: AiResult } | { type: "queued", data: QueuedInfo } | { type: "error", data: ErrorInfo } | { type: "answer", data: AnswerInfo } | { type: "done", data: null } | { type: "extract-rows", data: ExtractRow[] } | { type: "freq", data: JsonType<FreqResult> } | { type: "balance", data: BalanceInfo } | { type: "timing", data: TimingInfo };
 
 export interface FrontendHandler {
     updateFlash: (contentChunk: string) => void;
@@ -143,6 +189,14 @@ export interface FrontendHandler {
     updateExtract: (contentChunk: string) => void;
     updateUsage: (usageResult: AiUsageResult) => void;
     updateZdic: (zdicResult: ZdicResult) => void;
+    updateQueued?: (queuedInfo: QueuedInfo) => void;
+    updateError?: (errorInfo: ErrorInfo) => void;
+    updateAnswer?: (answerInfo: AnswerInfo) => void;
+    updateDone?: () => void;
+    updateExtractRows?: (rows: ExtractRow[]) => void;
+    updateFreq?: (freqResult: FreqResult) => void;
+    updateBalance?: (balanceInfo: BalanceInfo) => void;
+    updateTiming?: (timingInfo: TimingInfo) => void;
 }
 
 export enum SearchTarget {
@@ -2,7 +2,7 @@ import { defineStore } from "pinia";
 import { computed, nextTick, ref } from "vue";
 import { useLocalStorage } from "@vueuse/core";
 import { useApiStore } from "./api";
-import { type AiUsageResult, User } from "./types";
+import { type AiUsageResult, type BalanceInfo, User } from "./types";
 
 interface BalanceDetail {
     id: string;
@@ -50,6 +50,11 @@ export const useUserStore = defineStore("settings", () => {
         token.value = newToken;
     }
 
+    function updateBalance(balanceInfo: BalanceInfo) {
+        user.value.balance = balanceInfo.balance;
+        user.value.total_spent = balanceInfo.total_spent;
+    }
+
     function updateUsage(usageResult: AiUsageResult) {
         usageInfo.value.prompt_tokens += usageResult.prompt_tokens;
         usageInfo.value.completion_tokens += usageResult.completion_tokens;
@@ -106,6 +111,7 @@ export const useUserStore = defineStore("settings", () => {
         bdLoading,
         deepThinking,
         updateUsage,
+        updateBalance,
         updateUser,
         getUserInfo,
         login,
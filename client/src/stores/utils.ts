@@ -61,6 +61,34 @@ export function update_from_query(responseChunk: ResponseChunk, frontendHandler:
         case "ai-extract":
             frontendHandler.updateExtract(responseChunk.data.content);
             break;
+        case "answer":
+            frontendHandler.updateAnswer?.(responseChunk.data);
+            break;
+        case "done":
+            frontendHandler.updateDone?.();
+            break;
+        case "extract-rows":
+            frontendHandler.updateExtractRows?.(responseChunk.data);
+            break;
+        case "freq":
+            frontendHandler.updateFreq?.(new FreqResult(responseChunk.data));
+            break;
+        case "balance":
+            frontendHandler.updateBalance?.(responseChunk.data);
+            break;
+        case "queued":
+            frontendHandler.updateQueued?.(responseChunk.data);
+            break;
+        case "timing":
+            frontendHandler.updateTiming?.(responseChunk.data);
+            break;
+        case "error":
+            if (frontendHandler.updateError) {
+                frontendHandler.updateError(responseChunk.data);
+            } else {
+                console.error(`Server error: ${responseChunk.data.message}`);
+            }
+            break;
         default:
             console.error(`Unknown type: ${JSON.stringify(responseChunk)}`);
             break;
@@ -61,7 +61,7 @@ export default defineConfig({
   },
   server: {
     proxy: {
-      '/api': 'http://localhost:4122',
+      '/api': { target: 'http://localhost:4122', ws: true },
     }
   },
   build: {
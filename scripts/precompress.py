@@ -0,0 +1,54 @@
+"""
+Writes `.gz` (and `.br`, if the `brotli` package is installed) next to every
+compressible file of the built client, for `PrecompressedStaticFiles`.
+
+    python scripts/precompress.py client/dist
+"""
+
+from gzip import compress as gzip_compress
+from os import walk, path
+from sys import argv
+
+try:
+    from brotli import compress as brotli_compress  # type: ignore
+except ImportError:
+    brotli_compress = None
+
+COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".json", ".svg", ".txt", ".webmanifest", ".ico", ".map"}
+MIN_SIZE = 1024
+
+
+def precompress(directory: str) -> None:
+    original_total = gzip_total = brotli_total = 0
+    for root, _, files in walk(directory):
+        for name in files:
+            if path.splitext(name)[1] not in COMPRESSIBLE:
+                continue
+            full_path = path.join(root, name)
+            with open(full_path, "rb") as f:
+                content = f.read()
+            if len(content) < MIN_SIZE:
+                continue
+
+            original_total += len(content)
+            gzipped = gzip_compress(content, compresslevel=9, mtime=0)
+            with open(full_path + ".gz", "wb") as f:
+                f.write(gzipped)
+            gzip_total += len(gzipped)
+
+            if brotli_compress is not None:
+                brotlied = brotli_compress(content, quality=11)
+                with open(full_path + ".br", "wb") as f:
+                    f.write(brotlied)
+                brotli_total += len(brotlied)
+
+    print(f"Original: {original_total / 1024:.1f} KB")
+    print(f"Gzip:     {gzip_total / 1024:.1f} KB")
+    if brotli_compress is not None:
+        print(f"Brotli:   {brotli_total / 1024:.1f} KB")
+    else:
+        print("Brotli:   skipped (pip install brotli)")
+
+
+if __name__ == "__main__":
+    precompress(argv[1] if len(argv) > 1 else "client/dist")
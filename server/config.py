@@ -12,9 +12,34 @@ class Roles:
     GUEST = Role(id="role00guest0000", name="Guest", daily_coins=200_000)
 
 
+def parse_api_keys(value: str | None, default_base_url: str) -> list[tuple[str, str]]:
+    """Parses `key1,key2@https://other/v1` into (key, base URL) pairs."""
+    keys: list[tuple[str, str]] = []
+    for item in (value or "").split(","):
+        api_key, _, base_url = item.strip().partition("@")
+        if api_key:
+            keys.append((api_key, base_url or default_base_url))
+    return keys
+
+
 class Config:
     API_KEY = getenv("API_KEY")
-    AI_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    # Both upstreams can be pointed elsewhere, e.g. at the stand-ins of `bench.fake_upstreams`.
+    AI_BASE_URL = getenv("AI_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+    ZDIC_URL = getenv("ZDIC_URL", "https://www.zdic.net/hans/")
+    # Upstream traffic can be recorded and replayed offline: "off", "record", "replay",
+    # or "auto" (replay what was recorded, record the rest). 0 speed replays without delays.
+    UPSTREAM_RECORDING = getenv("UPSTREAM_RECORDING", "off")
+    UPSTREAM_RECORDING_PATH = getenv("UPSTREAM_RECORDING_PATH", "./recordings")
+    UPSTREAM_REPLAY_SPEED = float(getenv("UPSTREAM_REPLAY_SPEED", "1"))
+
+    # Pool of upstream keys; falls back to the single API_KEY.
+    API_KEYS = parse_api_keys(getenv("API_KEYS") or API_KEY, AI_BASE_URL)
+    API_KEY_RPM = int(getenv("API_KEY_RPM", "600"))
+    API_KEY_TPM = int(getenv("API_KEY_TPM", "1000000"))
+    API_KEY_COOLDOWN = 30.0  # seconds a key rests after a 429 without Retry-After
+    API_KEY_MAX_WAIT = 1.0  # seconds between quota re-checks when every key is exhausted
+    API_KEY_COMPLETION_ESTIMATE = 1000  # tokens reserved for a streamed answer until usage arrives
 
     GENERAL_MODEL = AiModel(
         base_url=AI_BASE_URL, id="qwen-plus", prompt_price=8, completion_price=20
@@ -23,17 +48,29 @@ class Config:
         base_url=AI_BASE_URL, id="qwen-long-latest", prompt_price=5, completion_price=20
     )
 
+    CHEAP_MODEL = AiModel(
+        base_url=AI_BASE_URL,
+        id="qwen-turbo-latest",
+        prompt_price=3,
+        completion_price=6,
+        first_token_timeout=10.0,
+    )
+
     WYW_FLASH_MODEL = AiModel(
         base_url=AI_BASE_URL,
         id="qwen-long-latest",
         prompt_price=5,
         completion_price=20,
+        fallback=CHEAP_MODEL,
+        first_token_timeout=8.0,
+        hedge=True,
     )
     WYW_THINKING_MODEL = AiModel(
         base_url=AI_BASE_URL,
         id="qwen-long-latest",
         prompt_price=5,
         completion_price=20,
+        first_token_timeout=15.0,
     )
     WYW_THINKING_MODEL_DEEP = AiModel(
         base_url=AI_BASE_URL,
@@ -41,14 +78,140 @@ class Config:
         prompt_price=8,
         completion_price=80,
         thinking=True,
+        fallback=WYW_THINKING_MODEL,
+        first_token_timeout=20.0,
     )
 
     ROLES = [Roles.ADMIN, Roles.CORE, Roles.USER, Roles.GUEST]
 
+    # Close the thinking stream once the **答案** line is complete, instead of letting the model ramble on.
+    THOUGHT_EARLY_STOP = True
+
+    # Thinking streams are buffered so a dropped client can resume them (`/api/query/resume`).
+    STREAM_STORE_MAX = 1000
+    STREAM_STORE_TTL = 600.0  # seconds a finished stream can still be replayed
+    STREAM_RESUME_GRACE = 30.0  # seconds generation goes on without any reader
+
+    # Server-side batches of queries (`/api/batch`).
+    BATCH_MAX_ITEMS = 500
+    BATCH_CONCURRENCY = 8
+    BATCH_MAX_CONCURRENCY = 16
+    # Adjacent streamed deltas are merged until this many bytes are pending or the oldest waited this long.
+    STREAM_COALESCE_BYTES = 64
+    STREAM_COALESCE_INTERVAL = 0.03  # seconds; 0 sends every delta as it comes
+    # Gzip query streams (with a sync flush per chunk) for clients that accept it.
+    STREAM_GZIP = getenv("STREAM_GZIP", "0") == "1"
+    STREAM_GZIP_LEVEL = 6
+
+    # Logs are JSON lines, rotated past LOG_MAX_BYTES; the console keeps the short format.
+    LOG_PATH = getenv("LOG_PATH", "./log.log")
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    # Share of the records kept per high-volume category; uncategorized records are all kept.
+    LOG_SAMPLE_RATES = {
+        "request": 0.1,
+        "auth": 0.1,
+        "zdic-cache": 0.2,
+        "admission": 0.01,  # shed requests; their totals are in /metrics
+    }
+
+    # Share of requests whose span timings are appended to the trace log (0 = none).
+    TIMING_TRACE_SAMPLE = float(getenv("TIMING_TRACE_SAMPLE", "0"))
+    TIMING_TRACE_PATH = getenv("TIMING_TRACE_PATH", "./trace.jsonl")
+
+    # `/metrics` (Prometheus text format) asks for this bearer token when set.
+    METRICS_TOKEN = getenv("METRICS_TOKEN")
+
+    # Admin profiling (`/api/admin/profile`): a run lasts at most this long, or this many requests.
+    PROFILE_MAX_SECONDS = 300.0
+    PROFILE_MAX_REQUESTS = 1000
+    PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples of the loop thread
+    PROFILE_STACK_DEPTH = 128
+
+    # WebSocket query sessions (`/api/session`).
+    SESSION_MAX_QUERIES = 8  # concurrent queries per session
+    SESSION_OUTBOX = 256  # events waiting for a slow client before queries block
+
+    # Flash items of a batch sharing a context are asked in one completion, this many words at most.
+    FLASH_PACK_SIZE = 8
+    FLASH_PACK_TOKENS_PER_WORD = 120
+
+    # Exam papers are extracted question block by question block, this many at a time.
+    EXTRACT_CONCURRENCY = 4
+
+    # Hedged requests fire after the model's recent p95 latency, or this before enough samples.
+    HEDGE_DEFAULT_DELAY = 3.0
+    HEDGE_MIN_SAMPLES = 20
+
     FREQUENCY_PATH = "server/word-frequency.jsonl"
 
+    # Optional read-only path to PocketBase's `pb_data/data.db` for hot lookups.
+    PB_SQLITE_PATH = getenv("PB_SQLITE_PATH")
+
+    # Zdic entries never change once cached; frequency info changes when answers are adopted.
+    CACHE_CONTROL_ZDIC = "private, max-age=86400"
+    CACHE_CONTROL_FREQ = "private, no-cache"
+    ETAG_REGISTRY_SIZE = 4096
+
+    # Backend shared by the zdic, finished-answer and session caches and the per-user locks:
+    # "memory" (one worker), "sqlite" (workers of one host; keep the file on a tmpfs)
+    # or "resp" (Redis or anything speaking its protocol, for several hosts).
+    CACHE_BACKEND = getenv("CACHE_BACKEND", "memory")
+    CACHE_SQLITE_PATH = getenv("CACHE_SQLITE_PATH", "/dev/shm/wyw-cache.db")
+    CACHE_RESP_URL = getenv("CACHE_RESP_URL", "redis://127.0.0.1:6379/0")
+    CACHE_RESP_POOL = 8
+    CACHE_RESP_TIMEOUT = 1.0
+    CACHE_MEMORY_MAX_ENTRIES = 10000
+    CACHE_ZDIC_TTL = 86400.0
+    CACHE_SESSION_TTL = 3600.0  # seconds a token's role is remembered across workers
+    CACHE_LOCK_TTL = 30.0  # a crashed worker's user lock frees itself after this
+    CACHE_LOCK_TIMEOUT = 10.0
+
+    # Upstream completion scheduling. A model's own `max_concurrency` overrides the default.
+    UPSTREAM_MAX_CONCURRENCY = 32
+    UPSTREAM_MODEL_CONCURRENCY = 16
+    UPSTREAM_QUEUE_POLL = 1.0  # seconds between "queued" events
+    UPSTREAM_QUEUE_DEADLINE = 30.0
+    UPSTREAM_QUEUE_DEADLINES = {
+        Roles.ADMIN.id: 120.0,
+        Roles.CORE.id: 90.0,
+        Roles.USER.id: 60.0,
+        Roles.GUEST.id: 20.0,
+    }
+
+    # Admission control for expensive endpoints, checked before any auth or billing.
+    ADMISSION_PATHS = {
+        "/api/query/thinking",
+        "/api/query/flash",
+        "/api/extract-model-test",
+        "/api/batch",
+    }
+    ADMISSION_SOFT_IN_FLIGHT = 64  # guests are shed from here on
+    ADMISSION_HARD_IN_FLIGHT = 128  # everyone is shed from here on
+    ADMISSION_MAX_LOOP_LAG = 0.2  # seconds, as measured by the loop watchdog
+    ADMISSION_MAX_UPSTREAM_QUEUE = 32
+    ADMISSION_RETRY_AFTER = 5.0
+
+    # CPU-bound work (HTML parsing, large validations and JSON dumps) runs here, off the loop.
+    CPU_EXECUTOR = getenv("CPU_EXECUTOR", "thread")  # "thread" or "process"
+    CPU_EXECUTOR_WORKERS = int(getenv("CPU_EXECUTOR_WORKERS", "4"))
+    # Smaller jobs stay inline, where they cost less than the hand-off.
+    CPU_INLINE_MAX_ITEMS = 100
+    CPU_INLINE_MAX_BYTES = 64 * 1024
+    # A callback holding the loop longer than this is logged with its stack (0 = off).
+    LOOP_WATCHDOG_THRESHOLD = float(getenv("LOOP_WATCHDOG_THRESHOLD", "0.1"))
+    # Heartbeat of the one loop lag measurement, read by the watchdog, admission and metrics.
+    LOOP_WATCHDOG_INTERVAL = 0.02
+
+    # Token buckets: (refill per second, burst).
+    RATE_LIMIT_GUEST = (0.5, 10.0)
+    RATE_LIMIT_USER = (2.0, 30.0)
+    RATE_LIMIT_MAX_KEYS = 10_000
+
     PROMPT_FLASH = "你是一位高中语文老师，深入研究高考文言文词语解释。答案简短，以准确为主，不太过意译。一般可以给出一个精准解释，语境特殊时可以补充引申义。简洁地回答用户的问题，除答案外不输出任何内容。"
 
+    PROMPT_FLASH_PACKED = '你是一位高中语文老师，深入研究高考文言文词语解释。答案简短，以准确为主，不太过意译。一般可以给出一个精准解释，语境特殊时可以补充引申义。用户会一次询问同一句古文中的多个词语，按给出的顺序逐一回答。只输出一个 JSON 数组，每项形如 {"word": "词语", "answer": "解释"}，不输出其他任何内容。'
+
     PROMPT_AI_THOUGHT = """你是一位高中语文老师，深入研究高考文言文词语解释。答案简短，并且不太过意译。一般可以给出一个精准解释，语境特殊时可以补充引申义。若涉及通假字，则需答：通“(通假字)”，(含义)。你需要按要求深度思考并回答用户问题。
 汉典是一个权威的网站，内含该字的多数义项，但不一定全面。
 回答步骤如下：
@@ -67,3 +230,14 @@ class Config:
 特别注意：不可以只输出题目的那几个字，这些上下文是不够做题的！
 
 你输出的结尾应该是几行 CSV 代码（使用代码块括起），格式为 type,context,query,answer，其中 type 为题目板块，可取值为 填空/选择/翻译/注释； context 需要你选取考察的词语的完整上下文，这一语境应为考生能推断出词义的最小语境。query应为考察的关键字词。answer应为期望的标准回答。"""
+
+    PROMPT_AI_EXTRACT_SECTION = """你是一位助教，你要帮助教师完成重复性的操作任务。请细致地完成。教师正在编撰一套专门针对文言释义的汇编题目，他会给你一篇文言文原文（可能带有注释），以及其中的一道题目和标准答案。格式为 Markdown，一般来说需要解释的词语会被加粗，但也有时会遗漏。这时，需要解释的词语需要你结合标准答案进行推断。
+
+对于填空和选择题，你要忠于原文和答案，从原文中补充上下文后，原样输出。
+对于翻译句子的题目，你需要选择考察的重难点字词，将其提炼出后输出。选取 1~3 个即可。中档、简单的不需要提取。最好取单字，若确实为一体则取整词。
+若教师要求只处理注释，将不过于生僻的字词同样从原文补充上下文后输出。若该注释很长，适当精简使其适合作为一道考试题目的答案。
+若题目与文言释义无关（如断句、简答分析），输出只有表头的 CSV 即可。
+
+特别注意：不可以只输出题目的那几个字，这些上下文是不够做题的！
+
+先简要分析，你输出的结尾应该是几行 CSV 代码（使用代码块括起），格式为 type,context,query,answer，其中 type 为题目板块，可取值为 填空/选择/翻译/注释； context 需要你选取考察的词语的完整上下文，这一语境应为考生能推断出词义的最小语境。query应为考察的关键字词。answer应为期望的标准回答。"""
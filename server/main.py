@@ -1,47 +1,52 @@
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import RedirectResponse, StreamingResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from fastapi import FastAPI, Query, HTTPException, Depends, WebSocket
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse, Response
 from starlette.requests import Request
-from openai import AsyncOpenAI
 from httpx import ConnectTimeout
 from asyncio import create_task
-from pydantic import BaseModel
+from hmac import compare_digest
+from pydantic import BaseModel, Field
+from typing import Literal
 
 from server.services.zdic_service import ZdicService
-from server.services.completion_service import CompletionService
+from server.services.completion_service import CompletionService, completion_tracker
 from server.services.logging_service import main_logger
+from server.services.static_service import PrecompressedStaticFiles
+from server.services.streaming_service import CancellableStreamingResponse
+from server.services.stream_store_service import stream_store
+from server.services.batch_service import BatchService
+from server.services.session_service import QuerySession
+from server.services.auth_service import (
+    AuthorizationMiddleware,
+    RequestAuth,
+    get_request_auth,
+    get_pocketbase,
+    get_admin_pocketbase,
+)
 from server.services.pocketbase_service import PocketBaseService, NotEnoughBalanceError
+from server.services.scheduler_service import upstream_scheduler
+from server.services.admission_service import AdmissionMiddleware, admission_controller
+from server.services.resilience_service import model_health
+from server.services.key_pool_service import api_key_pool
+from server.services.metrics_service import metrics_registry
+from server.services.timing_service import TimingMiddleware, with_timing_event
+from server.services.profiling_service import ProfilingMiddleware, ProfilerBusyError, profiler
+from server.services.executor_service import loop_watchdog
+from server.services.http_cache_service import (
+    etag_registry,
+    etag_matches,
+    make_etag,
+    not_modified_response,
+)
 from server.config import Config
 from server.models import (
     ZdicResult,
     ServerResponseZdic,
+    ServerResponseFreqInfo,
+    FreqInfo,
+    BatchItem,
 )
 
 
-class AuthorizationMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        host = request.client.host if request.client is not None else "Unknown"
-        ip_address = request.headers.get("X-Forwarded-For", host)
-        main_logger.info(f"Request from {ip_address}")
-
-        authorization = request.headers.get("Authorization")
-        request.state.pb = PocketBaseService()
-
-        if "api" in request.url.path:
-            # To avoid unnecessary auth when just getting pages.
-            if authorization is not None:
-                if authorization.startswith("Bearer "):
-                    authorization = authorization[len("Bearer ") :]
-                await request.state.pb.auth_user(authorization)
-                main_logger.info(f"Authorization: {authorization}")
-            else:
-                request.state.token = None
-                await request.state.pb.auth_guest(ip_address)
-
-        return await call_next(request)
-
-
 class LoginBody(BaseModel):
     email: str
     password: str
@@ -62,17 +67,24 @@ class ExtractBody(BaseModel):
     prompt: str
 
 
-def init_ai_client():
-    if not Config.API_KEY:
-        raise ValueError("API_KEY is not set")
-    return AsyncOpenAI(
-        api_key=Config.API_KEY,
-        base_url=Config.AI_BASE_URL,
-    )
+class BatchBody(BaseModel):
+    items: list[BatchItem] = Field(..., min_length=1, max_length=Config.BATCH_MAX_ITEMS)
+    concurrency: int = Field(Config.BATCH_CONCURRENCY, ge=1, le=Config.BATCH_MAX_CONCURRENCY)
+
+
+class ProfileBody(BaseModel):
+    mode: Literal["sampling", "cprofile"] = "sampling"
+    # Without a path: how long to profile. With one: how long to wait for the requests.
+    seconds: float = Field(10.0, gt=0, le=Config.PROFILE_MAX_SECONDS)
+    path: str | None = Field(None, pattern=r"^/")
+    requests: int = Field(1, ge=1, le=Config.PROFILE_MAX_REQUESTS)
 
 
 app = FastAPI()
 app.add_middleware(AuthorizationMiddleware)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(TimingMiddleware)
+app.add_middleware(ProfilingMiddleware)
 
 
 async def pocketbase_init():
@@ -83,17 +95,23 @@ async def pocketbase_init():
 
 
 create_task(pocketbase_init())
-client = init_ai_client()
+loop_watchdog.start()
 
 
-async def query_flash_core(pb: PocketBaseService, context: str, q: str):
-    completion_service = CompletionService(client, pb)
-    async for chunk in completion_service.generate_flash_response(context, q):
+async def query_flash_core(pb: PocketBaseService, context: str, q: str, stream: int):
+    completion_service = CompletionService(pb)
+    async for chunk in completion_service.generate_flash_response(context, q, stream=stream == 1):
         yield chunk.to_jsonl_str()
 
 
+async def query_flash_packed_core(pb: PocketBaseService, context: str, words: list[str]):
+    completion_service = CompletionService(pb)
+    async for word, chunk in completion_service.generate_packed_flash_response(context, words):
+        yield word, chunk.to_jsonl_str()
+
+
 async def query_thinking_core(pb: PocketBaseService, context: str, q: str, deep: int):
-    completion_service = CompletionService(client, pb)
+    completion_service = CompletionService(pb)
     try:
         zdic_result = await ZdicService(pb).get_result(q)
 
@@ -116,6 +134,11 @@ async def query_thinking_core(pb: PocketBaseService, context: str, q: str, deep:
         yield chunk.to_jsonl_str()
 
 
+async def query_freq_core(pb: PocketBaseService, q: str, page: int):
+    freq_info = await pb.corpus_freq_retrieve(q, page)
+    yield ServerResponseFreqInfo.create(freq_info or FreqInfo.empty(q)).to_jsonl_str()
+
+
 @app.exception_handler(NotEnoughBalanceError)
 async def not_enough_balance_handler(request: Request, exc: NotEnoughBalanceError):
     return JSONResponse(
@@ -130,40 +153,108 @@ async def not_enough_balance_handler(request: Request, exc: NotEnoughBalanceErro
 
 @app.get("/api/query/thinking")
 async def query_thinking(
-    request: Request,
+    auth: RequestAuth = Depends(get_request_auth),
+    pb: PocketBaseService = Depends(get_pocketbase),
     q: str = Query(..., description="The query word", min_length=1, max_length=100),
     context: str = Query(..., description="The context sentence", max_length=1000),
     deep: int = Query(
         1, description="Deep thinking level (0=disabled, 1=limited, 2=deep)", ge=0, le=2
     ),
 ):
-    pb: PocketBaseService = request.state.pb
     await pb.balance_check()
-    return StreamingResponse(
-        query_thinking_core(pb=pb, context=context, q=q, deep=deep),
+    stream = stream_store.start(
+        auth.get_owner(),
+        with_timing_event(query_thinking_core(pb=pb, context=context, q=q, deep=deep)),
+    )
+    return CancellableStreamingResponse(
+        stream.read(0),
+        media_type="application/json",
+        headers={"X-Stream-Id": stream.id},
+    )
+
+
+@app.get("/api/query/resume")
+async def query_resume(
+    request: Request,
+    auth: RequestAuth = Depends(get_request_auth),
+    id: str = Query(..., description="The X-Stream-Id of the interrupted stream"),
+    offset: int | None = Query(
+        None, description="Lines already received; defaults to Last-Event-ID", ge=0
+    ),
+):
+    if offset is None:
+        last_event_id = request.headers.get("Last-Event-ID", "0")
+        offset = int(last_event_id) if last_event_id.isdigit() else 0
+    stream = await stream_store.load(id, auth.get_owner())
+    if stream is None:
+        return JSONResponse({"message": "Stream not found or expired"}, status_code=404)
+    return CancellableStreamingResponse(
+        stream.read(offset),
         media_type="application/json",
+        headers={"X-Stream-Id": stream.id},
     )
 
 
 @app.get("/api/query/flash")
 async def query_flash(
-    request: Request,
+    pb: PocketBaseService = Depends(get_pocketbase),
     q: str = Query(..., description="The query word", min_length=1, max_length=100),
     context: str = Query(..., description="The context sentence", max_length=1000),
+    stream: int = Query(
+        1, description="Stream the answer token by token (0=single chunk, 1=streaming)", ge=0, le=1
+    ),
 ):
-    pb: PocketBaseService = request.state.pb
     await pb.balance_check()
-    return StreamingResponse(
-        query_flash_core(context=context, q=q, pb=request.state.pb),
+    return CancellableStreamingResponse(
+        with_timing_event(query_flash_core(context=context, q=q, pb=pb, stream=stream)),
+        media_type="application/json",
+    )
+
+
+@app.post("/api/batch")
+async def batch(body: BatchBody, pb: PocketBaseService = Depends(get_pocketbase)):
+    balance = await pb.balance_check()
+    runners = {
+        "flash": lambda context, q: query_flash_core(pb=pb, context=context, q=q, stream=0),
+        "thinking": lambda context, q: query_thinking_core(pb=pb, context=context, q=q, deep=1),
+        "deep": lambda context, q: query_thinking_core(pb=pb, context=context, q=q, deep=2),
+    }
+    packed_runners = {
+        "flash": lambda context, words: query_flash_packed_core(
+            pb=pb, context=context, words=words
+        ),
+    }
+    return CancellableStreamingResponse(
+        with_timing_event(
+            BatchService(
+                pb, runners, body.concurrency, packed_runners, balance=balance
+            ).run(body.items)
+        ),
         media_type="application/json",
     )
 
 
+@app.websocket("/api/session")
+async def query_session(websocket: WebSocket):
+    runners = {
+        "flash": lambda pb, query: query_flash_core(
+            pb=pb, context=query.context, q=query.q, stream=1
+        ),
+        "thinking": lambda pb, query: query_thinking_core(
+            pb=pb, context=query.context, q=query.q, deep=query.deep
+        ),
+        "freq": lambda pb, query: query_freq_core(pb=pb, q=query.q, page=query.page),
+    }
+    await QuerySession(websocket, runners).run()
+
+
 @app.post("/api/extract-model-test")
-async def extract_model_test(request: Request, body: ExtractBody):
-    completion_service = CompletionService(client=client, pb=request.state.pb)
-    return StreamingResponse(
-        completion_service.extract_model_test(prompt=body.prompt),
+async def extract_model_test(
+    body: ExtractBody, pb: PocketBaseService = Depends(get_pocketbase)
+):
+    completion_service = CompletionService(pb)
+    return CancellableStreamingResponse(
+        with_timing_event(completion_service.extract_model_test(prompt=body.prompt)),
         media_type="application/json",
     )
 
@@ -171,41 +262,72 @@ async def extract_model_test(request: Request, body: ExtractBody):
 @app.get("/api/query/freq-info")
 async def get_freq_info(
     request: Request,
+    auth: RequestAuth = Depends(get_request_auth),
     q: str = Query(..., description="The query word", max_length=100),
     page: int = Query(1, description="The page number", ge=1),
 ):
-    pb: PocketBaseService = request.state.pb
-    result = await pb.corpus_freq_retrieve(q, page)
+    result = await auth.get_client().corpus_freq_lookup(q, page)
     if result is None:
         return JSONResponse({"message": f"{q} not found in database"}, status_code=404)
-    return JSONResponse(result.model_dump())
+    freq_info, version = result
+
+    etag = make_etag("freq", version, str(page), etag_registry.get_epoch("freq"))
+    cache_control = Config.CACHE_CONTROL_FREQ
+    etag_registry.remember(
+        "freq", request.url.path, request.url.query, etag, cache_control
+    )
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return not_modified_response(etag, cache_control)
+
+    pb = await auth.get_pocketbase()
+    await pb.corpus_freq_charge(q, freq_info)
+    return JSONResponse(
+        freq_info.model_dump(), headers={"ETag": etag, "Cache-Control": cache_control}
+    )
 
 
 @app.get("/api/zdic")
 async def get_zdic_only(
-    request: Request, q: str = Query(..., description="The query word", max_length=100)
+    request: Request,
+    auth: RequestAuth = Depends(get_request_auth),
+    q: str = Query(..., description="The query word", max_length=100),
 ):
+    zdic_service = ZdicService(auth.get_client())
     try:
-        result = await ZdicService(request.state.pb).get_result(q)
+        lookup = await zdic_service.lookup(q)
     except ConnectTimeout:
         raise HTTPException(503, "Connection Timeout from zdic")
-    if result is None:
+    if lookup is None:
         raise HTTPException(404, "Empty Response from zdic")
-    return JSONResponse(result.model_dump())
+
+    etag = zdic_service.get_etag(lookup)
+    cache_control = Config.CACHE_CONTROL_ZDIC
+    etag_registry.remember(
+        "zdic", request.url.path, request.url.query, etag, cache_control
+    )
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return not_modified_response(etag, cache_control)
+
+    await auth.get_pocketbase()
+    await zdic_service.charge(q, lookup)
+    return Response(
+        await zdic_service.get_final_json(lookup),
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": cache_control},
+    )
 
 
 @app.get("/api/balance-details")
 async def get_balance(
-    request: Request,
+    pb: PocketBaseService = Depends(get_pocketbase),
     page: int = Query(1, description="The page number"),
 ):
-    pb: PocketBaseService = request.state.pb
     return JSONResponse((await pb.balance_details_list(page=page)).model_dump())
 
 
 @app.get("/api/user")
-def get_user_info(request: Request):
-    auth_result = request.state.pb.latest_auth_result
+async def get_user_info(pb: PocketBaseService = Depends(get_pocketbase)):
+    auth_result = pb.latest_auth_result
     if auth_result is None:
         return JSONResponse(
             {"message": "Not authenticated"},
@@ -216,29 +338,97 @@ def get_user_info(request: Request):
 
 
 @app.post("/api/adopt-answer")
-async def adopt_answer(body: AdoptBody, request: Request):
-    pb: PocketBaseService = request.state.pb
+async def adopt_answer(
+    body: AdoptBody, pb: PocketBaseService = Depends(get_pocketbase)
+):
     corpus_item = await pb.corpus_create_query(body.query, body.context, body.answer)
     return JSONResponse(corpus_item.model_dump())
 
 
 @app.post("/api/auth/register")
-async def register(body: RegisterBody, request: Request):
-    pb: PocketBaseService = request.state.pb
+async def register(
+    body: RegisterBody, pb: PocketBaseService = Depends(get_pocketbase)
+):
     result = await pb.users_guest_upgrade(body.email, body.password)
 
     return JSONResponse(result.model_dump())
 
 
 @app.post("/api/auth/login")
-async def login(body: LoginBody, request: Request):
-    pb: PocketBaseService = request.state.pb
+async def login(body: LoginBody):
+    # Logging in needs no prior auth, so no guest account is created here.
+    pb = PocketBaseService()
     return JSONResponse((await pb.auth_login(body.email, body.password)).model_dump())
 
 
+# Internal capacity and key details: admin only, like the profiler.
+@app.get("/api/status/upstream")
+async def get_upstream_status(pb: PocketBaseService = Depends(get_admin_pocketbase)):
+    return JSONResponse(upstream_scheduler.get_stats().model_dump())
+
+
+@app.get("/api/status/models")
+async def get_models_status(pb: PocketBaseService = Depends(get_admin_pocketbase)):
+    return JSONResponse(
+        {model_id: stats.model_dump() for model_id, stats in model_health.get_stats().items()}
+    )
+
+
+@app.get("/api/status/keys")
+async def get_keys_status(pb: PocketBaseService = Depends(get_admin_pocketbase)):
+    return JSONResponse(
+        {name: stats.model_dump() for name, stats in api_key_pool.get_stats().items()}
+    )
+
+
+@app.get("/api/status/completions")
+async def get_completions_status(pb: PocketBaseService = Depends(get_admin_pocketbase)):
+    return JSONResponse(completion_tracker.get_stats().model_dump())
+
+
+@app.get("/api/status/admission")
+async def get_admission_status(pb: PocketBaseService = Depends(get_admin_pocketbase)):
+    return JSONResponse(admission_controller.get_stats().model_dump())
+
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if Config.METRICS_TOKEN is not None and not compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {Config.METRICS_TOKEN}".encode()
+    ):
+        raise HTTPException(401, "Invalid metrics token")
+    return PlainTextResponse(
+        metrics_registry.render(), media_type=metrics_registry.CONTENT_TYPE
+    )
+
+
+@app.post("/api/admin/profile")
+async def start_profile(body: ProfileBody, pb: PocketBaseService = Depends(get_admin_pocketbase)):
+    try:
+        session = profiler.start(body.mode, body.seconds, body.path, body.requests)
+    except ProfilerBusyError as e:
+        raise HTTPException(409, str(e))
+    return JSONResponse(session.get_status().model_dump())
+
+
+@app.get("/api/admin/profile/{profile_id}")
+async def get_profile(profile_id: str, pb: PocketBaseService = Depends(get_admin_pocketbase)):
+    session = profiler.get(profile_id)
+    if session is None:
+        raise HTTPException(404, "Profile not found")
+    if not session.done:
+        return JSONResponse(session.get_status().model_dump(), status_code=202)
+    body, media_type, filename = session.get_result()
+    return Response(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.get("/")
 async def root():
     return RedirectResponse("/index.html")
 
 
-app.mount("/", StaticFiles(directory="client/dist"), name="static")
+app.mount("/", PrecompressedStaticFiles(directory="client/dist"), name="static")
@@ -1,5 +1,6 @@
 from pocketbase.models.dtos import AuthResult, ListResult, Record
 from pydantic import BaseModel, Field, field_serializer
+from pydantic_core import to_json
 from enum import Enum
 from typing import Literal, Callable, Coroutine, Any, TypeVar, Generic
 from datetime import datetime
@@ -33,6 +34,13 @@ class AiModel(BaseModel):
     prompt_price: int  # 1e-7 RMB/token
     completion_price: int  # 1e-7 RMB/token
     thinking: bool = Field(default=False)
+    max_concurrency: int | None = Field(default=None)
+    # Resilience: tried next when this model fails or misses its first-token SLO.
+    fallback: "AiModel | None" = Field(default=None)
+    first_token_timeout: float | None = Field(default=None)  # seconds
+    hedge: bool = Field(default=False)
+    breaker_failures: int = Field(default=5)
+    breaker_cooldown: float = Field(default=30.0)  # seconds
 
 
 class Note(BaseModel):
@@ -214,6 +222,7 @@ class AiUsage(BaseModel):
     model: AiModel
     prompt_tokens: int
     completion_tokens: int
+    estimated: bool = False  # the stream was cut before the upstream reported usage
 
     def calc_cost(self) -> int:
         return (
@@ -227,12 +236,135 @@ class CompletionChunkResponse(BaseModel):
     content: str
 
 
+class AnswerInfo(BaseModel):
+    answer: str
+    answers: list[str]
+
+
+class BatchItem(BaseModel):
+    id: str = Field(..., max_length=100)
+    context: str = Field(..., max_length=1000)
+    q: str = Field(..., min_length=1, max_length=100)
+    mode: Literal["flash", "thinking", "deep"] = "flash"
+
+
+class ExtractRow(BaseModel):
+    """One question extracted from an exam paper (see `Config.PROMPT_AI_EXTRACT_MODEL_TEST`)."""
+
+    type: str
+    context: str
+    query: str
+    answer: str
+
+
+class SessionQuery(BaseModel):
+    id: str = Field(..., max_length=100)
+    kind: Literal["flash", "thinking", "freq"]
+    q: str = Field(..., min_length=1, max_length=100)
+    context: str = Field("", max_length=1000)
+    deep: int = Field(1, ge=0, le=2)
+    page: int = Field(1, ge=1)
+
+
+class SessionMessage(BaseModel):
+    """A client message on `/api/session`: `auth` first, then `query` and `cancel`."""
+
+    op: Literal["auth", "query", "cancel"]
+    token: str | None = None
+    query: SessionQuery | None = None
+    id: str | None = None
+
+
+class BalanceInfo(BaseModel):
+    balance: int
+    total_spent: int
+
+
+class QueuedInfo(BaseModel):
+    position: int
+    waited: float
+
+
+class TimingSpan(BaseModel):
+    name: str
+    duration_ms: float  # summed over all spans of this name
+    count: int
+
+
+class TimingInfo(BaseModel):
+    total_ms: float
+    spans: list[TimingSpan]
+
+
+class ErrorInfo(BaseModel):
+    message: str
+    retry_after: float | None = None
+
+
+class UpstreamStats(BaseModel):
+    active: int
+    active_by_model: dict[str, int]
+    queued: int
+    queued_by_model: dict[str, int]
+    wait_avg: float
+    wait_p95: float
+    timeouts: int
+
+
+class ApiKeyStats(BaseModel):
+    base_url: str
+    available_requests: float
+    available_tokens: float
+    cooling_down: float
+    requests: int
+    tokens: int
+    throttled: int
+
+
+class AdmissionStats(BaseModel):
+    in_flight: int
+    loop_lag: float
+    rejected: int
+    rate_limited: int
+
+
+class ModelHealthStats(BaseModel):
+    state: Literal["closed", "open", "half-open"]
+    failures: int
+    latency_p95: float | None
+    fallbacks: int
+    hedges: int
+
+
+class CompletionStats(BaseModel):
+    completed: int
+    cancelled: int
+    early_stopped: int
+    tokens_saved: int
+
+
+class ProfileStatus(BaseModel):
+    id: str
+    mode: Literal["sampling", "cprofile"]
+    path: str | None
+    state: Literal["armed", "running", "done"]
+    requests: int
+    samples: int
+
+
 class ZdicExplanations(BaseModel):
     basic: list[str]
     detailed: list[str]
     phrase: list[str]
 
 
+class ZdicLookup(BaseModel):
+    explanations: ZdicExplanations
+    cached: bool
+    version: str
+    size: int  # length of the explanations as JSON
+
+
 class ZdicResult(BaseModel):
     basic_explanations: list[str]
     detailed_explanations: list[str]
@@ -259,6 +391,13 @@ class ServerResponseType(str, Enum):
     SearchOriginal = "search-original"
     Zdic = "zdic"
     FreqInfo = "freq"
+    Queued = "queued"
+    Answer = "answer"
+    Done = "done"
+    ExtractRows = "extract-rows"
+    Balance = "balance"
+    Timing = "timing"
+    Error = "error"
 
 
 class ServerResponseItem(BaseModel):
@@ -278,12 +417,32 @@ class ServerResponseAiUsage(ServerResponseItem):
 
 
 class ServerResponseAi(ServerResponseItem):
+    """
+    One streamed delta; there are hundreds per answer. Only the content is left to
+    the serializer, the rest of the line is prepared once per type.
+    """
+
     data: CompletionChunkResponse
 
     @classmethod
     def create(cls, type: ServerResponseType, data: CompletionChunkResponse):
         return cls(type=type, data=data)
 
+    @classmethod
+    def create_delta(cls, type: ServerResponseType, content: str, stopped: bool):
+        return cls(type=type, data=CompletionChunkResponse(stopped=stopped, content=content))
+
+    def to_jsonl_str(self):
+        prefix = _DELTA_PREFIXES[self.type, self.data.stopped]
+        return prefix + to_json(self.data.content).decode() + "}}\n"
+
+
+_DELTA_PREFIXES = {
+    (type, stopped): f'{{"type":"{type.value}","data":{{"stopped":{"true" if stopped else "false"},"content":'
+    for type in ServerResponseType
+    for stopped in (False, True)
+}
+
 
 class ServerResponseAiFlash(ServerResponseItem):
     type: ServerResponseType = Field(ServerResponseType.AiFlash)
@@ -293,6 +452,9 @@ class ServerResponseAiFlash(ServerResponseItem):
     def create(cls, data: str):
         return cls(type=ServerResponseType.AiFlash, data=data)
 
+    def to_jsonl_str(self):
+        return f'{{"type":"{self.type.value}","data":{to_json(self.data).decode()}}}\n'
+
 
 class ServerResponseZdic(ServerResponseItem):
     type: ServerResponseType = Field(ServerResponseType.Zdic)
@@ -310,3 +472,74 @@ class ServerResponseFreqInfo(ServerResponseItem):
     @classmethod
     def create(cls, data: FreqInfo):
         return cls(type=ServerResponseType.FreqInfo, data=data)
+
+
+class ServerResponseQueued(ServerResponseItem):
+    type: ServerResponseType = Field(ServerResponseType.Queued)
+    data: QueuedInfo
+
+    @classmethod
+    def create(cls, data: QueuedInfo):
+        return cls(type=ServerResponseType.Queued, data=data)
+
+
+class ServerResponseError(ServerResponseItem):
+    type: ServerResponseType = Field(ServerResponseType.Error)
+    data: ErrorInfo
+
+    @classmethod
+    def create(cls, data: ErrorInfo):
+        return cls(type=ServerResponseType.Error, data=data)
+
+
+class ServerResponseAnswer(ServerResponseItem):
+    type: ServerResponseType = Field(ServerResponseType.Answer)
+    data: AnswerInfo
+
+    @classmethod
+    def create(cls, data: AnswerInfo):
+        return cls(type=ServerResponseType.Answer, data=data)
+
+
+class ServerResponseExtractRows(ServerResponseItem):
+    """Rows of an exam paper block as soon as the block is extracted, without duplicates."""
+
+    type: ServerResponseType = Field(ServerResponseType.ExtractRows)
+    data: list[ExtractRow]
+
+    @classmethod
+    def create(cls, data: list[ExtractRow]):
+        return cls(type=ServerResponseType.ExtractRows, data=data)
+
+
+class ServerResponseBalance(ServerResponseItem):
+    """Pushed on a query session after every charge."""
+
+    type: ServerResponseType = Field(ServerResponseType.Balance)
+    data: BalanceInfo
+
+    @classmethod
+    def create(cls, data: BalanceInfo):
+        return cls(type=ServerResponseType.Balance, data=data)
+
+
+class ServerResponseTiming(ServerResponseItem):
+    """Last event of a stream: where its time went."""
+
+    type: ServerResponseType = Field(ServerResponseType.Timing)
+    data: TimingInfo
+
+    @classmethod
+    def create(cls, data: TimingInfo):
+        return cls(type=ServerResponseType.Timing, data=data)
+
+
+class ServerResponseDone(ServerResponseItem):
+    """Marks the end of one item of a batch."""
+
+    type: ServerResponseType = Field(ServerResponseType.Done)
+    data: None = None
+
+    @classmethod
+    def create(cls):
+        return cls(type=ServerResponseType.Done)
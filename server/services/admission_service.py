@@ -0,0 +1,203 @@
+from collections import OrderedDict
+from math import ceil
+from time import monotonic
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from server.config import Config, Roles
+from server.models import AdmissionStats
+from server.services.cache_service import cache_backend
+from server.services.executor_service import loop_watchdog
+from server.services.logging_service import main_logger
+from server.services.scheduler_service import upstream_scheduler
+from server.services.auth_service import AuthorizationMiddleware, RequestAuth, hash_token
+from server.services.metrics_service import admission_rejections_total, metrics_registry
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def take(self) -> float:
+        """Takes one token. Returns 0 on success, otherwise the seconds until one is available."""
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token bucket per key (client IP for guests, user token otherwise), bounded in size."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def take(self, key: str, rate: float, capacity: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+
+class AdmissionController:
+    """
+    Decides whether a new expensive request is admitted, before any auth,
+    PocketBase call or billing. Guests are shed first when the process is
+    saturated; everyone is shed past the hard limit.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.rate_limiter = RateLimiter(Config.RATE_LIMIT_MAX_KEYS)
+        self._token_roles: OrderedDict[str, str] = OrderedDict()
+
+    def remember_role(self, token: str, role_id: str, share: bool = True) -> None:
+        """Records the role behind a token, so later requests can be classified before auth."""
+        key = hash_token(token)
+        if share and cache_backend.shared and self._token_roles.get(key) != role_id:
+            # Other workers then classify the token without authenticating it first.
+            cache_backend.set_soon(f"role:{key}", role_id, Config.CACHE_SESSION_TTL)
+        self._token_roles[key] = role_id
+        self._token_roles.move_to_end(key)
+        if len(self._token_roles) > Config.RATE_LIMIT_MAX_KEYS:
+            self._token_roles.popitem(last=False)
+
+    async def load_role(self, token: str | None) -> None:
+        """Fetches a role another worker recorded, if this one has not seen the token yet."""
+        if token is None or not cache_backend.shared or hash_token(token) in self._token_roles:
+            return
+        role_id = await cache_backend.get(f"role:{hash_token(token)}")
+        if role_id is not None:
+            self.remember_role(token, role_id, share=False)
+
+    def is_guest(self, token: str | None) -> bool:
+        """
+        A token counts as a guest until it has authenticated as a user: anyone can
+        make up a new one per request, so an unknown token gets no bucket of its own.
+        """
+        if token is None:
+            return True
+        role_id = self._token_roles.get(hash_token(token))
+        return role_id is None or role_id == Roles.GUEST.id
+
+    def is_saturated(self) -> bool:
+        return (
+            self.in_flight >= Config.ADMISSION_SOFT_IN_FLIGHT
+            or loop_watchdog.get_lag() >= Config.ADMISSION_MAX_LOOP_LAG
+            or upstream_scheduler.get_queue_depth() >= Config.ADMISSION_MAX_UPSTREAM_QUEUE
+        )
+
+    def evaluate(self, ip_address: str, token: str | None) -> tuple[int, str, float] | None:
+        """Returns the rejection (status code, message, retry after), or None if admitted."""
+        guest = self.is_guest(token)
+
+        if guest:
+            rate, capacity = Config.RATE_LIMIT_GUEST
+            key = f"ip:{ip_address}"
+        else:
+            assert token is not None
+            rate, capacity = Config.RATE_LIMIT_USER
+            key = f"user:{hash_token(token)}"
+        wait = self.rate_limiter.take(key, rate, capacity)
+        if wait > 0:
+            self.rate_limited += 1
+            admission_rejections_total.inc("rate_limited", str(guest).lower())
+            return 429, "Too many requests", wait
+
+        if self.in_flight >= Config.ADMISSION_HARD_IN_FLIGHT or (
+            guest and self.is_saturated()
+        ):
+            self.rejected += 1
+            admission_rejections_total.inc("shed", str(guest).lower())
+            # Sampled: under overload this would otherwise log every request.
+            main_logger.warning(
+                f"Shedding request from {ip_address} (guest={guest}, in_flight={self.in_flight}, "
+                f"lag={loop_watchdog.get_lag() * 1000:.0f}ms, {self.rejected} shed so far)",
+                extra={"category": "admission"},
+            )
+            return 503, "Server busy", Config.ADMISSION_RETRY_AFTER
+
+        return None
+
+    def check(self, ip_address: str, token: str | None) -> JSONResponse | None:
+        """Returns a rejection response, or None if the request is admitted."""
+        rejection = self.evaluate(ip_address, token)
+        return None if rejection is None else self.reject(*rejection)
+
+    def get_stats(self) -> AdmissionStats:
+        return AdmissionStats(
+            in_flight=self.in_flight,
+            loop_lag=loop_watchdog.get_lag(),
+            rejected=self.rejected,
+            rate_limited=self.rate_limited,
+        )
+
+    @classmethod
+    def reject(cls, status_code: int, message: str, retry_after: float) -> JSONResponse:
+        return JSONResponse(
+            {"message": message, "retry_after": retry_after},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, ceil(retry_after)))},
+        )
+
+
+admission_controller = AdmissionController()
+
+metrics_registry.callback_gauge(
+    "wyw_streams_in_flight",
+    "Query streams being served, over HTTP or query sessions.",
+    lambda: admission_controller.in_flight,
+)
+metrics_registry.callback_gauge(
+    "wyw_event_loop_lag_last_seconds",
+    "Latest event loop lag measurement.",
+    loop_watchdog.get_lag,
+)
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware guarding `Config.ADMISSION_PATHS` and counting their in-flight streams."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] not in Config.ADMISSION_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        token = AuthorizationMiddleware.get_token(headers)
+        await admission_controller.load_role(token)
+        rejection = admission_controller.check(
+            AuthorizationMiddleware.get_ip_address(scope, headers), token
+        )
+        if rejection is not None:
+            await rejection(scope, receive, send)
+            return
+
+        admission_controller.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_controller.in_flight -= 1
+
+        auth: RequestAuth | None = scope.get("state", {}).get("auth")
+        role = auth.get_role() if auth is not None else None
+        if token is not None and role is not None:
+            admission_controller.remember_role(token, role.id)
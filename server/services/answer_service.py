@@ -0,0 +1,78 @@
+from json import JSONDecoder
+from re import compile
+
+from server.models import AnswerInfo
+
+
+class AnswerLineParser:
+    """
+    Incrementally finds the `**答案**：` line of a thought answer (see
+    `Config.PROMPT_AI_THOUGHT`). The line is complete once a newline follows it.
+    """
+
+    MARKER = compile(r"(?:^|\n)\*\*答案\*\*[:：]")
+
+    def __init__(self):
+        self.text = ""
+        self.answer_start: int | None = None
+        self.answer: AnswerInfo | None = None
+
+    @classmethod
+    def make_answer(cls, line: str) -> AnswerInfo:
+        return AnswerInfo(
+            answer=line,
+            answers=[answer.strip() for answer in line.split("；") if answer.strip()],
+        )
+
+    def feed(self, content: str) -> AnswerInfo | None:
+        """Returns the answer the first time its line is complete."""
+        if self.answer is not None:
+            return None
+        searched = max(0, len(self.text) - len("\n**答案**："))
+        self.text += content
+
+        if self.answer_start is None:
+            match = self.MARKER.search(self.text, searched)
+            if match is None:
+                return None
+            self.answer_start = match.end()
+
+        rest = self.text[self.answer_start :].lstrip()
+        end = rest.find("\n")
+        if end == -1:
+            return None
+        self.answer = self.make_answer(rest[:end].strip())
+        return self.answer
+
+    def finish(self) -> AnswerInfo | None:
+        """Returns the answer if the stream ended on the answer line without a newline."""
+        if self.answer is not None or self.answer_start is None:
+            return None
+        line = self.text[self.answer_start :].strip()
+        if not line:
+            return None
+        self.answer = self.make_answer(line)
+        return self.answer
+
+
+def parse_packed_answers(content: str, words: list[str]) -> dict[str, str]:
+    """
+    Answers of a packed flash completion (see `Config.PROMPT_FLASH_PACKED`), by word.
+    Every `{"word": ..., "answer": ...}` object is decoded on its own, so code fences,
+    stray text or a truncated array only lose the words they affect.
+    """
+    decoder = JSONDecoder()
+    answers: dict[str, str] = {}
+    index = content.find("{")
+    while index != -1:
+        try:
+            value, end = decoder.raw_decode(content, index)
+        except ValueError:
+            index = content.find("{", index + 1)
+            continue
+        if isinstance(value, dict):
+            word, answer = value.get("word"), value.get("answer")
+            if word in words and isinstance(answer, str) and answer.strip():
+                answers.setdefault(word, answer.strip())
+        index = content.find("{", end)
+    return answers
@@ -0,0 +1,151 @@
+from asyncio import Lock
+from hashlib import sha256
+from secrets import token_hex
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from server.config import Roles
+from server.models import Role
+from server.services.logging_service import main_logger, request_id
+from server.services.pocketbase_service import PocketBaseService
+from server.services.http_cache_service import etag_registry
+from server.services.metrics_service import request_endpoint
+from server.services.timing_service import timed
+
+
+def hash_token(token: str) -> str:
+    """Stands in for a bearer token wherever it is kept: in memory, shared caches or logs."""
+    return sha256(token.encode("utf-8")).hexdigest()[:32]
+
+
+class RequestAuth:
+    """
+    Per-request auth state. Nothing touches PocketBase until a handler asks for
+    the user, and then the request is authenticated exactly once.
+    """
+
+    def __init__(self, ip_address: str, token: str | None):
+        self.ip_address = ip_address
+        self.token = token
+        self._pb: PocketBaseService | None = None
+        self._authenticated = False
+        self._lock = Lock()
+
+    def get_client(self) -> PocketBaseService:
+        """PocketBase client for public collections. Not necessarily authenticated."""
+        if self._pb is None:
+            self._pb = PocketBaseService()
+        return self._pb
+
+    def get_owner(self) -> str:
+        """Identifies who may read back state created by this request, without touching PocketBase."""
+        return f"token:{hash_token(self.token)}" if self.token is not None else f"ip:{self.ip_address}"
+
+    def get_role(self) -> Role | None:
+        """Role of the authenticated user, or None if the request was never authenticated."""
+        if self._pb is None or self._pb.latest_auth_result is None:
+            return None
+        return self._pb.latest_auth_result.user.role
+
+    async def get_pocketbase(self) -> PocketBaseService:
+        """PocketBase client authenticated as the user (or guest) of the request."""
+        async with self._lock:
+            pb = self.get_client()
+            if not self._authenticated:
+                with timed("auth"):
+                    if self.token is not None:
+                        await pb.auth_user(self.token)
+                        main_logger.info(
+                            f"Authenticated user {pb.get_user_id()}", extra={"category": "auth"}
+                        )
+                    else:
+                        await pb.auth_guest(self.ip_address)
+                self._authenticated = True
+            return pb
+
+
+class AuthorizationMiddleware:
+    """
+    Pure ASGI middleware: attaches a lazy `RequestAuth` to `/api/` requests and
+    passes response bodies through untouched, so NDJSON streams are not buffered.
+    """
+
+    API_PREFIX = "/api/"
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    @classmethod
+    def get_ip_address(cls, scope: Scope, headers: Headers) -> str:
+        client = scope.get("client")
+        host = client[0] if client else "Unknown"
+        return headers.get("X-Forwarded-For", host)
+
+    @classmethod
+    def get_request_id(cls, headers: Headers) -> str:
+        """The proxy's `X-Request-Id` when it sends a sane one, otherwise a new id."""
+        incoming = headers.get("X-Request-Id", "")
+        return incoming if 0 < len(incoming) <= 64 and incoming.isprintable() else token_hex(8)
+
+    @classmethod
+    def get_token(cls, headers: Headers) -> str | None:
+        authorization = headers.get("Authorization")
+        if authorization is not None and authorization.startswith("Bearer "):
+            return authorization[len("Bearer ") :]
+        return authorization
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket") or not scope["path"].startswith(
+            self.API_PREFIX
+        ):
+            # Static assets never need auth or a PocketBase client.
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        request_endpoint.set(scope["path"])
+        request_id.set(self.get_request_id(headers))
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        ip_address = self.get_ip_address(scope, headers)
+        main_logger.info(f"Request from {ip_address}", extra={"category": "request"})
+
+        if scope["method"] == "GET":
+            not_modified = etag_registry.match(
+                scope["path"],
+                scope["query_string"].decode("latin-1"),
+                headers.get("If-None-Match"),
+            )
+            if not_modified is not None:
+                await not_modified(scope, receive, send)
+                return
+
+        scope.setdefault("state", {})["auth"] = RequestAuth(
+            ip_address, self.get_token(headers)
+        )
+        await self.app(scope, receive, send)
+
+
+def get_request_auth(request: Request) -> RequestAuth:
+    return request.state.auth
+
+
+async def get_pocketbase(request: Request) -> PocketBaseService:
+    """Dependency for handlers that always act on behalf of the user."""
+    return await get_request_auth(request).get_pocketbase()
+
+
+async def get_admin_pocketbase(request: Request) -> PocketBaseService:
+    """Dependency for admin-only handlers; never creates a guest account."""
+    auth = get_request_auth(request)
+    if auth.token is None:
+        raise HTTPException(401, "Not authenticated")
+    pb = await auth.get_pocketbase()
+    role = auth.get_role()
+    if role is None or role.id != Roles.ADMIN.id:
+        raise HTTPException(403, "Admin only")
+    return pb
@@ -0,0 +1,133 @@
+from asyncio import Queue, Semaphore, create_task, gather
+from json import dumps
+from typing import AsyncIterator, Callable
+
+from server.config import Config
+from server.models import BatchItem, ErrorInfo, ServerResponseDone, ServerResponseError, ServerResponseType
+from server.services.logging_service import main_logger
+from server.services.pocketbase_service import PocketBaseService
+
+BatchRunner = Callable[[str, str], AsyncIterator[str]]
+# Runs several words of one context together; yields (word or None for all of them, line).
+PackedRunner = Callable[[str, list[str]], AsyncIterator[tuple[str | None, str]]]
+# Context, mode, and the item ids asking each word.
+BatchJob = tuple[str, str, dict[str, list[str]]]
+
+_USAGE_PREFIX = f'{{"type":"{ServerResponseType.AiUsage.value}"'
+
+
+class BatchService:
+    """
+    Runs many queries of one user with bounded concurrency, through the same
+    pipelines as the single query endpoints. Identical items run once, items of a
+    mode with a packed runner that share a context run as one request, and all
+    coins spent are charged as one balance detail at the end. Given the balance
+    the user started with, jobs stop starting once the batch has spent more.
+    """
+
+    def __init__(
+        self,
+        pb: PocketBaseService,
+        runners: dict[str, BatchRunner],
+        concurrency: int,
+        packed_runners: dict[str, PackedRunner] | None = None,
+        pack_size: int = Config.FLASH_PACK_SIZE,
+        balance: int | None = None,
+    ):
+        self.pb = pb
+        self.runners = runners
+        self.concurrency = concurrency
+        self.packed_runners = packed_runners or {}
+        self.pack_size = pack_size
+        self.balance = balance
+        self.skipped = 0
+
+    @classmethod
+    def tag(cls, item_ids: list[str], line: str) -> list[str]:
+        """Adds the item id to an NDJSON event line, without re-serializing it."""
+        assert line.startswith("{")
+        return ['{"id":' + dumps(item_id) + "," + line[1:] for item_id in item_ids]
+
+    @classmethod
+    def get_targets(cls, item_ids: list[str], line: str) -> list[str]:
+        """
+        The items an event of a shared request goes to. Usage is reported on the
+        first one only, since clients add it up and it was billed once.
+        """
+        return item_ids[:1] if line.startswith(_USAGE_PREFIX) else item_ids
+
+    def is_over_balance(self) -> bool:
+        return self.balance is not None and self.pb.get_deferred_coins() > self.balance
+
+    def group(self, items: list[BatchItem]) -> list[BatchJob]:
+        packs: dict[tuple[str, str], list[dict[str, list[str]]]] = {}
+        for item in items:
+            limit = self.pack_size if item.mode in self.packed_runners else 1
+            candidates = packs.setdefault((item.context, item.mode), [])
+            pack = next((pack for pack in candidates if item.q in pack), None) or next(
+                (pack for pack in candidates if len(pack) < limit), None
+            )
+            if pack is None:
+                pack = {}
+                candidates.append(pack)
+            pack.setdefault(item.q, []).append(item.id)
+        return [
+            (context, mode, pack)
+            for (context, mode), candidates in packs.items()
+            for pack in candidates
+        ]
+
+    async def _run_job(
+        self, job: BatchJob, semaphore: Semaphore, queue: "Queue[list[str] | None]"
+    ) -> None:
+        context, mode, ids_by_q = job
+        item_ids = [item_id for ids in ids_by_q.values() for item_id in ids]
+        try:
+            async with semaphore:
+                if self.is_over_balance():
+                    # Jobs already running finish and are billed; the rest do not start.
+                    self.skipped += len(item_ids)
+                    error = ServerResponseError.create(ErrorInfo(message="Not enough balance"))
+                    await queue.put(self.tag(item_ids, error.to_jsonl_str()))
+                elif len(ids_by_q) > 1:
+                    packed = self.packed_runners[mode](context, list(ids_by_q))
+                    async for q, line in packed:
+                        targets = item_ids if q is None else ids_by_q[q]
+                        await queue.put(self.tag(self.get_targets(targets, line), line))
+                else:
+                    (q,) = ids_by_q
+                    async for line in self.runners[mode](context, q):
+                        await queue.put(self.tag(self.get_targets(item_ids, line), line))
+        except Exception as e:
+            main_logger.warning(f"Batch item {item_ids[0]} failed: {e}")
+            error = ServerResponseError.create(ErrorInfo(message="Query failed"))
+            await queue.put(self.tag(item_ids, error.to_jsonl_str()))
+        await queue.put(self.tag(item_ids, ServerResponseDone.create().to_jsonl_str()))
+        await queue.put(None)
+
+    async def run(self, items: list[BatchItem]) -> AsyncIterator[str]:
+        """Yields the events of all items as they come, each tagged with its item id."""
+        jobs = self.group(items)
+        semaphore = Semaphore(self.concurrency)
+        queue: "Queue[list[str] | None]" = Queue(maxsize=self.concurrency * 4)
+
+        async with self.pb.deferred_charges(f"批量查询 {len(items)} 项"):
+            tasks = [create_task(self._run_job(job, semaphore, queue)) for job in jobs]
+            try:
+                running = len(tasks)
+                while running:
+                    lines = await queue.get()
+                    if lines is None:
+                        running -= 1
+                        continue
+                    for line in lines:
+                        yield line
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # Let cancelled items bill what they generated into the aggregated charge.
+                await gather(*tasks, return_exceptions=True)
+                if self.skipped:
+                    main_logger.warning(
+                        f"Batch of {len(items)} items ran out of balance ({self.balance}): {self.skipped} skipped"
+                    )
@@ -0,0 +1,374 @@
+from asyncio import (
+    Lock,
+    Queue,
+    QueueEmpty,
+    StreamReader,
+    StreamWriter,
+    Task,
+    create_task,
+    open_connection,
+    sleep,
+    to_thread,
+    wait_for,
+)
+from collections import OrderedDict
+from secrets import token_hex
+from sqlite3 import Connection, Error as SqliteError, connect
+from threading import local
+from time import monotonic, time
+from typing import Any, Callable, TypeVar
+from urllib.parse import urlsplit
+
+from server.config import Config
+from server.services.logging_service import main_logger
+
+T = TypeVar("T")
+
+# Fire-and-forget writes, referenced until done so they are not garbage collected.
+_background: set[Task[None]] = set()
+
+
+class CacheBackendError(Exception):
+    pass
+
+
+class LockTimeoutError(Exception):
+    pass
+
+
+class CacheBackend:
+    """
+    Key-value cache with expiry plus named leases, shared between workers unless
+    `shared` is False. Caches are an optimization: when the backend fails, reads
+    miss and writes are dropped with a warning instead of failing the request.
+    """
+
+    name = "base"
+    shared = True
+    ERRORS = (CacheBackendError, OSError, SqliteError)
+
+    async def _get(self, key: str) -> str | None:
+        raise NotImplementedError
+
+    async def _set(self, key: str, value: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def _delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def _try_lock(self, name: str, token: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    async def _unlock(self, name: str, token: str) -> None:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> str | None:
+        try:
+            return await self._get(key)
+        except self.ERRORS as e:
+            main_logger.warning(f"Cache ({self.name}) get failed: {e}")
+            return None
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        try:
+            await self._set(key, value, ttl)
+        except self.ERRORS as e:
+            main_logger.warning(f"Cache ({self.name}) set failed: {e}")
+
+    async def delete(self, key: str) -> None:
+        try:
+            await self._delete(key)
+        except self.ERRORS as e:
+            main_logger.warning(f"Cache ({self.name}) delete failed: {e}")
+
+    def set_soon(self, key: str, value: str, ttl: float) -> None:
+        """Writes in the background, for callers that must not wait on the backend."""
+        task = create_task(self.set(key, value, ttl))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+    async def acquire(self, name: str, ttl: float, timeout: float) -> str | None:
+        """
+        Takes the lease `name` for `ttl` seconds, waiting up to `timeout`. Returns
+        the token to release it with, or None if the backend is unreachable (the
+        caller then only has its in-process lock).
+        """
+        token = token_hex(8)
+        deadline = monotonic() + timeout
+        delay = 0.005
+        try:
+            while not await self._try_lock(name, token, ttl):
+                if monotonic() >= deadline:
+                    raise LockTimeoutError(f"Lock {name} still held after {timeout}s")
+                await sleep(delay)
+                delay = min(delay * 2, 0.1)
+            return token
+        except self.ERRORS as e:
+            main_logger.error(f"Cache ({self.name}) lock {name} failed: {e}")
+            return None
+
+    async def release(self, name: str, token: str) -> None:
+        try:
+            await self._unlock(name, token)
+        except self.ERRORS as e:
+            main_logger.error(f"Cache ({self.name}) unlock {name} failed: {e}")
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Per-process LRU; the default for a single worker."""
+
+    name = "memory"
+    shared = False
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._locks: dict[str, tuple[str, float]] = {}
+
+    async def _get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def _set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (value, monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    async def _try_lock(self, name: str, token: str, ttl: float) -> bool:
+        held = self._locks.get(name)
+        if held is not None and held[1] > monotonic():
+            return False
+        self._locks[name] = (token, monotonic() + ttl)
+        return True
+
+    async def _unlock(self, name: str, token: str) -> None:
+        held = self._locks.get(name)
+        if held is not None and held[0] == token:
+            del self._locks[name]
+
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    A SQLite file in WAL mode, shared by the workers of one host. On a tmpfs
+    such as /dev/shm it never touches the disk, i.e. it is shared memory.
+    """
+
+    name = "sqlite"
+    PURGE_EVERY = 1000  # writes between sweeps of expired rows
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = local()
+        self._writes = 0
+
+    def _get_connection(self) -> Connection:
+        # sqlite3 connections must stay on the thread that created them.
+        connection: Connection | None = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = connect(self.path, isolation_level=None, timeout=5.0)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, token TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    async def _run(self, func: Callable[[Connection], T]) -> T:
+        return await to_thread(lambda: func(self._get_connection()))
+
+    async def _get(self, key: str) -> str | None:
+        def fetch(connection: Connection):
+            row = connection.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires > ?", (key, time())
+            ).fetchone()
+            return None if row is None else row[0]
+
+        return await self._run(fetch)
+
+    async def _set(self, key: str, value: str, ttl: float) -> None:
+        self._writes += 1
+        purge = self._writes % self.PURGE_EVERY == 0
+
+        def store(connection: Connection):
+            now = time()
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", (key, value, now + ttl)
+            )
+            if purge:
+                connection.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+        await self._run(store)
+
+    async def _delete(self, key: str) -> None:
+        await self._run(lambda connection: connection.execute("DELETE FROM cache WHERE key = ?", (key,)))
+
+    async def _try_lock(self, name: str, token: str, ttl: float) -> bool:
+        def take(connection: Connection) -> bool:
+            now = time()
+            cursor = connection.execute(
+                "INSERT INTO locks (name, token, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET token = excluded.token, expires = excluded.expires "
+                "WHERE locks.expires <= ?",
+                (name, token, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+        return await self._run(take)
+
+    async def _unlock(self, name: str, token: str) -> None:
+        await self._run(
+            lambda connection: connection.execute("DELETE FROM locks WHERE name = ? AND token = ?", (name, token))
+        )
+
+
+class RespConnection:
+    """One connection speaking RESP2, the protocol of Redis, Valkey, KeyDB and friends."""
+
+    def __init__(self, reader: StreamReader, writer: StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    def encode(cls, *args: str | bytes | int | float) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise CacheBackendError("Connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise CacheBackendError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [await self.read_reply() for _ in range(count)]
+        raise CacheBackendError(f"Unexpected reply {line!r}")
+
+    async def call(self, *args: str | bytes | int | float) -> Any:
+        self.writer.write(self.encode(*args))
+        await self.writer.drain()
+        return await self.read_reply()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RespCacheBackend(CacheBackend):
+    """A Redis-protocol server shared by every worker and container, over a small connection pool."""
+
+    name = "resp"
+    # Deletes the lease only if it still holds our token, so an expired lease taken over is left alone.
+    UNLOCK_SCRIPT = 'if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("del", KEYS[1]) else return 0 end'
+
+    def __init__(self, url: str, pool_size: int, timeout: float):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.username = parts.username
+        self.password = parts.password
+        self.db = int(parts.path.strip("/") or 0)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle: Queue[RespConnection] = Queue()
+        self._opened = 0
+        self._open_lock = Lock()
+
+    async def _connect(self) -> RespConnection:
+        reader, writer = await wait_for(open_connection(self.host, self.port), self.timeout)
+        connection = RespConnection(reader, writer)
+        if self.password is not None:
+            if self.username:
+                await connection.call("AUTH", self.username, self.password)
+            else:
+                await connection.call("AUTH", self.password)
+        if self.db:
+            await connection.call("SELECT", self.db)
+        return connection
+
+    async def _checkout(self) -> RespConnection:
+        try:
+            return self._idle.get_nowait()
+        except QueueEmpty:
+            pass
+        async with self._open_lock:
+            if self._opened < self.pool_size:
+                connection = await self._connect()
+                self._opened += 1
+                return connection
+        return await wait_for(self._idle.get(), self.timeout)
+
+    async def call(self, *args: str | bytes | int | float) -> Any:
+        connection = await self._checkout()
+        try:
+            reply = await wait_for(connection.call(*args), self.timeout)
+        except CacheBackendError as e:
+            if str(e).startswith(("ERR", "WRONGTYPE", "NOSCRIPT")):
+                # A command error leaves the connection in sync; anything else may not.
+                self._idle.put_nowait(connection)
+            else:
+                self._discard(connection)
+            raise
+        except BaseException:
+            self._discard(connection)
+            raise
+        self._idle.put_nowait(connection)
+        return reply
+
+    def _discard(self, connection: RespConnection) -> None:
+        connection.close()
+        self._opened -= 1
+
+    async def _get(self, key: str) -> str | None:
+        value = await self.call("GET", key)
+        return None if value is None else value.decode()
+
+    async def _set(self, key: str, value: str, ttl: float) -> None:
+        await self.call("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    async def _delete(self, key: str) -> None:
+        await self.call("DEL", key)
+
+    async def _try_lock(self, name: str, token: str, ttl: float) -> bool:
+        return await self.call("SET", name, token, "NX", "PX", max(1, int(ttl * 1000))) == "OK"
+
+    async def _unlock(self, name: str, token: str) -> None:
+        await self.call("EVAL", self.UNLOCK_SCRIPT, 1, name, token)
+
+
+def get_cache_backend() -> CacheBackend:
+    if Config.CACHE_BACKEND == "sqlite":
+        return SqliteCacheBackend(Config.CACHE_SQLITE_PATH)
+    if Config.CACHE_BACKEND == "resp":
+        return RespCacheBackend(Config.CACHE_RESP_URL, Config.CACHE_RESP_POOL, Config.CACHE_RESP_TIMEOUT)
+    return MemoryCacheBackend(Config.CACHE_MEMORY_MAX_ENTRIES)
+
+
+cache_backend = get_cache_backend()
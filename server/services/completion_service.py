@@ -1,26 +1,195 @@
-from typing import Literal
-from openai import AsyncOpenAI
-from openai import AsyncStream
-from openai.types.chat import ChatCompletionChunk
+from asyncio import Queue, Semaphore, create_task, gather, shield
+from json import dumps
+from time import perf_counter
+from typing import Literal, Callable, AsyncIterator, TypeVar
+from openai import AsyncStream, NotGiven, NOT_GIVEN
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
 from server.config import Config
 from server.models import (
     AiModel,
     AiUsage,
+    Role,
+    ErrorInfo,
+    ServerResponseItem,
     ServerResponseType,
     CompletionChunkResponse,
     ServerResponseAiUsage,
     ServerResponseAi,
     ServerResponseAiFlash,
+    ServerResponseQueued,
+    ServerResponseError,
+    ServerResponseAnswer,
+    ServerResponseExtractRows,
+    CompletionStats,
+    ExtractRow,
 )
 from server.services.pocketbase_service import PocketBaseService
+from server.services.scheduler_service import (
+    upstream_scheduler,
+    scheduled_ticket,
+    UpstreamQueueTimeoutError,
+)
+from server.services.resilience_service import model_health, upstream_deadline, UpstreamUnavailableError
+from server.services.key_pool_service import ApiKeyPool, PooledKey, api_key_pool
+from server.services.answer_service import AnswerLineParser, parse_packed_answers
+from server.services.extract_service import (
+    split_exam_blocks,
+    parse_extract_rows,
+    ExtractRowMerger,
+)
+from server.services.logging_service import main_logger
+from server.services.metrics_service import (
+    llm_completion_seconds,
+    llm_first_token_seconds,
+    llm_tokens_total,
+    request_endpoint,
+)
+from server.services.streaming_service import coalesce_deltas
+from server.services.timing_service import record_span, timed
+
+T = TypeVar("T")
+
+
+class OpenedStream:
+    """An upstream completion stream whose first chunk has already arrived."""
+
+    def __init__(
+        self,
+        model: AiModel,
+        key: PooledKey,
+        estimated_tokens: int,
+        prompt_tokens: int,
+        stream: AsyncStream[ChatCompletionChunk],
+        first: ChatCompletionChunk | None,
+        sent_at: float,
+    ):
+        self.model = model
+        self.key = key
+        self.estimated_tokens = estimated_tokens
+        self.prompt_tokens = prompt_tokens
+        self.stream = stream
+        self.first = first
+        self.sent_at = sent_at
+
+    async def __aiter__(self):
+        if self.first is not None:
+            yield self.first
+        async for chunk in self.stream:
+            yield chunk
+
+    async def close(self) -> None:
+        await self.stream.close()
+
+
+class CompletionTracker:
+    """Counts completions cut short (client gone, or early stop) and the completion tokens that saved."""
+
+    def __init__(self):
+        self.completed = 0
+        self.cancelled = 0
+        self.early_stopped = 0
+        self.tokens_saved = 0
+        self._average_tokens: dict[str, float] = {}
+
+    def record_completed(self, model: AiModel, completion_tokens: int) -> None:
+        self.completed += 1
+        average = self._average_tokens.get(model.id)
+        self._average_tokens[model.id] = (
+            completion_tokens if average is None else 0.9 * average + 0.1 * completion_tokens
+        )
+
+    def record_cut(self, model: AiModel, completion_tokens: int, early_stop: bool) -> None:
+        """Tokens saved are estimated against the model's average full completion."""
+        if early_stop:
+            self.early_stopped += 1
+        else:
+            self.cancelled += 1
+        average = self._average_tokens.get(model.id)
+        if average is not None:
+            self.tokens_saved += max(0, round(average - completion_tokens))
+
+    def get_stats(self) -> CompletionStats:
+        return CompletionStats(
+            completed=self.completed,
+            cancelled=self.cancelled,
+            early_stopped=self.early_stopped,
+            tokens_saved=self.tokens_saved,
+        )
+
+
+completion_tracker = CompletionTracker()
+
+
+def record_usage_metrics(usage: AiUsage) -> None:
+    endpoint = request_endpoint.get()
+    llm_tokens_total.inc(endpoint, usage.model.id, "prompt", amount=usage.prompt_tokens)
+    llm_tokens_total.inc(endpoint, usage.model.id, "completion", amount=usage.completion_tokens)
 
 
 class CompletionService:
-    def __init__(self, client: AsyncOpenAI, pb: PocketBaseService):
-        self.client = client
+    def __init__(self, pb: PocketBaseService, key_pool: ApiKeyPool = api_key_pool):
+        self.key_pool = key_pool
         self.pb = pb
 
+    def get_role(self) -> Role | None:
+        auth_result = self.pb.latest_auth_result
+        return None if auth_result is None else auth_result.user.role
+
+    async def _scheduled(
+        self,
+        model: AiModel,
+        stream_factory: Callable[[], AsyncIterator[T]],
+    ) -> AsyncIterator[T | ServerResponseItem]:
+        """Runs `stream_factory` once the upstream scheduler grants a slot, reporting the queue meanwhile."""
+        async with upstream_scheduler.slot(model, self.get_role()) as ticket:
+            try:
+                with timed("queue"):
+                    async for queued in ticket.wait():
+                        yield ServerResponseQueued.create(queued)
+            except UpstreamQueueTimeoutError:
+                yield ServerResponseError.create(
+                    ErrorInfo(
+                        message="Upstream model is busy, please retry later.",
+                        retry_after=max(1.0, upstream_scheduler.get_stats().wait_p95),
+                    )
+                )
+                return
+
+            outer_ticket = scheduled_ticket.get()
+            scheduled_ticket.set(ticket)
+            items = stream_factory()
+            if Config.STREAM_COALESCE_INTERVAL > 0:
+                items = coalesce_deltas(
+                    items, Config.STREAM_COALESCE_INTERVAL, Config.STREAM_COALESCE_BYTES
+                )
+            try:
+                async for item in items:
+                    yield item
+            except UpstreamUnavailableError:
+                yield ServerResponseError.create(
+                    ErrorInfo(
+                        message="Upstream model is unavailable, please retry later.",
+                        retry_after=model.breaker_cooldown,
+                    )
+                )
+            finally:
+                scheduled_ticket.set(outer_ticket)
+
+    @classmethod
+    async def _move_slot(cls, candidate: AiModel) -> None:
+        """Moves the request's scheduler slot to the model the fallback chain is about to try."""
+        ticket = scheduled_ticket.get()
+        if ticket is None or ticket.model_id == candidate.id:
+            return
+        # Waiting for a slot, like waiting for key quota, is not the model's latency.
+        deadline = upstream_deadline.get()
+        if deadline is not None:
+            deadline.pause()
+        await upstream_scheduler.move(ticket, candidate)
+        if deadline is not None:
+            deadline.restart()
+
     async def _send_request(
         self,
         model: AiModel,
@@ -28,7 +197,10 @@ class CompletionService:
         user_prompt: str,
         temperature: float,
         search: Literal["no", "optional", "force"],
-    ):
+        max_tokens: int | NotGiven = NOT_GIVEN,
+        top_p: float | NotGiven = NOT_GIVEN,
+    ) -> tuple[PooledKey, int, AsyncStream[ChatCompletionChunk]]:
+        """Sends the request with a key from the pool. Returns the key and its token reservation too."""
         if search == "no":
             extra_body = {"enable_search": False}
         elif search == "optional":
@@ -42,124 +214,470 @@ class CompletionService:
             extra_body["enable_thinking"] = True
         else:
             extra_body["enable_thinking"] = False
-        return await self.client.chat.completions.create(
-            model=model.id,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            stream=True,
-            temperature=temperature,
-            stream_options={"include_usage": True},
-            extra_body=extra_body,
+        estimated_tokens = ApiKeyPool.estimate_tokens(
+            system_prompt,
+            user_prompt,
+            completion=(
+                Config.API_KEY_COMPLETION_ESTIMATE
+                if isinstance(max_tokens, NotGiven)
+                else max_tokens
+            ),
+        )
+
+        async def send(key: PooledKey):
+            return key, estimated_tokens, await key.client.chat.completions.create(
+                model=model.id,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                stream=True,
+                temperature=temperature,
+                top_p=top_p,
+                max_tokens=max_tokens,
+                stream_options={"include_usage": True},
+                extra_body=extra_body,
+            )
+
+        return await self.key_pool.call(estimated_tokens, send)
+
+    async def _open_stream(
+        self,
+        model: AiModel,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float,
+        search: Literal["no", "optional", "force"],
+        max_tokens: int | NotGiven = NOT_GIVEN,
+        top_p: float | NotGiven = NOT_GIVEN,
+    ) -> OpenedStream:
+        """Opens a stream on the model or its fallbacks, once one of them produces a first chunk."""
+
+        async def open_stream(candidate: AiModel) -> OpenedStream:
+            await self._move_slot(candidate)
+            sent_at = perf_counter()
+            key, estimated_tokens, stream = await self._send_request(
+                candidate, system_prompt, user_prompt, temperature, search, max_tokens, top_p
+            )
+            try:
+                first = await anext(stream)
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                await stream.close()
+                raise
+            llm_first_token_seconds.observe(perf_counter() - sent_at, candidate.id)
+            record_span("llm-first-token", sent_at)
+            return OpenedStream(
+                candidate,
+                key,
+                estimated_tokens,
+                ApiKeyPool.estimate_tokens(system_prompt, user_prompt),
+                stream,
+                first,
+                sent_at,
+            )
+
+        _, opened = await model_health.call_with_fallback(model, open_stream)
+        return opened
+
+    async def _charge(self, response: OpenedStream, usage: AiUsage, completion_type: str):
+        response.key.record_usage(
+            response.estimated_tokens, usage.prompt_tokens + usage.completion_tokens
+        )
+        llm_completion_seconds.observe(perf_counter() - response.sent_at, response.model.id, "true")
+        record_span("llm", response.sent_at)
+        record_usage_metrics(usage)
+        await self.pb.users_spend_coins(usage.calc_cost(), reason=f"AI {completion_type}")
+
+    @classmethod
+    def _estimate_usage(cls, response: OpenedStream, generated: str) -> AiUsage:
+        return AiUsage(
+            model=response.model,
+            prompt_tokens=response.prompt_tokens,
+            completion_tokens=ApiKeyPool.estimate_tokens(generated),
+            estimated=True,
         )
 
+    async def _cut(
+        self, response: OpenedStream, generated: str, completion_type: str, early_stop: bool
+    ) -> AiUsage:
+        """Closes the upstream stream and bills an estimate of what it generated so far."""
+        await response.close()
+        usage = self._estimate_usage(response, generated)
+        completion_tracker.record_cut(response.model, usage.completion_tokens, early_stop)
+        await self._charge(response, usage, completion_type)
+        return usage
+
     async def _process_response(
         self,
-        response: AsyncStream[ChatCompletionChunk],
+        response: OpenedStream,
         response_type: ServerResponseType,
-        model: AiModel,
         completion_type: str,
+        answer_parser: AnswerLineParser | None = None,
     ):
+        model = response.model
         reasoning = False
-        async for answer in response:
-            if answer.usage:
-                usage = AiUsage(
-                    model=model,
-                    prompt_tokens=answer.usage.prompt_tokens,
-                    completion_tokens=answer.usage.completion_tokens,
+        generated = ""
+        billed = False
+        try:
+            async for answer in response:
+                if answer.usage:
+                    usage = AiUsage(
+                        model=model,
+                        prompt_tokens=answer.usage.prompt_tokens,
+                        completion_tokens=answer.usage.completion_tokens,
+                    )
+                    billed = True
+                    await self._charge(response, usage, completion_type)
+                    completion_tracker.record_completed(model, usage.completion_tokens)
+                    yield ServerResponseAiUsage.create(usage)
+                    break
+                delta = answer.choices[0].delta
+                try:
+                    reasoning_content: str | None = delta.reasoning_content  # type: ignore
+                    assert reasoning_content is None or isinstance(reasoning_content, str)
+                except AttributeError:
+                    reasoning_content = None
+
+                # Special in Qwen3
+                if reasoning_content is not None:
+                    if not reasoning:
+                        content = "**思考**：" + reasoning_content
+                        reasoning = True
+                    else:
+                        content = reasoning_content
+                else:
+                    if reasoning:
+                        content = "\n" + (delta.content or "")
+                        reasoning = False
+                    else:
+                        content = delta.content or ""
+
+                generated += content
+                parsed = (
+                    answer_parser.feed(delta.content)
+                    if answer_parser is not None and delta.content
+                    else None
                 )
-                await self.pb.users_spend_coins(
-                    usage.calc_cost(), reason=f"AI {completion_type}"
+                stopping = parsed is not None and Config.THOUGHT_EARLY_STOP
+
+                yield ServerResponseAi.create_delta(
+                    response_type,
+                    content,
+                    stopped=stopping or bool(answer.choices[0].finish_reason),
                 )
-                yield ServerResponseAiUsage.create(usage)
-                break
-            delta = answer.choices[0].delta
-            try:
-                reasoning_content: str | None = delta.reasoning_content  # type: ignore
-                assert reasoning_content is None or isinstance(reasoning_content, str)
-            except AttributeError:
-                reasoning_content = None
-
-            # Special in Qwen3
-            if reasoning_content is not None:
-                if not reasoning:
-                    content = "**思考**：" + reasoning_content
-                    reasoning = True
-                else:
-                    content = reasoning_content
+                if parsed is not None:
+                    yield ServerResponseAnswer.create(parsed)
+
+                if stopping:
+                    billed = True
+                    usage = await self._cut(response, generated, completion_type, early_stop=True)
+                    yield ServerResponseAiUsage.create(usage)
+                    break
             else:
-                if reasoning:
-                    content = "\n" + (delta.content or "")
-                    reasoning = False
-                else:
-                    content = delta.content or ""
-
-            yield ServerResponseAi.create(
-                type=response_type,
-                data=CompletionChunkResponse(
-                    stopped=bool(answer.choices[0].finish_reason),
-                    content=content,
-                ),
-            )
+                # Some upstreams end the stream without a usage chunk: a full completion all the same.
+                main_logger.warning(f"Model {model.id} sent no usage, billing an estimate")
+                billed = True
+                usage = self._estimate_usage(response, generated)
+                await self._charge(response, usage, completion_type)
+                completion_tracker.record_completed(model, usage.completion_tokens)
+                yield ServerResponseAiUsage.create(usage)
+        except Exception:
+            if not billed:
+                # The upstream failed mid-stream: bill what arrived, but nothing was cancelled.
+                billed = True
+                await response.close()
+                await self._charge(response, self._estimate_usage(response, generated), completion_type)
+            raise
+        finally:
+            if not billed:
+                # The client went away before the stream ended: stop generating, but
+                # still bill what was generated, even though this task is being cancelled.
+                await shield(self._cut(response, generated, completion_type, early_stop=False))
+
+        # The stream may end on the answer line itself.
+        parsed = answer_parser.finish() if answer_parser is not None else None
+        if parsed is not None:
+            yield ServerResponseAnswer.create(parsed)
+
+    async def _complete(
+        self, model: AiModel, system_prompt: str, user_prompt: str, max_tokens: int
+    ) -> tuple[AiModel, ChatCompletion]:
+        """A regular (non-streaming) flash-style completion, on the model or its fallbacks."""
+        estimated_tokens = ApiKeyPool.estimate_tokens(
+            system_prompt, user_prompt, completion=max_tokens
+        )
+
+        async def complete(candidate: AiModel):
+            await self._move_slot(candidate)
+
+            async def send(key: PooledKey):
+                sent_at = perf_counter()
+                response = await key.client.chat.completions.create(
+                    model=candidate.id,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    temperature=0.3,
+                    top_p=0.95,
+                    max_tokens=max_tokens,
+                    extra_body={"enable_thinking": False},
+                )
+                llm_completion_seconds.observe(perf_counter() - sent_at, candidate.id, "false")
+                record_span("llm", sent_at)
+                if response.usage is not None:
+                    key.record_usage(estimated_tokens, response.usage.total_tokens)
+                return response
+
+            async def call():
+                return await self.key_pool.call(estimated_tokens, send)
+
+            return await model_health.hedged(candidate, call) if candidate.hedge else await call()
+
+        return await model_health.call_with_fallback(model, complete)
+
+    async def generate_flash_response(self, context: str, q: str, stream: bool = True):
+        if stream:
+            async for chunk in self._generate_flash_stream(context, q):
+                yield chunk
+            return
 
-    async def generate_flash_response(self, context: str, q: str):
         # Unnecessary for streaming response, using regular completion instead.
+        user_prompt = f"请解释古文“{context}”中，“{q}”的含义。"
+
+        async def stream():
+            model, response = await self._complete(
+                Config.WYW_FLASH_MODEL, Config.PROMPT_FLASH, user_prompt, max_tokens=100
+            )
+            content = response.choices[0].message.content
+
+            if not content:
+                raise ValueError("Empty response from ai flash model")
+
+            assert response.usage is not None
+            usage = AiUsage(
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+                model=model,
+            )
+
+            record_usage_metrics(usage)
+            await self.pb.users_spend_coins(coins=usage.calc_cost(), reason=f"AI 快速回答")
+
+            yield ServerResponseAiUsage.create(usage)
+
+            yield ServerResponseAiFlash.create(data=content)
+
+        async for chunk in self._scheduled(Config.WYW_FLASH_MODEL, stream):
+            yield chunk
+
+    async def generate_packed_flash_response(
+        self, context: str, words: list[str]
+    ) -> AsyncIterator[tuple[str | None, ServerResponseItem]]:
+        """
+        Flash answers for several words of one context, asked in a single completion.
+        Each event comes with its word, or None when it concerns the whole pack. Words
+        missing from the model's JSON are asked again one by one.
+        """
         model = Config.WYW_FLASH_MODEL
-        response = await self.client.chat.completions.create(
-            model=model.id,
-            messages=[
-                {"role": "system", "content": Config.PROMPT_FLASH},
-                {"role": "user", "content": f"请解释古文“{context}”中，“{q}”的含义。"},
-            ],
-            temperature=0.3,
-            top_p=0.95,
-            max_tokens=100,
-            extra_body={"enable_thinking": False},
-        )
-        content = response.choices[0].message.content
+        user_prompt = f"请解释古文“{context}”中，以下词语的含义：{dumps(words, ensure_ascii=False)}"
+        answers: dict[str, str] = {}
 
-        if not content:
-            raise ValueError("Empty response from ai flash model")
+        async def stream():
+            model_used, response = await self._complete(
+                model,
+                Config.PROMPT_FLASH_PACKED,
+                user_prompt,
+                max_tokens=Config.FLASH_PACK_TOKENS_PER_WORD * len(words),
+            )
 
-        assert response.usage is not None
-        usage = AiUsage(
-            prompt_tokens=response.usage.prompt_tokens,
-            completion_tokens=response.usage.completion_tokens,
-            model=model,
-        )
+            assert response.usage is not None
+            usage = AiUsage(
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+                model=model_used,
+            )
+            record_usage_metrics(usage)
+            await self.pb.users_spend_coins(coins=usage.calc_cost(), reason=f"AI 快速回答")
+            yield None, ServerResponseAiUsage.create(usage)
 
-        await self.pb.users_spend_coins(coins=usage.calc_cost(), reason=f"AI 快速回答")
+            answers.update(parse_packed_answers(response.choices[0].message.content or "", words))
+            for word, answer in answers.items():
+                yield word, ServerResponseAiFlash.create(data=answer)
 
-        yield ServerResponseAiUsage.create(usage)
+        async for chunk in self._scheduled(model, stream):
+            if not isinstance(chunk, tuple):
+                yield None, chunk
+                if isinstance(chunk, ServerResponseError):
+                    return
+                continue
+            yield chunk
 
-        yield ServerResponseAiFlash.create(data=content)
+        missing = [word for word in words if word not in answers]
+        if missing:
+            main_logger.warning(
+                f"Packed flash answer missed {len(missing)}/{len(words)} words, asking separately"
+            )
+        for word in missing:
+            async for item in self.generate_flash_response(context, word, stream=False):
+                yield word, item
+
+    async def _generate_flash_stream(self, context: str, q: str):
+        """Flash answer as incremental `ai-flash` chunks; usage is billed when the stream ends."""
+        model = Config.WYW_FLASH_MODEL
+
+        async def stream():
+            response = await self._open_stream(
+                model=model,
+                system_prompt=Config.PROMPT_FLASH,
+                user_prompt=f"请解释古文“{context}”中，“{q}”的含义。",
+                temperature=0.3,
+                search="no",
+                max_tokens=100,
+                top_p=0.95,
+            )
+
+            async for chunk in self._process_response(
+                response, ServerResponseType.AiFlash, "快速回答"
+            ):
+                if isinstance(chunk, ServerResponseAi):
+                    if chunk.data.content:
+                        yield ServerResponseAiFlash.create(data=chunk.data.content)
+                else:
+                    yield chunk
+
+        async for chunk in self._scheduled(model, stream):
+            yield chunk
 
     async def generate_thought_response(self, context: str, q: str, zdic_prompt: str, deep: bool):
         model = Config.WYW_THINKING_MODEL_DEEP if deep else Config.WYW_THINKING_MODEL
-        response = await self._send_request(
-            model=model,
-            system_prompt=Config.PROMPT_AI_THOUGHT,
-            user_prompt=f"请解释古文“{context}”中，“{q}”的含义。{zdic_prompt}",
-            temperature=0.5,
-            search="no",
-        )
 
-        async for chunk in self._process_response(
-            response, ServerResponseType.AiThinking, model, "深度思考"
-        ):
+        async def stream():
+            response = await self._open_stream(
+                model=model,
+                system_prompt=Config.PROMPT_AI_THOUGHT,
+                user_prompt=f"请解释古文“{context}”中，“{q}”的含义。{zdic_prompt}",
+                temperature=0.5,
+                search="no",
+            )
+
+            async for chunk in self._process_response(
+                response, ServerResponseType.AiThinking, "深度思考", AnswerLineParser()
+            ):
+                yield chunk
+
+        async for chunk in self._scheduled(model, stream):
             yield chunk
 
     async def extract_model_test(self, prompt: str):
-        response = await self._send_request(
-            model=Config.LONG_MODEL,
-            system_prompt=Config.PROMPT_AI_EXTRACT_MODEL_TEST,
-            user_prompt=prompt,
-            temperature=0.5,
-            search="no",
-        )
+        blocks = split_exam_blocks(prompt)
+        if len(blocks) > 1:
+            async with self.pb.deferred_charges("AI 提取模卷"):
+                async for chunk in self._extract_blocks(blocks):
+                    yield chunk.to_jsonl_str()
+            return
 
-        async for chunk in self._process_response(
-            response, ServerResponseType.AiExtract, Config.LONG_MODEL, "提取模卷"
-        ):
+        model = Config.LONG_MODEL
+
+        async def stream():
+            response = await self._open_stream(
+                model=model,
+                system_prompt=Config.PROMPT_AI_EXTRACT_MODEL_TEST,
+                user_prompt=prompt,
+                temperature=0.5,
+                search="no",
+            )
+
+            async for chunk in self._process_response(
+                response, ServerResponseType.AiExtract, "提取模卷"
+            ):
+                yield chunk
+
+        async for chunk in self._scheduled(model, stream):
             yield chunk.to_jsonl_str()
+
+    async def _extract_block(self, block: str, usages: list[AiUsage]) -> list[ExtractRow]:
+        model = Config.LONG_MODEL
+
+        async def stream():
+            response = await self._open_stream(
+                model=model,
+                system_prompt=Config.PROMPT_AI_EXTRACT_SECTION,
+                user_prompt=block,
+                temperature=0.5,
+                search="no",
+            )
+
+            async for chunk in self._process_response(
+                response, ServerResponseType.AiExtract, "提取模卷"
+            ):
+                yield chunk
+
+        text = ""
+        async for chunk in self._scheduled(model, stream):
+            if isinstance(chunk, ServerResponseAi):
+                text += chunk.data.content
+            elif isinstance(chunk, ServerResponseAiUsage):
+                usages.append(chunk.data)
+            elif isinstance(chunk, ServerResponseError):
+                raise ValueError(chunk.data.message)
+        return parse_extract_rows(text)
+
+    async def _extract_blocks(self, blocks: list[str]) -> AsyncIterator[ServerResponseItem]:
+        """
+        Extracts the question blocks of a paper concurrently, streaming the rows of each
+        block when it is done, then the merged CSV and the summed usage.
+        """
+        merger = ExtractRowMerger()
+        semaphore = Semaphore(Config.EXTRACT_CONCURRENCY)
+        queue: "Queue[list[ExtractRow] | None]" = Queue()
+        usages: list[AiUsage] = []
+        failed = 0
+
+        async def run_block(block: str) -> None:
+            nonlocal failed
+            try:
+                async with semaphore:
+                    rows = await self._extract_block(block, usages)
+            except Exception as e:
+                main_logger.warning(f"Extracting an exam block failed: {e}")
+                failed += 1
+                rows = []
+            await queue.put(merger.add(rows))
+            await queue.put(None)
+
+        tasks = [create_task(run_block(block)) for block in blocks]
+        try:
+            running = len(tasks)
+            while running:
+                rows = await queue.get()
+                if rows is None:
+                    running -= 1
+                elif rows:
+                    yield ServerResponseExtractRows.create(rows)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Cancelled blocks still bill what they generated.
+            await gather(*tasks, return_exceptions=True)
+
+        content = f"\n```csv\n{merger.to_csv()}```\n"
+        if failed:
+            content = f"\n{failed}/{len(blocks)} 个题块提取失败。\n{content}"
+        yield ServerResponseAi.create(
+            type=ServerResponseType.AiExtract,
+            data=CompletionChunkResponse(stopped=True, content=content),
+        )
+        if not usages:
+            yield ServerResponseError.create(ErrorInfo(message="Extraction failed"))
+            return
+        yield ServerResponseAiUsage.create(
+            AiUsage(
+                model=usages[0].model,
+                prompt_tokens=sum(usage.prompt_tokens for usage in usages),
+                completion_tokens=sum(usage.completion_tokens for usage in usages),
+                estimated=any(usage.estimated for usage in usages),
+            )
+        )
@@ -0,0 +1,120 @@
+from asyncio import AbstractEventLoop, get_running_loop
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from sys import _current_frames
+from threading import Event, Thread, get_ident
+from time import monotonic, perf_counter
+from traceback import format_stack
+from typing import Callable, TypeVar
+
+from server.config import Config
+from server.services.logging_service import main_logger
+from server.services.metrics_service import loop_lag_seconds, loop_stalls_total
+from server.services.timing_service import record_span
+
+T = TypeVar("T")
+
+
+class CpuExecutor:
+    """
+    The one place CPU-bound work leaves the event loop. A thread pool keeps the
+    loop responsive (the GIL is handed back every few milliseconds); a process
+    pool also runs the work in parallel, but then `func` and its arguments must
+    be picklable, i.e. module-level functions and plain data or pydantic models.
+    """
+
+    def __init__(self, kind: str, workers: int):
+        self.kind = kind
+        self.workers = workers
+        self._executor: Executor | None = None
+
+    def get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="cpu")
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        started = perf_counter()
+        loop = get_running_loop()
+        try:
+            if self.kind == "process":
+                return await loop.run_in_executor(self.get_executor(), func, *args)
+            # Threads keep the request's context, so its logs still carry the request id.
+            return await loop.run_in_executor(self.get_executor(), partial(copy_context().run, func, *args))
+        finally:
+            record_span("cpu", started)
+
+
+cpu_executor = CpuExecutor(Config.CPU_EXECUTOR, Config.CPU_EXECUTOR_WORKERS)
+
+
+async def run_cpu(func: Callable[..., T], *args) -> T:
+    return await cpu_executor.run(func, *args)
+
+
+class LoopWatchdog:
+    """
+    A heartbeat the event loop bumps every `interval`; how late it comes is the
+    loop lag, the one measurement admission control and the metrics read. A
+    thread watches the beat too: when it is more than `threshold` late, some
+    callback is blocking the loop, and its stack is taken from the loop thread
+    right then and logged, once per stall.
+    """
+
+    def __init__(self, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._lag = 0.0
+        self._beat = monotonic()
+        self._loop: AbstractEventLoop | None = None
+        self._loop_thread = 0
+        self._stopped = Event()
+
+    def start(self) -> None:
+        if self._loop is not None:
+            return
+        self._loop = get_running_loop()
+        self._loop_thread = get_ident()
+        self._beat = monotonic()
+        self._heartbeat()
+        if self.threshold > 0:
+            Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def get_lag(self) -> float:
+        """The last measured lag, or how late the pending beat already is if that is more."""
+        if self._loop is None:
+            return self._lag
+        return max(self._lag, monotonic() - self._beat - self.interval)
+
+    def _heartbeat(self) -> None:
+        now = monotonic()
+        self._lag = max(0.0, now - self._beat - self.interval)
+        self._beat = now
+        loop_lag_seconds.observe(self._lag)
+        if self._loop is not None and not self._stopped.is_set():
+            self._loop.call_later(self.interval, self._heartbeat)
+
+    def _watch(self) -> None:
+        reported = 0.0
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            late = monotonic() - beat - self.interval
+            if late < self.threshold or beat == reported:
+                continue
+            reported = beat
+            self.stalls += 1
+            loop_stalls_total.inc()
+            frame = _current_frames().get(self._loop_thread)
+            stack = "".join(format_stack(frame)) if frame is not None else "(no frame)\n"
+            main_logger.warning(f"Event loop blocked for {late * 1000:.0f}ms+, at:\n{stack.rstrip()}")
+
+
+loop_watchdog = LoopWatchdog(Config.LOOP_WATCHDOG_THRESHOLD, Config.LOOP_WATCHDOG_INTERVAL)
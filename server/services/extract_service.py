@@ -0,0 +1,150 @@
+from csv import reader, writer
+from io import StringIO
+from re import compile, DOTALL
+
+from server.models import ExtractRow
+
+QUESTION = compile(r"^\s*(?:\*\*)?(\d{1,2})\s*(?:\*\*)?\s*[.．、]")
+# A heading line on its own; `【答案】B` right under a question stays in its block.
+ANSWER_HEADING = compile(
+    r"^\s*(?:#+\s*)?(?:\*\*)?[【\[]?(?:参考)?答案(?:[与及]解析)?[】\]]?(?:\*\*)?\s*[:：]?\s*$"
+)
+# Starts the next passage of a paper with several (文言文阅读（二）, 阅读下面的文言文…).
+PASSAGE_HEADING = compile(
+    r"^\s*(?:#+\s*)?(?:\*\*)?(?:[（(]?[一二三四五六七八九十]+[）)、.．]\s*)?"
+    r"(?:文言文(?:阅读)?\s*[（(]?[一二三四五六七八九十]?[）)]?\s*(?:\*\*)?\s*$|阅读下面的?(?:这段|这篇|两段)?文言文)"
+)
+NOTE = compile(r"^\s*(?:\*\*)?(?:[【\[]注(?:释)?[】\]]|注(?:释)?[:：]|[①-⑳])")
+# Questions on word meanings; 断句, 概括分析 and the like are left out.
+RELEVANT = compile(r"加点|解释|词语|词义|释义|含义|意思|意义|翻译|译文|译成|译为")
+CODE_BLOCK = compile(r"```[^\n]*\n(.*?)```", DOTALL)
+CONTEXT_TRIM = "，。；：、！？,.;:!? \t\r\n"
+
+
+class _PaperSection:
+    """One passage of a paper with its questions, and the answers found under them."""
+
+    def __init__(self):
+        self.passage: list[str] = []
+        self.questions: dict[int, list[str]] = {}
+        self.answers: dict[int, list[str]] = {}
+
+    def has_text(self) -> bool:
+        return any(line.strip() and not PASSAGE_HEADING.match(line) for line in self.passage)
+
+
+def split_exam_blocks(markdown: str) -> list[str]:
+    """
+    Splits an exam paper into prompts of one question block each (with its answer),
+    and one for the notes under each passage, all carrying their passage as context.
+    Passages after the first are told apart by their headings; without one, a later
+    passage runs into the last question before it. Returns an empty list when the
+    paper does not look like numbered questions.
+    """
+    sections = [_PaperSection()]
+    asked: set[int] = set()
+    current: list[str] | None = None
+    in_answers = False
+
+    for line in markdown.splitlines():
+        section = sections[-1]
+        if PASSAGE_HEADING.match(line) and (section.questions or in_answers):
+            section = _PaperSection()
+            sections.append(section)
+            current = None
+            in_answers = False
+        if ANSWER_HEADING.match(line):
+            in_answers = True
+            current = []
+            continue
+        match = QUESTION.match(line)
+        if match is not None:
+            number = int(match.group(1))
+            # Numbering that starts over is the answer section, even without a heading; so is
+            # a number asked under an earlier passage with no passage text before it.
+            in_answers = (
+                in_answers
+                or number in section.questions
+                or (number in asked and not section.has_text())
+            )
+            if not in_answers:
+                asked.add(number)
+            current = (section.answers if in_answers else section.questions).setdefault(number, [])
+        if current is None:
+            section.passage.append(line)
+        else:
+            current.append(line)
+
+    # Answers are often all at the end of the paper, after the last passage.
+    all_answers: dict[int, list[str]] = {}
+    for section in sections:
+        for number, lines in section.answers.items():
+            all_answers.setdefault(number, lines)
+
+    blocks: list[str] = []
+    for section in sections:
+        passage_text = "\n".join(section.passage).strip()
+        if not section.questions or not passage_text:
+            continue
+        for number, lines in section.questions.items():
+            question = "\n".join(lines).strip()
+            if not RELEVANT.search(question):
+                continue
+            block = f"{passage_text}\n\n{question}"
+            answer = "\n".join(section.answers.get(number) or all_answers.get(number, [])).strip()
+            if answer:
+                block += f"\n\n答案：\n{answer}"
+            blocks.append(block)
+        if any(NOTE.match(line) for line in section.passage):
+            blocks.append(f"{passage_text}\n\n（本题块只处理原文下的注释。）")
+    return blocks
+
+
+def parse_extract_rows(text: str) -> list[ExtractRow]:
+    """Rows of the last CSV code block of an extraction answer."""
+    blocks = CODE_BLOCK.findall(text)
+    if not blocks:
+        return []
+    rows: list[ExtractRow] = []
+    for row in reader(StringIO(blocks[-1].strip())):
+        cells = [cell.strip() for cell in row]
+        if len(cells) < 4 or cells[0] == "type":
+            continue
+        # An unquoted ASCII comma in the context splits it; the other columns are short.
+        rows.append(
+            ExtractRow(
+                type=cells[0],
+                context=",".join(cells[1:-2]),
+                query=cells[-2],
+                answer=cells[-1],
+            )
+        )
+    return [row for row in rows if row.context and row.query]
+
+
+class ExtractRowMerger:
+    """Rows of all blocks of one paper; a question found by several blocks is kept once."""
+
+    def __init__(self):
+        self.rows: list[ExtractRow] = []
+        self._seen: set[tuple[str, str]] = set()
+
+    def add(self, rows: list[ExtractRow]) -> list[ExtractRow]:
+        """Returns the rows not seen before."""
+        added: list[ExtractRow] = []
+        for row in rows:
+            key = (row.query, row.context.strip(CONTEXT_TRIM))
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            added.append(row)
+        self.rows.extend(added)
+        return added
+
+    def to_csv(self) -> str:
+        output = StringIO()
+        csv_writer = writer(output, lineterminator="\n")
+        csv_writer.writerow(["type", "context", "query", "answer"])
+        for row in self.rows:
+            csv_writer.writerow([row.type, row.context, row.query, row.answer])
+        return output.getvalue()
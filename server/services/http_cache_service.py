@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from hashlib import sha256
+from time import time
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.responses import Response
+
+from server.config import Config
+
+
+def make_etag(*parts: str, weak: bool = False) -> str:
+    """
+    ETag derived from the version parts of a cache entry. Strong unless `weak`,
+    for responses that are equivalent but not byte-identical across requests.
+    """
+    etag = '"' + sha256("\0".join(parts).encode("utf-8")).hexdigest()[:32] + '"'
+    return "W/" + etag if weak else etag
+
+
+def _strip_weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """`If-None-Match` uses the weak comparison: `W/` prefixes are ignored."""
+    if not if_none_match:
+        return False
+    candidates = [_strip_weak(candidate.strip()) for candidate in if_none_match.split(",")]
+    return "*" in candidates or _strip_weak(etag) in candidates
+
+
+def not_modified_response(etag: str, cache_control: str) -> Response:
+    return Response(
+        status_code=304, headers={"ETag": etag, "Cache-Control": cache_control}
+    )
+
+
+class ETagRegistry:
+    """
+    Remembers the ETag last served for each URL, so a matching `If-None-Match`
+    can be answered with 304 before any auth, PocketBase call or billing.
+
+    Entries belong to a scope (e.g. "freq"); writes that change a scope's data
+    invalidate all of its entries and bump its epoch, which is part of its ETags.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[str, str, str]] = OrderedDict()
+        self._startup = str(int(time()))
+        self._epochs: dict[str, int] = {}
+
+    @classmethod
+    def get_key(cls, path: str, query_string: str) -> str:
+        return path + "?" + urlencode(sorted(parse_qsl(query_string)))
+
+    def get_epoch(self, scope: str) -> str:
+        return f"{self._startup}.{self._epochs.get(scope, 0)}"
+
+    def remember(
+        self, scope: str, path: str, query_string: str, etag: str, cache_control: str
+    ) -> None:
+        key = self.get_key(path, query_string)
+        self._entries[key] = (scope, etag, cache_control)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def match(
+        self, path: str, query_string: str, if_none_match: str | None
+    ) -> Response | None:
+        """Returns a 304 response if the client already holds the current version."""
+        if not if_none_match:
+            return None
+        entry = self._entries.get(self.get_key(path, query_string))
+        if entry is None:
+            return None
+        _, etag, cache_control = entry
+        if not etag_matches(if_none_match, etag):
+            return None
+        return not_modified_response(etag, cache_control)
+
+    def invalidate_scope(self, scope: str) -> None:
+        self._epochs[scope] = self._epochs.get(scope, 0) + 1
+        for key in [key for key, entry in self._entries.items() if entry[0] == scope]:
+            del self._entries[key]
+
+
+etag_registry = ETagRegistry(max_size=Config.ETAG_REGISTRY_SIZE)
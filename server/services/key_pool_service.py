@@ -0,0 +1,208 @@
+from asyncio import sleep
+from time import monotonic
+from typing import Awaitable, Callable, TypeVar
+
+from httpx import Response
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError
+
+from server.config import Config
+from server.models import ApiKeyStats
+from server.services.logging_service import main_logger
+from server.services.recording_service import get_upstream_transport
+from server.services.resilience_service import upstream_deadline
+
+T = TypeVar("T")
+
+
+class QuotaBucket:
+    """Token bucket that may be overdrawn, so actual usage can be charged after the fact."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = monotonic()
+
+    def get_available(self) -> float:
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def get_fraction(self) -> float:
+        return self.get_available() / self.capacity
+
+    def get_wait(self, amount: float) -> float:
+        return max(0.0, (amount - self.get_available()) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.get_available()
+        self.tokens -= amount
+
+    def clamp(self, remaining: float) -> None:
+        """Trusts the upstream's view of the remaining quota when it is lower than ours."""
+        self.tokens = min(self.get_available(), remaining)
+
+
+class PooledKey:
+    def __init__(self, api_key: str, base_url: str, rpm: int, tpm: int):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.requests = QuotaBucket(rpm)
+        self.tokens = QuotaBucket(tpm)
+        self.cooldown_until = 0.0
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.throttled = 0
+        # The pool reroutes 429s and the fallback chain handles the rest, so no SDK retries.
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                transport=get_upstream_transport(), event_hooks={"response": [self._on_response]}
+            ),
+        )
+
+    def get_name(self) -> str:
+        return f"...{self.api_key[-4:]}@{self.base_url}"
+
+    def is_cooling_down(self) -> bool:
+        return monotonic() < self.cooldown_until
+
+    def get_score(self) -> float:
+        return min(self.requests.get_fraction(), self.tokens.get_fraction())
+
+    def cool_down(self, seconds: float) -> None:
+        self.throttled += 1
+        self.cooldown_until = max(self.cooldown_until, monotonic() + seconds)
+        main_logger.warning(f"API key {self.get_name()} throttled, cooling down for {seconds:.0f}s")
+
+    def reserve(self, estimated_tokens: int) -> None:
+        self.requests.take(1)
+        self.tokens.take(estimated_tokens)
+        self.total_requests += 1
+
+    def release(self, estimated_tokens: int) -> None:
+        """Returns the token reservation of a request that got no completion, e.g. a losing hedge."""
+        self.tokens.take(-estimated_tokens)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Corrects the reservation made before the request with the billed usage."""
+        self.tokens.take(actual_tokens - estimated_tokens)
+        self.total_tokens += actual_tokens
+
+    async def _on_response(self, response: Response) -> None:
+        remaining_requests = response.headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = response.headers.get("x-ratelimit-remaining-tokens")
+        try:
+            if remaining_requests is not None:
+                self.requests.clamp(float(remaining_requests))
+            if remaining_tokens is not None:
+                self.tokens.clamp(float(remaining_tokens))
+        except ValueError:
+            pass
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.headers.get("retry-after", ""))
+            except ValueError:
+                retry_after = Config.API_KEY_COOLDOWN
+            self.cool_down(retry_after)
+
+    def get_stats(self) -> ApiKeyStats:
+        return ApiKeyStats(
+            base_url=self.base_url,
+            available_requests=self.requests.get_available(),
+            available_tokens=self.tokens.get_available(),
+            cooling_down=max(0.0, self.cooldown_until - monotonic()),
+            requests=self.total_requests,
+            tokens=self.total_tokens,
+            throttled=self.throttled,
+        )
+
+
+class ApiKeyPool:
+    """
+    Spreads upstream requests over several API keys, picking the one with the
+    most remaining quota. Quota is tracked locally per key and corrected with
+    the upstream's rate-limit headers and the reported usage.
+    """
+
+    def __init__(self, keys: list[PooledKey]):
+        if not keys:
+            raise ValueError("API_KEY is not set")
+        self.keys = keys
+
+    @classmethod
+    def from_config(cls) -> "ApiKeyPool":
+        return cls(
+            [
+                PooledKey(api_key, base_url, Config.API_KEY_RPM, Config.API_KEY_TPM)
+                for api_key, base_url in Config.API_KEYS
+            ]
+        )
+
+    @classmethod
+    def estimate_tokens(cls, *texts: str, completion: int = 0) -> int:
+        # Chinese text is roughly one token per character.
+        return sum(len(text) for text in texts) + completion
+
+    async def acquire(self, estimated_tokens: int, exclude: set[str]) -> PooledKey:
+        deadline = upstream_deadline.get()
+        waited = False
+        while True:
+            candidates = [
+                key
+                for key in self.keys
+                if not key.is_cooling_down() and key.get_name() not in exclude
+            ]
+            if not candidates:
+                # Everything is throttled; wait for the key that recovers first rather than failing.
+                key = min(
+                    (key for key in self.keys if key.get_name() not in exclude),
+                    key=lambda key: key.cooldown_until,
+                )
+                wait = key.cooldown_until - monotonic()
+            else:
+                key = max(candidates, key=PooledKey.get_score)
+                wait = max(
+                    key.requests.get_wait(1),
+                    key.tokens.get_wait(min(estimated_tokens, key.tokens.capacity)),
+                )
+            if wait <= 0:
+                break
+            if deadline is not None and not waited:
+                deadline.pause()
+            waited = True
+            await sleep(min(wait, Config.API_KEY_MAX_WAIT))
+        if deadline is not None and waited:
+            deadline.restart()
+        key.reserve(estimated_tokens)
+        return key
+
+    async def call(
+        self, estimated_tokens: int, func: Callable[[PooledKey], Awaitable[T]]
+    ) -> T:
+        """Runs `func` with a key, moving on to the next key when one is rate limited."""
+        tried: set[str] = set()
+        while True:
+            key = await self.acquire(estimated_tokens, tried)
+            tried.add(key.get_name())
+            try:
+                return await func(key)
+            except RateLimitError:
+                key.release(estimated_tokens)
+                if not key.is_cooling_down():
+                    key.cool_down(Config.API_KEY_COOLDOWN)
+                if len(tried) == len(self.keys):
+                    raise
+            except BaseException:
+                # Failed or cancelled (a hedge that lost): nothing to reconcile the estimate with.
+                key.release(estimated_tokens)
+                raise
+
+    def get_stats(self) -> dict[str, ApiKeyStats]:
+        return {key.get_name(): key.get_stats() for key in self.keys}
+
+
+api_key_pool = ApiKeyPool.from_config()
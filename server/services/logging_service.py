@@ -1,17 +1,92 @@
-from logging import getLogger, INFO, StreamHandler, FileHandler, Formatter
+from atexit import register
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from json import dumps
+from logging import getLogger, INFO, Filter, Formatter, Handler, Logger, LogRecord, StreamHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from random import random
+
+from server.config import Config
+
+# Set per request (and per session query), stamped on every record logged meanwhile.
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+class ContextFilter(Filter):
+    """
+    Runs in the logging task, before the hand-off: stamps the request id, and keeps
+    only a sample of the records of high-volume categories (`extra={"category": ...}`).
+    """
+
+    def filter(self, record: LogRecord) -> bool:
+        category = getattr(record, "category", None)
+        if category is not None and random() >= Config.LOG_SAMPLE_RATES.get(category, 1.0):
+            return False
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(Formatter):
+    def format(self, record: LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "module": record.module,
+            "line": record.lineno,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        category = getattr(record, "category", None)
+        if category is not None:
+            entry["category"] = category
+        return dumps(entry, ensure_ascii=False)
+
+
+def attach_queue(logger: Logger, *handlers: Handler) -> QueueListener:
+    """Hands the logger's records to `handlers` on a background thread; I/O never blocks the event loop."""
+    queue: "SimpleQueue[LogRecord]" = SimpleQueue()
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(ContextFilter())
+    logger.addHandler(queue_handler)
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def get_rotating_handler(filename: str) -> RotatingFileHandler:
+    return RotatingFileHandler(
+        filename,
+        maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT,
+        encoding="utf-8",
+        delay=True,
+    )
+
 
 def get_main_logger():
     logger = getLogger("main")
     logger.setLevel(INFO)
-    handler1 = StreamHandler()
-    handler2 = FileHandler(filename="./log.log")
-    formatter = Formatter(
-        "%(levelname)s [main] %(module)s:%(lineno)d | %(message)s"
+    logger.propagate = False
+    console_handler = StreamHandler()
+    console_handler.setFormatter(
+        Formatter("%(levelname)s [main] %(module)s:%(lineno)d %(request_id)s | %(message)s")
     )
-    handler1.setFormatter(formatter)
-    handler2.setFormatter(formatter)
-    logger.addHandler(handler1)
-    logger.addHandler(handler2)
+    file_handler = get_rotating_handler(Config.LOG_PATH)
+    file_handler.setFormatter(JsonFormatter())
+    # Stopping the listener at exit flushes what is still queued.
+    register(attach_queue(logger, console_handler, file_handler).stop)
+    return logger
+
+def get_trace_logger():
+    """Sampled request timings as JSON lines; the file is only created once one is written."""
+    logger = getLogger("trace")
+    logger.setLevel(INFO)
+    logger.propagate = False
+    handler = get_rotating_handler(Config.TIMING_TRACE_PATH)
+    handler.setFormatter(Formatter("%(message)s"))
+    register(attach_queue(logger, handler).stop)
     return logger
 
 main_logger = get_main_logger()
+trace_logger = get_trace_logger()
@@ -0,0 +1,218 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, TypeVar
+
+from httpx import Request, Response
+
+from server.services.timing_service import record_span
+
+# The API path a request (or query session) came in on, for per-endpoint counters.
+request_endpoint: ContextVar[str] = ContextVar("request_endpoint", default="-")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self.samples()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+            for labels, value in list(self._values.items())
+        ]
+
+
+class CallbackGauge(Metric):
+    """A gauge read from the process state at scrape time, so it costs nothing in between."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self.read = read
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {_format_value(self.read())}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # Per label set: the count of each bucket (not cumulative, the last one is +Inf) and the sum.
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self) -> list[str]:
+        lines: list[str] = []
+        for labels, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                label_text = _format_labels(self.labels, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class MetricsRegistry:
+    """Collectors are plain in-process counters; the text exposition format is built only on scrape."""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback_gauge(self, name: str, help: str, read: Callable[[], float]) -> CallbackGauge:
+        return self.register(CallbackGauge(name, help, read))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+pocketbase_request_seconds = metrics_registry.histogram(
+    "wyw_pocketbase_request_seconds",
+    "PocketBase API call latency.",
+    ("collection", "operation", "status"),
+)
+zdic_lookups_total = metrics_registry.counter(
+    "wyw_zdic_lookups_total", "Zdic lookups by cache result.", ("result",)
+)
+zdic_upstream_seconds = metrics_registry.histogram(
+    "wyw_zdic_upstream_seconds", "Latency of zdic.net requests on cache misses, by status.", ("outcome",)
+)
+llm_first_token_seconds = metrics_registry.histogram(
+    "wyw_llm_first_token_seconds",
+    "Time from sending a streamed completion to its first chunk.",
+    ("model",),
+    LLM_BUCKETS,
+)
+llm_completion_seconds = metrics_registry.histogram(
+    "wyw_llm_completion_seconds",
+    "Time from sending a completion to its end (or cut).",
+    ("model", "stream"),
+    LLM_BUCKETS,
+)
+llm_tokens_total = metrics_registry.counter(
+    "wyw_llm_tokens_total", "Tokens billed, by endpoint.", ("endpoint", "model", "kind")
+)
+coins_spent_total = metrics_registry.counter(
+    "wyw_coins_spent_total", "Coins charged to users, by endpoint.", ("endpoint",)
+)
+loop_lag_seconds = metrics_registry.histogram(
+    "wyw_event_loop_lag_seconds", "How late the event loop wakes a periodic sleeper.", (), LAG_BUCKETS
+)
+loop_stalls_total = metrics_registry.counter(
+    "wyw_event_loop_stalls_total", "Callbacks that blocked the event loop past the watchdog threshold."
+)
+admission_rejections_total = metrics_registry.counter(
+    "wyw_admission_rejections_total", "Requests turned away by admission control.", ("reason", "guest")
+)
+
+
+def get_pocketbase_operation(request: Request) -> tuple[str, str]:
+    """(collection, operation) of a PocketBase API request, e.g. ("users", "update")."""
+    parts = request.url.path.strip("/").split("/")
+    # /api/collections/{collection}/records[/{id}] or /api/collections/{collection}/{action}
+    if len(parts) >= 4 and parts[1] == "collections":
+        collection = parts[2]
+        if parts[3] != "records":
+            return collection, parts[3]
+        if len(parts) == 4:
+            return collection, "list" if request.method == "GET" else "create"
+        return collection, {"GET": "view", "PATCH": "update", "DELETE": "delete"}.get(
+            request.method, request.method.lower()
+        )
+    return "-", "/".join(parts[1:2]) or "-"
+
+
+async def pocketbase_before_send(request: Request) -> Request:
+    request.extensions["metrics_started"] = perf_counter()
+    return request
+
+
+async def pocketbase_after_send(response: Response) -> Response:
+    started = response.request.extensions.get("metrics_started")
+    if started is not None:
+        collection, operation = get_pocketbase_operation(response.request)
+        pocketbase_request_seconds.observe(
+            perf_counter() - started, collection, operation, str(response.status_code)
+        )
+        record_span("pb", started)
+    return response
@@ -1,15 +1,29 @@
 from pocketbase import PocketBase
 from pocketbase.models.errors import PocketBaseNotFoundError, PocketBaseBadRequestError
+from pydantic import BaseModel
 
 from os import getenv
 from tqdm import tqdm
 from datetime import datetime, timezone
-from asyncio import gather
-from typing import Coroutine, Any
+from asyncio import gather, shield
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Coroutine, Any, TypeVar
 
 from asyncio import Lock, current_task
+from sqlite3 import Error as SqliteError
 
+from server.services.cache_service import cache_backend
 from server.services.logging_service import main_logger
+from server.services.sqlite_reader_service import sqlite_reader
+from server.services.http_cache_service import etag_registry
+from server.services.metrics_service import (
+    coins_spent_total,
+    pocketbase_after_send,
+    pocketbase_before_send,
+    request_endpoint,
+)
+from server.services.timing_service import timed
+from server.services.executor_service import run_cpu
 from server.config import Config, Roles
 from server.models import (
     Role,
@@ -23,6 +37,7 @@ from server.models import (
     UserRaw,
     BalanceDetail,
     BalanceDetailRaw,
+    BalanceInfo,
     AuthResultModel,
     ListResultModel,
 )
@@ -43,10 +58,17 @@ class NotEnoughBalanceError(ServerException):
 
 
 class ReentrantLock:
-    def __init__(self):
+    """
+    Re-entrant per task. With a shared cache backend the outermost acquire also
+    takes the lease `name` there, so other workers serialize on the same user.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
         self._lock = Lock()
         self._owner = None
         self._count = 0
+        self._lease: str | None = None
 
     async def __aenter__(self):
         _current_task = current_task()
@@ -54,6 +76,14 @@ class ReentrantLock:
             self._count += 1
         else:
             await self._lock.__aenter__()
+            if cache_backend.shared:
+                try:
+                    self._lease = await cache_backend.acquire(
+                        self.name, Config.CACHE_LOCK_TTL, Config.CACHE_LOCK_TIMEOUT
+                    )
+                except BaseException:
+                    self._lock.release()
+                    raise
             self._owner = _current_task
             self._count = 1
         return self
@@ -69,7 +99,12 @@ class ReentrantLock:
             self._count -= 1
             if self._count == 0:
                 self._owner = None
-                await self._lock.__aexit__(exc_type, exc_val, exc_tb)
+                try:
+                    if self._lease is not None:
+                        await cache_backend.release(self.name, self._lease)
+                        self._lease = None
+                finally:
+                    await self._lock.__aexit__(exc_type, exc_val, exc_tb)
         else:
             raise RuntimeError("Cannot release un-acquired lock")
 
@@ -86,7 +121,7 @@ class UserLockManager:
 
         async with self._user_locks_lock:
             if user_id not in self._user_locks:
-                self._user_locks[user_id] = ReentrantLock()
+                self._user_locks[user_id] = ReentrantLock(f"lock:user:{user_id}")
             return self._user_locks[user_id]
 
     async def cleanup_user_lock(self, user_id: str):
@@ -98,13 +133,42 @@ class UserLockManager:
 user_lock_manager = UserLockManager()
 
 
+# CPU-bound steps, run on the executor. Module-level so a process pool can pickle them.
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def validate_all(model: type[M], items: list[Any]) -> list[M]:
+    return [model.model_validate(item) for item in items]
+
+
+def build_freq_info(
+    corpus_stats_item: dict[str, Any], corpus_items: list[dict[str, Any]], total_pages: int
+) -> FreqInfo:
+    return FreqInfo(
+        stat=CorpusStatItem.model_validate(corpus_stats_item),
+        notes=[CorpusItem.model_validate(item) for item in corpus_items],
+        total_pages=total_pages,
+    )
+
+
+def load_frequency_file(path: str) -> list[FreqInfoAll]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [FreqInfoFileRaw.model_validate_json(line).to_freq_info_all() for line in f]
+
+
 class PocketBaseService:
     def __init__(self):
         self.pocketbase_url = getenv("POCKETBASE_URL")
         if self.pocketbase_url is None:
             raise KeyError("POCKETBASE_URL not set.")
         self.pb = PocketBase(self.pocketbase_url)
+        self.pb.before_send = pocketbase_before_send
+        self.pb.after_send = pocketbase_after_send
         self.latest_auth_result: AuthResultModel | None = None
+        self._deferred_coins: int | None = None
+        # Called with the new balance after every charge, e.g. to push it on a query session.
+        self.balance_listeners: list[Callable[[BalanceInfo], None]] = []
         self.zdic_cache = self.pb.collection("zdicCache")
         self.corpus = self.pb.collection("corpus")
         self.corpus_stats = self.pb.collection("corpusStats")
@@ -140,10 +204,10 @@ class PocketBaseService:
 
         main_logger.info("Initializing Corpus...")
         await self._corpus_delete_all()
-        with open(Config.FREQUENCY_PATH, "r", encoding="utf-8") as f:
-            for line in tqdm(f, "Initializing Corpus"):
-                freq_info = FreqInfoFileRaw.model_validate_json(line).to_freq_info_all()
-                await self._corpus_init_load(freq_info)
+        freq_infos = await run_cpu(load_frequency_file, Config.FREQUENCY_PATH)
+        for freq_info in tqdm(freq_infos, "Initializing Corpus"):
+            await self._corpus_init_load(freq_info)
+        etag_registry.invalidate_scope("freq")
 
     async def init_roles(self) -> None:
         for role in Config.ROLES:
@@ -235,13 +299,21 @@ class PocketBaseService:
 
     ## Users ##
 
-    async def users_spend_coins(self, coins: int, reason: str) -> BalanceDetailRaw:
+    async def users_spend_coins(self, coins: int, reason: str) -> BalanceDetailRaw | None:
         """
         If it's an income, coins should be negative.
 
-        A user spends coins and returns the new user info.
+        A user spends coins and returns the new user info, or None if the
+        charge was deferred (see `deferred_charges`).
         """
+        if self._deferred_coins is not None and coins > 0:
+            self._deferred_coins += coins
+            return None
+
+        with timed("charge"):
+            return await self._spend_coins(coins, reason)
 
+    async def _spend_coins(self, coins: int, reason: str) -> BalanceDetailRaw | None:
         user_lock = await user_lock_manager.get_user_lock(self.get_user_id())
 
         async with user_lock:
@@ -268,9 +340,28 @@ class PocketBaseService:
                     reason=reason,
                 )
             )
+            if coins > 0:
+                coins_spent_total.inc(request_endpoint.get(), amount=coins)
+            for listener in self.balance_listeners:
+                listener(BalanceInfo(balance=remaining, total_spent=total_spent + max(coins, 0)))
 
             return result
 
+    def get_deferred_coins(self) -> int:
+        """Coins spent so far inside `deferred_charges`, not yet charged."""
+        return self._deferred_coins or 0
+
+    @asynccontextmanager
+    async def deferred_charges(self, reason: str) -> AsyncIterator[None]:
+        """Collects the coins spent inside the block into one balance detail, charged at exit."""
+        self._deferred_coins = 0
+        try:
+            yield
+        finally:
+            coins, self._deferred_coins = self._deferred_coins, None
+            if coins:
+                await shield(self.users_spend_coins(coins, reason))
+
     async def users_guest_upgrade(self, email: str, password: str) -> AuthResultModel:
         """Upgrade from guest to user"""
 
@@ -320,11 +411,22 @@ class PocketBaseService:
         )
 
     async def zdc_search(self, query: str):
+        if sqlite_reader is not None:
+            try:
+                cache = await sqlite_reader.zdc_search(query)
+                if cache is not None:
+                    main_logger.info(
+                        f"ZDic Cache Retrieved ({query}, sqlite)", extra={"category": "zdic-cache"}
+                    )
+                return cache
+            except SqliteError as e:
+                main_logger.warning(f"SQLite read (zdicCache) failed: {e}")
+
         try:
             cache = await self.zdic_cache.get_first(
                 options={"filter": f"query='{self.sanitize(query)}'"}
             )
-            main_logger.info(f"ZDic Cache Retrieved ({query})")
+            main_logger.info(f"ZDic Cache Retrieved ({query})", extra={"category": "zdic-cache"})
             return cache
         except PocketBaseNotFoundError:
             return None
@@ -335,10 +437,27 @@ class PocketBaseService:
         main_logger.info(f"Creating role ({role.name})")
         await self.roles.create(params=role.model_dump())
 
+    async def _roles_sqlite_get(self, id: str) -> Role | None:
+        if sqlite_reader is None:
+            return None
+        try:
+            role = await sqlite_reader.roles_get(id)
+            return None if role is None else Role.model_validate(role)
+        except SqliteError as e:
+            main_logger.warning(f"SQLite read (roles) failed: {e}")
+            return None
+
     async def roles_get(self, id: str) -> Role:
+        role = await self._roles_sqlite_get(id)
+        if role is not None:
+            return role
         return Role.model_validate(await self.roles.get_one(id))
 
     async def roles_retrieve(self, id: str) -> Role | None:
+        role = await self._roles_sqlite_get(id)
+        if role is not None:
+            return role
+
         try:
             role = await self.roles.get_one(id)
             return Role.model_validate(dict(role))
@@ -376,41 +495,75 @@ class PocketBaseService:
 
         return True
 
-    async def corpus_freq_retrieve(self, query: str, page: int) -> FreqInfo | None:
+    async def _corpus_freq_read(
+        self, query: str, page: int, per_page: int
+    ) -> tuple[dict[str, Any], list[dict[str, Any]], int] | None:
+        if sqlite_reader is not None:
+            try:
+                corpus_stats_item = await sqlite_reader.corpus_stats_get(query)
+                if corpus_stats_item is None:
+                    return None
+                items, total_pages = await sqlite_reader.corpus_list(
+                    query, page, per_page
+                )
+                return corpus_stats_item, items, total_pages
+            except SqliteError as e:
+                main_logger.warning(f"SQLite read (corpus) failed: {e}")
+
         try:
             corpus_stats_item = await self.corpus_stats.get_first(
                 options={"filter": f"query='{self.sanitize(query)}'"}
             )
             corpus_items = await self.corpus.get_list(
                 page=page,
-                per_page=15,
+                per_page=per_page,
                 options={"filter": f"query~'{self.sanitize(query)}'"},
             )
-            await self.users_spend_coins(
-                20 + len(corpus_items["items"]) * 5, reason=f"词频查询 {query}"
-            )
-            return FreqInfo(
-                stat=CorpusStatItem.model_validate(dict(corpus_stats_item)),
-                notes=[
-                    CorpusItem.model_validate(dict(item))
-                    for item in corpus_items["items"]
-                ],
-                total_pages=corpus_items["totalPages"],  # type: ignore
+            return (
+                dict(corpus_stats_item),
+                [dict(item) for item in corpus_items["items"]],
+                corpus_items["totalPages"],  # type: ignore
             )
         except PocketBaseNotFoundError:
             return None
 
+    async def corpus_freq_lookup(
+        self, query: str, page: int
+    ) -> tuple[FreqInfo, str] | None:
+        """Returns the frequency info and its version, without charging for it."""
+        result = await self._corpus_freq_read(query, page, per_page=15)
+        if result is None:
+            return None
+        corpus_stats_item, corpus_items, total_pages = result
+
+        if len(corpus_items) <= Config.CPU_INLINE_MAX_ITEMS:
+            freq_info = build_freq_info(corpus_stats_item, corpus_items, total_pages)
+        else:
+            freq_info = await run_cpu(build_freq_info, corpus_stats_item, corpus_items, total_pages)
+        version = f"{corpus_stats_item.get('id')}:{corpus_stats_item.get('updated')}"
+        return freq_info, version
+
+    async def corpus_freq_charge(self, query: str, freq_info: FreqInfo) -> None:
+        await self.users_spend_coins(
+            20 + len(freq_info.notes) * 5, reason=f"词频查询 {query}"
+        )
+
+    async def corpus_freq_retrieve(self, query: str, page: int) -> FreqInfo | None:
+        result = await self.corpus_freq_lookup(query, page)
+        if result is None:
+            return None
+        freq_info, _ = result
+
+        await self.corpus_freq_charge(query, freq_info)
+        return freq_info
+
     async def _corpus_stats_list_all(self) -> list[CorpusStatItemRaw]:
-        return [
-            CorpusStatItemRaw.model_validate(item)
-            for item in await self.corpus_stats.get_full_list()
-        ]
+        return await run_cpu(
+            validate_all, CorpusStatItemRaw, await self.corpus_stats.get_full_list()
+        )
 
     async def _corpus_list_all(self) -> list[CorpusItemRaw]:
-        return [
-            CorpusItemRaw.model_validate(item)
-            for item in await self.corpus.get_full_list()
-        ]
+        return await run_cpu(validate_all, CorpusItemRaw, await self.corpus.get_full_list())
 
     async def corpus_create_query(
         self, query: str, context: str, answer: str
@@ -440,7 +593,7 @@ class PocketBaseService:
             },
         )
 
-        return CorpusItemRaw.model_validate(
+        corpus_item = CorpusItemRaw.model_validate(
             await self.corpus.create(
                 CorpusItem(
                     query=query,
@@ -451,6 +604,8 @@ class PocketBaseService:
                 ).model_dump()
             )
         )
+        etag_registry.invalidate_scope("freq")
+        return corpus_item
 
     async def _corpus_is_empty(self) -> bool:
         try:
@@ -489,7 +644,11 @@ class PocketBaseService:
             await self.balance_details.create(params=balance_detail.model_dump())
         )
 
-    async def balance_check(self) -> None:
-        balance = UserRaw.model_validate(await self.users.get_one(self.get_user_id())).balance
+    async def balance_check(self) -> int:
+        """Returns the balance, or raises if it is already negative."""
+        with timed("balance"):
+            user = await self.users.get_one(self.get_user_id())
+        balance = UserRaw.model_validate(user).balance
         if balance < 0:
             raise NotEnoughBalanceError(self.get_user_id(), balance)
+        return balance
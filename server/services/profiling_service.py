@@ -0,0 +1,218 @@
+from asyncio import Task, TimerHandle, create_task, get_running_loop, to_thread
+from collections import Counter, OrderedDict
+from cProfile import Profile
+from marshal import dumps
+from secrets import token_urlsafe
+from sys import _current_frames
+from threading import Event, Thread, get_ident
+from types import FrameType
+from typing import Callable, Literal
+
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from server.config import Config
+from server.models import ProfileStatus
+from server.services.logging_service import main_logger
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+def get_collapsed_stack(frame: FrameType | None, depth: int) -> str:
+    """`module:function` names from the outermost frame in, `;`-separated as flame graph tools read them."""
+    names: list[str] = []
+    while frame is not None and len(names) < depth:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class ProfileSession:
+    """
+    One profiling run. Without a path it captures from the start until `seconds`
+    have passed; with one it captures only while requests under that path are in
+    flight, until `requests` of them finished (or `seconds` ran out waiting).
+    Either way it sees the whole event loop thread, so coroutines of other
+    requests interleaved with the profiled ones show up too.
+    """
+
+    def __init__(
+        self,
+        mode: Literal["sampling", "cprofile"],
+        seconds: float,
+        path: str | None,
+        requests: int,
+        on_stop: Callable[["ProfileSession"], None],
+    ):
+        self.id = token_urlsafe(8)
+        self.mode = mode
+        self.path = path
+        self.requests = requests
+        self.seen = 0
+        self.in_flight = 0
+        self.stopping = False
+        self.done = False
+        self.capturing = False
+        self.samples = 0
+        self.stacks: Counter[str] = Counter()
+        self._seconds = seconds
+        self._loop_thread = get_ident()
+        self._profile: Profile | None = Profile() if mode == "cprofile" else None
+        self._stopped = Event()
+        self._sampler: Thread | None = None
+        self._deadline: TimerHandle | None = None
+        self._finishing: Task[None] | None = None
+        self._on_stop = on_stop
+
+    def start(self) -> None:
+        self._deadline = get_running_loop().call_later(self._seconds, self.stop)
+        if self.mode == "sampling":
+            self._sampler = Thread(target=self._sample, name="profiler", daemon=True)
+            self._sampler.start()
+        if self.path is None:
+            self._resume()
+
+    def stop(self) -> None:
+        if self.stopping:
+            return
+        self.stopping = True
+        if self._deadline is not None:
+            self._deadline.cancel()
+        self._pause()
+        self._stopped.set()
+        self._finishing = create_task(self._finish())
+
+    async def _finish(self) -> None:
+        # The sampler may be mid-sleep; wait for it off the loop, which it samples.
+        if self._sampler is not None:
+            await to_thread(self._sampler.join)
+        self.done = True
+        self._on_stop(self)
+        main_logger.info(f"Profile {self.id} done: {self.samples} samples, {self.seen} requests")
+
+    def matches(self, path: str) -> bool:
+        return (
+            self.path is not None
+            and not self.stopping
+            and self.seen < self.requests
+            and path.startswith(self.path)
+        )
+
+    def request_started(self) -> None:
+        self.seen += 1
+        self.in_flight += 1
+        if self.in_flight == 1:
+            self._resume()
+
+    def request_finished(self) -> None:
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self._pause()
+            if self.seen >= self.requests:
+                self.stop()
+
+    def _resume(self) -> None:
+        self.capturing = True
+        if self._profile is not None:
+            # cProfile hooks the thread that enables it, which is the loop thread here.
+            self._profile.enable()
+
+    def _pause(self) -> None:
+        if self.capturing and self._profile is not None:
+            self._profile.disable()
+        self.capturing = False
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(Config.PROFILE_SAMPLE_INTERVAL):
+            if not self.capturing:
+                continue
+            frame = _current_frames().get(self._loop_thread)
+            self.stacks[get_collapsed_stack(frame, Config.PROFILE_STACK_DEPTH)] += 1
+            self.samples += 1
+
+    def get_status(self) -> ProfileStatus:
+        return ProfileStatus(
+            id=self.id,
+            mode=self.mode,
+            path=self.path,
+            state="done" if self.done else "running" if self.capturing or self.stopping else "armed",
+            requests=self.seen,
+            samples=self.samples,
+        )
+
+    def get_result(self) -> tuple[bytes, str, str]:
+        """(body, media type, file name) of a finished session."""
+        if self._profile is not None:
+            # What `Profile.dump_stats` writes, readable by `pstats.Stats` and snakeviz.
+            self._profile.create_stats()
+            return dumps(self._profile.stats), "application/octet-stream", f"{self.id}.prof"  # type: ignore
+        text = "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        return text.encode(), "text/plain; charset=utf-8", f"{self.id}.folded"
+
+
+class Profiler:
+    """At most one session runs at a time; the last few finished ones are kept for download."""
+
+    def __init__(self, keep: int = 4):
+        self.active: ProfileSession | None = None
+        self._sessions: OrderedDict[str, ProfileSession] = OrderedDict()
+        self._keep = keep
+
+    def start(
+        self,
+        mode: Literal["sampling", "cprofile"],
+        seconds: float,
+        path: str | None,
+        requests: int,
+    ) -> ProfileSession:
+        if self.active is not None:
+            raise ProfilerBusyError(f"Profile {self.active.id} is still running")
+        session = ProfileSession(mode, seconds, path, requests, self._release)
+        self.active = session
+        self._sessions[session.id] = session
+        while len(self._sessions) > self._keep:
+            self._sessions.popitem(last=False)
+        session.start()
+        main_logger.info(f"Profile {session.id} started: {mode}, {seconds}s, path {path}")
+        return session
+
+    def _release(self, session: ProfileSession) -> None:
+        if self.active is session:
+            self.active = None
+
+    def get(self, session_id: str) -> ProfileSession | None:
+        return self._sessions.get(session_id)
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware marking the requests a path-bound profile waits for.
+    Without an armed session it is a single attribute check per request.
+    """
+
+    EXCLUDED_PREFIX = "/api/admin/profile"
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        session = profiler.active
+        if (
+            session is None
+            or scope["type"] != "http"
+            or not session.matches(scope["path"])
+            or scope["path"].startswith(self.EXCLUDED_PREFIX)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        session.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.request_finished()
@@ -0,0 +1,205 @@
+from asyncio import sleep
+from collections import Counter
+from hashlib import sha256
+from json import JSONDecodeError, dumps, loads
+from os import replace
+from pathlib import Path
+from time import perf_counter
+from typing import Any, AsyncIterator
+
+from httpx import AsyncBaseTransport, AsyncByteStream, AsyncHTTPTransport, Request, Response, TransportError
+
+from server.config import Config
+from server.services.logging_service import main_logger
+
+
+class RecordingMissError(TransportError):
+    pass
+
+
+class RecordingStore:
+    """
+    Recorded exchanges on disk. Bodies are blobs named by their SHA-256, so the
+    same zdic page or answer is stored once; each request key (a hash of method,
+    URL and canonical body) has a JSON file with its recordings, in call order.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._replays: Counter[str] = Counter()
+
+    @classmethod
+    def get_key(cls, request: Request) -> str:
+        body = request.content
+        try:
+            # The OpenAI SDK's key order is stable, but canonical JSON does not depend on it.
+            body = dumps(loads(body), sort_keys=True, ensure_ascii=False).encode()
+        except (JSONDecodeError, UnicodeDecodeError):
+            pass
+        digest = sha256(f"{request.method} {request.url}\n".encode())
+        digest.update(body)
+        return digest.hexdigest()
+
+    def _get_entry_path(self, key: str) -> Path:
+        return self.root / "requests" / key[:2] / f"{key}.json"
+
+    def _get_blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / digest
+
+    def _write(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp")
+        temporary.write_bytes(data)
+        replace(temporary, path)
+
+    def put_blob(self, data: bytes) -> str:
+        digest = sha256(data).hexdigest()
+        path = self._get_blob_path(digest)
+        if not path.exists():
+            self._write(path, data)
+        return digest
+
+    def get_blob(self, digest: str) -> bytes:
+        return self._get_blob_path(digest).read_bytes()
+
+    def get_recordings(self, key: str) -> list[dict[str, Any]]:
+        path = self._get_entry_path(key)
+        return loads(path.read_text(encoding="utf-8")) if path.exists() else []
+
+    def has(self, key: str) -> bool:
+        return self._get_entry_path(key).exists()
+
+    def add(self, key: str, recording: dict[str, Any]) -> None:
+        recordings = self.get_recordings(key)
+        recordings.append(recording)
+        self._write(self._get_entry_path(key), dumps(recordings, ensure_ascii=False, indent=1).encode())
+
+    def next_recording(self, key: str) -> dict[str, Any] | None:
+        """The recordings of a key are replayed in turn, so repeated calls vary as they did live."""
+        recordings = self.get_recordings(key)
+        if not recordings:
+            return None
+        index = self._replays[key] % len(recordings)
+        self._replays[key] += 1
+        return recordings[index]
+
+
+class _RecordingStream(AsyncByteStream):
+    """Passes the upstream body through and notes when each chunk arrived."""
+
+    def __init__(self, stream: AsyncByteStream, started: float, on_close):
+        self._stream = stream
+        self._started = started
+        self._on_close = on_close
+        self.chunks: list[tuple[float, bytes]] = []
+        self.complete = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self.chunks.append((perf_counter() - self._started, chunk))
+            yield chunk
+        self.complete = True
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+        self._on_close(self)
+
+
+class _ReplayStream(AsyncByteStream):
+    def __init__(self, body: bytes, chunks: list[list[float]], started: float, speed: float):
+        self._body = body
+        self._chunks = chunks
+        self._started = started
+        self._speed = speed
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        position = 0
+        for offset, size in self._chunks:
+            if self._speed > 0:
+                delay = self._started + offset / self._speed - perf_counter()
+                if delay > 0:
+                    await sleep(delay)
+            yield self._body[position : position + int(size)]
+            position += int(size)
+
+
+class RecordReplayTransport(AsyncBaseTransport):
+    """
+    httpx transport for upstream clients. "record" passes requests on and saves
+    each exchange with its chunk timing; "replay" serves saved ones only, at
+    `speed` times the original pace (0 = no delays); "auto" replays what was
+    recorded and records the rest. A stream the client closed early (e.g. an
+    answer stopped at its **答案** line) is saved as far as it was read.
+    """
+
+    def __init__(self, store: RecordingStore, mode: str, speed: float, inner: AsyncBaseTransport | None = None):
+        self.store = store
+        self.mode = mode
+        self.speed = speed
+        self.inner = inner or AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: Request) -> Response:
+        await request.aread()
+        key = self.store.get_key(request)
+        if self.mode == "replay" or (self.mode == "auto" and self.store.has(key)):
+            return await self._replay(request, key)
+        return await self._record(request, key)
+
+    async def _replay(self, request: Request, key: str) -> Response:
+        started = perf_counter()
+        recording = self.store.next_recording(key)
+        if recording is None:
+            raise RecordingMissError(f"No recording of {request.method} {request.url} ({key[:12]})", request=request)
+        if self.speed > 0:
+            await sleep(recording["headers_at"] / self.speed)
+        return Response(
+            recording["status"],
+            headers=recording["headers"],
+            stream=_ReplayStream(
+                self.store.get_blob(recording["body"]), recording["chunks"], started, self.speed
+            ),
+        )
+
+    async def _record(self, request: Request, key: str) -> Response:
+        started = perf_counter()
+        response = await self.inner.handle_async_request(request)
+        headers_at = perf_counter() - started
+
+        def save(stream: _RecordingStream) -> None:
+            self.store.add(
+                key,
+                {
+                    "method": request.method,
+                    "url": str(request.url),
+                    "request_body": self.store.put_blob(request.content),
+                    "status": response.status_code,
+                    # Raw headers and body, so content encodings replay as they came.
+                    "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in response.headers.raw],
+                    "headers_at": round(headers_at, 4),
+                    "body": self.store.put_blob(b"".join(chunk for _, chunk in stream.chunks)),
+                    "chunks": [[round(offset, 4), len(chunk)] for offset, chunk in stream.chunks],
+                    "complete": stream.complete,
+                },
+            )
+            main_logger.info(f"Recorded {request.method} {request.url} ({key[:12]}, {len(stream.chunks)} chunks)")
+
+        assert isinstance(response.stream, AsyncByteStream)
+        return Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, started, save),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+recording_store = RecordingStore(Path(Config.UPSTREAM_RECORDING_PATH))
+
+
+def get_upstream_transport() -> AsyncBaseTransport | None:
+    """A transport for a new upstream client, or None (httpx's default) when recording is off."""
+    if Config.UPSTREAM_RECORDING == "off":
+        return None
+    return RecordReplayTransport(recording_store, Config.UPSTREAM_RECORDING, Config.UPSTREAM_REPLAY_SPEED)
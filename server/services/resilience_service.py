@@ -0,0 +1,239 @@
+from asyncio import (
+    FIRST_COMPLETED,
+    Task,
+    Timeout,
+    TimeoutError as AsyncTimeoutError,
+    create_task,
+    get_running_loop,
+    timeout,
+    wait,
+)
+from collections import deque
+from contextvars import ContextVar
+from time import monotonic
+from typing import Awaitable, Callable, Literal, TypeVar
+
+from openai import APIError, RateLimitError
+
+from server.config import Config
+from server.models import AiModel, ModelHealthStats
+from server.services.logging_service import main_logger
+from server.services.pocketbase_service import ServerException
+from server.services.scheduler_service import UpstreamQueueTimeoutError
+
+T = TypeVar("T")
+
+
+class UpstreamUnavailableError(ServerException):
+    def __init__(self, model_id: str):
+        super().__init__(f"No healthy model in the fallback chain of {model_id}")
+        self.model_id = model_id
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures. After `cooldown` seconds a single
+    trial request is let through (half-open); its outcome closes or reopens it.
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+
+    def get_state(self) -> Literal["closed", "open", "half-open"]:
+        if self.opened_at is None:
+            return "closed"
+        if monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.get_state()
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.max_failures:
+            self.opened_at = monotonic()
+
+    def release_trial(self) -> None:
+        """Frees the half-open trial slot of a call that ended without an outcome."""
+        self.trial_running = False
+
+
+class UpstreamDeadline:
+    """
+    The first-token timeout of one attempt. Waiting for key quota is the pool's
+    doing, not the model's, so the key pool pauses it and restarts it once it
+    has a key.
+    """
+
+    def __init__(self, scope: Timeout, seconds: float | None):
+        self.scope = scope
+        self.seconds = seconds
+
+    def pause(self) -> None:
+        if not self.scope.expired():
+            self.scope.reschedule(None)
+
+    def restart(self) -> None:
+        if self.seconds is not None and not self.scope.expired():
+            self.scope.reschedule(get_running_loop().time() + self.seconds)
+
+
+upstream_deadline: ContextVar[UpstreamDeadline | None] = ContextVar("upstream_deadline", default=None)
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 256):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def get_p95(self) -> float | None:
+        if len(self._samples) < Config.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class ModelHealth:
+    """Circuit breakers and latency of every upstream model, keyed by model id."""
+
+    def __init__(self):
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latency: dict[str, LatencyTracker] = {}
+        self._fallbacks: dict[str, int] = {}
+        self._hedges: dict[str, int] = {}
+
+    def get_breaker(self, model: AiModel) -> CircuitBreaker:
+        if model.id not in self._breakers:
+            self._breakers[model.id] = CircuitBreaker(
+                model.breaker_failures, model.breaker_cooldown
+            )
+        return self._breakers[model.id]
+
+    def get_chain(self, model: AiModel) -> list[AiModel]:
+        """The model followed by its fallback chain."""
+        chain: list[AiModel] = []
+        current: AiModel | None = model
+        while current is not None and current.id not in [m.id for m in chain]:
+            chain.append(current)
+            current = current.fallback
+        return chain
+
+    async def call_with_fallback(
+        self, model: AiModel, call: Callable[[AiModel], Awaitable[T]]
+    ) -> tuple[AiModel, T]:
+        """
+        Runs `call` on the first model of the chain whose breaker lets it through,
+        bounded by its `first_token_timeout`, moving down the chain on failure.
+        Running out of key quota (429s from every key) or waiting too long for a
+        scheduler slot of the fallback moves on without counting against the model.
+        """
+        last_error: BaseException | None = None
+        for candidate in self.get_chain(model):
+            breaker = self.get_breaker(candidate)
+            if not breaker.allow():
+                continue
+            if candidate is not model:
+                self.record_fallback(model)
+            start = monotonic()
+            try:
+                async with timeout(candidate.first_token_timeout) as scope:
+                    upstream_deadline.set(UpstreamDeadline(scope, candidate.first_token_timeout))
+                    result = await call(candidate)
+            except (RateLimitError, UpstreamQueueTimeoutError) as e:
+                last_error = e
+                continue
+            except (APIError, AsyncTimeoutError) as e:
+                self.record_failure(candidate, e)
+                last_error = e
+                continue
+            except Exception as e:
+                self.record_failure(candidate, e)
+                raise
+            finally:
+                # A cancelled call has no outcome; without this a half-open breaker stays stuck.
+                breaker.release_trial()
+                upstream_deadline.set(None)
+            self.record_success(candidate, monotonic() - start)
+            return candidate, result
+        raise UpstreamUnavailableError(model.id) from last_error
+
+    def record_success(self, model: AiModel, latency: float) -> None:
+        self.get_breaker(model).record_success()
+        self._latency.setdefault(model.id, LatencyTracker()).add(latency)
+
+    def record_failure(self, model: AiModel, error: BaseException) -> None:
+        breaker = self.get_breaker(model)
+        breaker.record_failure()
+        main_logger.warning(
+            f"Model {model.id} failed ({type(error).__name__}: {error}), breaker {breaker.get_state()}"
+        )
+
+    def record_fallback(self, model: AiModel) -> None:
+        self._fallbacks[model.id] = self._fallbacks.get(model.id, 0) + 1
+
+    def get_hedge_delay(self, model: AiModel) -> float:
+        tracker = self._latency.get(model.id)
+        p95 = tracker.get_p95() if tracker is not None else None
+        return p95 if p95 is not None else Config.HEDGE_DEFAULT_DELAY
+
+    async def hedged(self, model: AiModel, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs `call`, and a second copy of it if the first has not finished after
+        the model's p95 latency. The first successful result wins.
+        """
+        tasks: set[Task[T]] = {create_task(call())}
+        error: BaseException | None = None
+        try:
+            # Inside the try, so that a cancelled caller does not leave the first call running.
+            done, _ = await wait(tasks, timeout=self.get_hedge_delay(model))
+            if not done:
+                self._hedges[model.id] = self._hedges.get(model.id, 0) + 1
+                tasks.add(create_task(call()))
+
+            while tasks:
+                done, tasks = await wait(tasks, return_when=FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            assert error is not None
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def get_stats(self) -> dict[str, ModelHealthStats]:
+        return {
+            model_id: ModelHealthStats(
+                state=breaker.get_state(),
+                failures=breaker.failures,
+                latency_p95=(
+                    self._latency[model_id].get_p95() if model_id in self._latency else None
+                ),
+                fallbacks=self._fallbacks.get(model_id, 0),
+                hedges=self._hedges.get(model_id, 0),
+            )
+            for model_id, breaker in self._breakers.items()
+        }
+
+
+model_health = ModelHealth()
@@ -0,0 +1,189 @@
+from asyncio import Future, get_running_loop, wait_for, shield, TimeoutError as AsyncTimeoutError
+from bisect import insort
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from itertools import count
+from time import monotonic
+from typing import AsyncIterator
+
+from server.config import Config
+from server.models import AiModel, Role, QueuedInfo, UpstreamStats
+from server.services.pocketbase_service import ServerException
+
+
+class UpstreamQueueTimeoutError(ServerException):
+    def __init__(self, model_id: str, waited: float):
+        super().__init__(f"Queue deadline exceeded for {model_id} after {waited:.1f}s")
+        self.model_id = model_id
+        self.waited = waited
+
+
+class Ticket:
+    def __init__(self, scheduler: "UpstreamScheduler", model_id: str, priority: int, deadline: float):
+        self.scheduler = scheduler
+        self.model_id = model_id
+        self.priority = priority
+        self.max_wait = deadline
+        self.enqueued_at = monotonic()
+        self.deadline = self.enqueued_at + deadline
+        self.seq = next(scheduler._seq)
+        self.granted: Future[None] = get_running_loop().create_future()
+
+    def requeue(self, model_id: str) -> None:
+        """Waits again, for `model_id`, keeping its place among equal priorities."""
+        self.model_id = model_id
+        self.enqueued_at = monotonic()
+        self.deadline = self.enqueued_at + self.max_wait
+        self.granted = get_running_loop().create_future()
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def get_waited(self) -> float:
+        return monotonic() - self.enqueued_at
+
+    async def wait(self) -> AsyncIterator[QueuedInfo]:
+        """Yields the queue position every poll interval until a slot is granted."""
+        while not self.granted.done():
+            remaining = self.deadline - monotonic()
+            if remaining <= 0:
+                self.scheduler._timeouts += 1
+                raise UpstreamQueueTimeoutError(self.model_id, self.get_waited())
+            yield QueuedInfo(
+                position=self.scheduler.get_position(self), waited=self.get_waited()
+            )
+            try:
+                await wait_for(
+                    shield(self.granted), min(remaining, Config.UPSTREAM_QUEUE_POLL)
+                )
+            except AsyncTimeoutError:
+                pass
+
+
+class UpstreamScheduler:
+    """
+    Caps concurrent upstream completions globally and per model. Waiting requests
+    are served in role order (admin first), then first come first served.
+    """
+
+    def __init__(self, max_concurrency: int, default_model_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.default_model_concurrency = default_model_concurrency
+        self._model_limits: dict[str, int] = {}
+        self._active: dict[str, int] = {}
+        self._active_total = 0
+        self._waiting: list[Ticket] = []
+        self._seq = count()
+        self._recent_waits: deque[float] = deque(maxlen=512)
+        self._timeouts = 0
+
+    @classmethod
+    def get_priority(cls, role: Role | None) -> int:
+        role_ids = [r.id for r in Config.ROLES]
+        if role is None or role.id not in role_ids:
+            return role_ids.index(Config.ROLES[-1].id)
+        return role_ids.index(role.id)
+
+    def _has_capacity(self, model_id: str) -> bool:
+        return (
+            self._active_total < self.max_concurrency
+            and self._active.get(model_id, 0) < self._model_limits[model_id]
+        )
+
+    def _grant(self, ticket: Ticket) -> None:
+        self._active_total += 1
+        self._active[ticket.model_id] = self._active.get(ticket.model_id, 0) + 1
+        self._recent_waits.append(ticket.get_waited())
+        ticket.granted.set_result(None)
+
+    def _dispatch(self) -> None:
+        for ticket in list(self._waiting):
+            if self._active_total >= self.max_concurrency:
+                break
+            if self._has_capacity(ticket.model_id):
+                self._waiting.remove(ticket)
+                self._grant(ticket)
+
+    def _release(self, ticket: Ticket) -> None:
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            return
+        if ticket.granted.done() and not ticket.granted.cancelled():
+            self._active_total -= 1
+            self._active[ticket.model_id] -= 1
+            self._dispatch()
+
+    def get_queue_depth(self) -> int:
+        return len(self._waiting)
+
+    def get_position(self, ticket: Ticket) -> int:
+        try:
+            return self._waiting.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def _set_limit(self, model: AiModel) -> None:
+        self._model_limits.setdefault(
+            model.id, model.max_concurrency or self.default_model_concurrency
+        )
+
+    @asynccontextmanager
+    async def slot(self, model: AiModel, role: Role | None) -> AsyncIterator[Ticket]:
+        """
+        Reserves an upstream slot for the duration of the block. Iterate
+        `ticket.wait()` inside the block before calling the model.
+        """
+        self._set_limit(model)
+        ticket = Ticket(
+            self,
+            model.id,
+            self.get_priority(role),
+            Config.UPSTREAM_QUEUE_DEADLINES.get(
+                role.id if role is not None else "", Config.UPSTREAM_QUEUE_DEADLINE
+            ),
+        )
+        insort(self._waiting, ticket)
+        self._dispatch()
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    async def move(self, ticket: Ticket, model: AiModel) -> None:
+        """
+        Hands a granted slot back and waits for one of `model` instead, for a
+        request the fallback chain moved on to another model, so the fallback
+        stays within its own concurrency cap.
+        """
+        self._release(ticket)
+        self._set_limit(model)
+        ticket.requeue(model.id)
+        insort(self._waiting, ticket)
+        self._dispatch()
+        async for _ in ticket.wait():
+            pass
+
+    def get_stats(self) -> UpstreamStats:
+        waits = sorted(self._recent_waits)
+        return UpstreamStats(
+            active=self._active_total,
+            active_by_model=dict(self._active),
+            queued=len(self._waiting),
+            queued_by_model={
+                model_id: sum(1 for t in self._waiting if t.model_id == model_id)
+                for model_id in {t.model_id for t in self._waiting}
+            },
+            wait_avg=sum(waits) / len(waits) if waits else 0.0,
+            wait_p95=waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            timeouts=self._timeouts,
+        )
+
+
+# The ticket of the request being served, for `UpstreamScheduler.move` on fallback.
+scheduled_ticket: ContextVar[Ticket | None] = ContextVar("scheduled_ticket", default=None)
+
+upstream_scheduler = UpstreamScheduler(
+    max_concurrency=Config.UPSTREAM_MAX_CONCURRENCY,
+    default_model_concurrency=Config.UPSTREAM_MODEL_CONCURRENCY,
+)
@@ -0,0 +1,162 @@
+from asyncio import Queue, QueueFull, Task, create_task, gather
+from typing import AsyncIterator, Callable
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from starlette.datastructures import Headers
+
+from server.config import Config
+from server.models import (
+    BalanceInfo,
+    ErrorInfo,
+    ServerResponseBalance,
+    ServerResponseDone,
+    ServerResponseError,
+    ServerResponseItem,
+    ServerResponseTiming,
+    SessionMessage,
+    SessionQuery,
+)
+from server.services.admission_service import admission_controller
+from server.services.auth_service import AuthorizationMiddleware, RequestAuth
+from server.services.batch_service import BatchService
+from server.services.logging_service import main_logger, request_id
+from server.services.pocketbase_service import PocketBaseService, NotEnoughBalanceError
+from server.services.timing_service import RequestTiming, current_timing
+
+SessionRunner = Callable[[PocketBaseService, SessionQuery], AsyncIterator[str]]
+
+
+class QuerySession:
+    """
+    One WebSocket per client, authenticated once by its first (`auth`) message.
+    It then carries many concurrent queries, each event tagged with the query id
+    like `/api/batch` lines, their cancellation, and balance pushes.
+    """
+
+    def __init__(self, websocket: WebSocket, runners: dict[str, SessionRunner]):
+        self.websocket = websocket
+        self.runners = runners
+        self.ip_address = AuthorizationMiddleware.get_ip_address(
+            websocket.scope, Headers(scope=websocket.scope)
+        )
+        self.token: str | None = None
+        self.outbox: "Queue[str]" = Queue(maxsize=Config.SESSION_OUTBOX)
+        self.tasks: dict[str, Task[None]] = {}
+
+    async def _send_loop(self) -> None:
+        while True:
+            await self.websocket.send_text((await self.outbox.get()).rstrip("\n"))
+
+    async def _emit(self, query_id: str, item: ServerResponseItem) -> None:
+        for line in BatchService.tag([query_id], item.to_jsonl_str()):
+            await self.outbox.put(line)
+
+    async def _emit_error(
+        self, query_id: str, message: str, retry_after: float | None = None
+    ) -> None:
+        error = ErrorInfo(message=message, retry_after=retry_after)
+        await self._emit(query_id, ServerResponseError.create(error))
+
+    def _on_balance(self, balance: BalanceInfo) -> None:
+        try:
+            self.outbox.put_nowait(ServerResponseBalance.create(balance).to_jsonl_str())
+        except QueueFull:
+            pass  # The next charge pushes a fresh balance anyway.
+
+    async def _authenticate(self) -> PocketBaseService:
+        message = SessionMessage.model_validate_json(await self.websocket.receive_text())
+        if message.op != "auth":
+            raise ValueError("The first message must be `auth`")
+        self.token = message.token
+        pb = await RequestAuth(self.ip_address, self.token).get_pocketbase()
+        if pb.latest_auth_result is None:
+            raise ValueError("Authentication failed")
+        if self.token is not None:
+            admission_controller.remember_role(self.token, pb.latest_auth_result.user.role.id)
+        pb.balance_listeners.append(self._on_balance)
+        return pb
+
+    async def _run_query(self, pb: PocketBaseService, query: SessionQuery) -> None:
+        # Each query runs in its own task, so this timing covers only its spans.
+        timing = RequestTiming(f"/api/session/{query.kind}")
+        current_timing.set(timing)
+        request_id.set(f"{request_id.get()}/{query.id}")
+        try:
+            rejection = admission_controller.evaluate(self.ip_address, self.token)
+            if rejection is not None:
+                _, message, retry_after = rejection
+                await self._emit_error(query.id, message, retry_after)
+            else:
+                admission_controller.in_flight += 1
+                try:
+                    if query.kind != "freq":
+                        # As over HTTP, frequency lookups are charged but not gated on the balance.
+                        await pb.balance_check()
+                    async for line in self.runners[query.kind](pb, query):
+                        for tagged in BatchService.tag([query.id], line):
+                            await self.outbox.put(tagged)
+                finally:
+                    admission_controller.in_flight -= 1
+        except NotEnoughBalanceError:
+            await self._emit_error(query.id, "Not enough balance")
+        except Exception as e:
+            main_logger.warning(f"Session query {query.id} failed: {e}")
+            await self._emit_error(query.id, "Query failed")
+        await self._emit(query.id, ServerResponseTiming.create(timing.get_info()))
+        await self._emit(query.id, ServerResponseDone.create())
+        self.tasks.pop(query.id, None)
+        timing.finish()
+
+    def _start(self, pb: PocketBaseService, query: SessionQuery) -> str | None:
+        """Starts the query, or returns why it cannot start."""
+        if query.id in self.tasks:
+            return "Duplicate query id"
+        if len(self.tasks) >= Config.SESSION_MAX_QUERIES:
+            return "Too many queries in flight"
+        self.tasks[query.id] = create_task(self._run_query(pb, query))
+        return None
+
+    def _cancel(self, query_id: str) -> None:
+        # Cancelled queries stop their upstream completions and bill what was generated.
+        task = self.tasks.pop(query_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def run(self) -> None:
+        await self.websocket.accept()
+        try:
+            pb = await self._authenticate()
+        except WebSocketDisconnect:
+            return
+        except Exception as e:
+            main_logger.warning(f"Session auth from {self.ip_address} failed: {e}")
+            error = ServerResponseError.create(ErrorInfo(message="Authentication failed"))
+            await self.websocket.send_text(error.to_jsonl_str())
+            await self.websocket.close(code=1008)
+            return
+
+        sender = create_task(self._send_loop())
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                try:
+                    message = SessionMessage.model_validate_json(text)
+                except ValidationError:
+                    await self._emit_error("", "Bad message")
+                    continue
+                if message.op == "query" and message.query is not None:
+                    refused = self._start(pb, message.query)
+                    if refused is not None:
+                        await self._emit_error(message.query.id, refused)
+                        await self._emit(message.query.id, ServerResponseDone.create())
+                elif message.op == "cancel" and message.id is not None:
+                    self._cancel(message.id)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            pb.balance_listeners.remove(self._on_balance)
+            tasks = [*self.tasks.values(), sender]
+            for task in tasks:
+                task.cancel()
+            await gather(*tasks, return_exceptions=True)
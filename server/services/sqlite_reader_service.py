@@ -0,0 +1,103 @@
+from sqlite3 import connect, Connection, Row, Error as SqliteError
+from threading import local
+from asyncio import to_thread
+from math import ceil
+from typing import Any, Callable, TypeVar
+
+from server.services.logging_service import main_logger
+from server.config import Config
+
+T = TypeVar("T")
+
+
+class SqliteReaderService:
+    """
+    Read-only access to the PocketBase SQLite database for hot lookups.
+
+    PocketBase keeps its database in WAL mode, so readers never block its writer.
+    Every write still goes through the PocketBase HTTP API.
+    """
+
+    SQL_ZDIC_CACHE = "SELECT id, query, content, created, updated FROM zdicCache WHERE query = ? LIMIT 1"
+    SQL_ROLE = "SELECT id, name, daily_coins FROM roles WHERE id = ? LIMIT 1"
+    SQL_CORPUS_STATS = "SELECT id, query, freqTextbook, freqDataset, freqQuery, updated FROM corpusStats WHERE query = ? LIMIT 1"
+    SQL_CORPUS_COUNT = "SELECT COUNT(*) FROM corpus WHERE query LIKE ? ESCAPE '\\'"
+    SQL_CORPUS_PAGE = "SELECT id, query, queryUser, type, context, answer FROM corpus WHERE query LIKE ? ESCAPE '\\' ORDER BY rowid LIMIT ? OFFSET ?"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = local()
+
+    def _get_connection(self) -> Connection:
+        # sqlite3 connections must stay on the thread that created them.
+        connection: Connection | None = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = connect(
+                f"file:{self.path}?mode=ro", uri=True, cached_statements=32
+            )
+            connection.row_factory = Row
+            connection.execute("PRAGMA query_only = ON")
+            connection.execute("PRAGMA busy_timeout = 1000")
+            self._local.connection = connection
+        return connection
+
+    async def _run(self, func: Callable[[Connection], T]) -> T:
+        return await to_thread(lambda: func(self._get_connection()))
+
+    @classmethod
+    def escape_like(cls, word: str) -> str:
+        return word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    async def zdc_search(self, query: str) -> dict[str, Any] | None:
+        def fetch(connection: Connection):
+            row = connection.execute(self.SQL_ZDIC_CACHE, (query,)).fetchone()
+            return None if row is None else dict(row)
+
+        return await self._run(fetch)
+
+    async def roles_get(self, id: str) -> dict[str, Any] | None:
+        def fetch(connection: Connection):
+            row = connection.execute(self.SQL_ROLE, (id,)).fetchone()
+            return None if row is None else dict(row)
+
+        return await self._run(fetch)
+
+    async def corpus_stats_get(self, query: str) -> dict[str, Any] | None:
+        def fetch(connection: Connection):
+            row = connection.execute(self.SQL_CORPUS_STATS, (query,)).fetchone()
+            return None if row is None else dict(row)
+
+        return await self._run(fetch)
+
+    async def corpus_list(
+        self, query: str, page: int, per_page: int
+    ) -> tuple[list[dict[str, Any]], int]:
+        """Equivalent of the PocketBase filter `query~'...'`. Returns items and total pages."""
+        pattern = f"%{self.escape_like(query)}%"
+
+        def fetch(connection: Connection):
+            total_items: int = connection.execute(
+                self.SQL_CORPUS_COUNT, (pattern,)
+            ).fetchone()[0]
+            rows = connection.execute(
+                self.SQL_CORPUS_PAGE, (pattern, per_page, (page - 1) * per_page)
+            ).fetchall()
+            return [dict(row) for row in rows], ceil(total_items / per_page)
+
+        return await self._run(fetch)
+
+
+def init_sqlite_reader() -> SqliteReaderService | None:
+    if not Config.PB_SQLITE_PATH:
+        return None
+    try:
+        reader = SqliteReaderService(Config.PB_SQLITE_PATH)
+        reader._get_connection()
+        main_logger.info(f"SQLite read path enabled ({Config.PB_SQLITE_PATH})")
+        return reader
+    except SqliteError as e:
+        main_logger.error(f"SQLite read path disabled: {e}")
+        return None
+
+
+sqlite_reader = init_sqlite_reader()
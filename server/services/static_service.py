@@ -0,0 +1,89 @@
+from os import stat, stat_result, PathLike
+from re import compile
+from mimetypes import guess_type
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    Serves the Vite bundle, preferring `.br`/`.gz` files prebuilt by
+    `scripts/precompress.py`, and marks hashed assets as immutable.
+    """
+
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+    # Vite emits `assets/<name>-<8 char hash>.<ext>`.
+    HASHED_ASSET = compile(r"/assets/.+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+    CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+    CACHE_CONTROL_DEFAULT = "no-cache"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The bundle does not change while the server runs, so variants are probed once.
+        self._variants: dict[tuple[str, str], stat_result | None] = {}
+
+    @classmethod
+    def get_accepted_encodings(cls, request_headers: Headers) -> set[str]:
+        accepted: set[str] = set()
+        for item in request_headers.get("accept-encoding", "").split(","):
+            encoding, _, params = item.strip().partition(";")
+            if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(encoding.strip().lower())
+        return accepted
+
+    def _get_variant(self, full_path: str, suffix: str) -> stat_result | None:
+        key = (full_path, suffix)
+        if key not in self._variants:
+            try:
+                self._variants[key] = stat(full_path + suffix)
+            except OSError:
+                self._variants[key] = None
+        return self._variants[key]
+
+    def file_response(
+        self,
+        full_path: PathLike[str] | str,
+        stat_result: stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        path = str(full_path)
+        media_type = guess_type(path)[0] or "text/plain"
+        accepted = self.get_accepted_encodings(request_headers)
+
+        response: Response | None = None
+        for encoding, suffix in self.ENCODINGS:
+            if encoding not in accepted:
+                continue
+            variant = self._get_variant(path, suffix)
+            if variant is None:
+                continue
+            response = FileResponse(
+                path + suffix,
+                status_code=status_code,
+                stat_result=variant,
+                media_type=media_type,
+                headers={"Content-Encoding": encoding},
+            )
+            break
+
+        if response is None:
+            response = FileResponse(
+                path, status_code=status_code, stat_result=stat_result
+            )
+
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = (
+            self.CACHE_CONTROL_IMMUTABLE
+            if self.HASHED_ASSET.search(path.replace("\\", "/"))
+            else self.CACHE_CONTROL_DEFAULT
+        )
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,155 @@
+from asyncio import Event, Task, TimerHandle, create_task, get_running_loop
+from collections import OrderedDict
+from json import JSONDecodeError, dumps, loads
+from secrets import token_urlsafe
+from time import monotonic
+from typing import AsyncIterator
+
+from server.config import Config
+from server.models import ErrorInfo, ServerResponseError
+from server.services.cache_service import cache_backend
+from server.services.logging_service import main_logger
+
+
+class BufferedStream:
+    """
+    NDJSON lines of one query, produced by a background task and buffered so that
+    a reader can (re)attach at any line offset.
+    """
+
+    def __init__(self, stream_id: str, owner: str, grace: float):
+        self.id = stream_id
+        self.owner = owner
+        self.grace = grace
+        self.lines: list[str] = []
+        self.done = False
+        self.finished_at: float | None = None
+        self.readers = 0
+        self.task: Task[None] | None = None
+        self._changed = Event()
+        self._abandon_handle: TimerHandle | None = None
+
+    def append(self, line: str) -> None:
+        self.lines.append(line)
+        self._notify()
+
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = monotonic()
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = Event()
+
+    def _attach(self) -> None:
+        self.readers += 1
+        if self._abandon_handle is not None:
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+
+    def _detach(self) -> None:
+        self.readers -= 1
+        if self.readers == 0 and not self.done:
+            # Keep generating for a while, so a reconnect finds the rest of the answer.
+            self._abandon_handle = get_running_loop().call_later(self.grace, self._abandon)
+
+    def _abandon(self) -> None:
+        self._abandon_handle = None
+        if self.readers == 0 and not self.done and self.task is not None:
+            main_logger.info(f"Stream {self.id} abandoned, cancelling")
+            self.task.cancel()
+
+    async def read(self, offset: int) -> AsyncIterator[str]:
+        """Yields the lines from `offset` on, waiting for new ones until the stream is done."""
+        self._attach()
+        try:
+            while True:
+                changed = self._changed
+                while offset < len(self.lines):
+                    yield self.lines[offset]
+                    offset += 1
+                if self.done:
+                    return
+                await changed.wait()
+        finally:
+            self._detach()
+
+
+class StreamStore:
+    """
+    Bounded store of recent query streams. Finished streams are kept for `ttl`
+    seconds, so a client that lost the connection can resume or replay them
+    without another upstream call or charge. With a shared cache backend they
+    are also saved there, so the resume may land on any worker.
+    """
+
+    def __init__(self, max_streams: int, ttl: float, grace: float):
+        self.max_streams = max_streams
+        self.ttl = ttl
+        self.grace = grace
+        self._streams: OrderedDict[str, BufferedStream] = OrderedDict()
+
+    def _evict(self) -> None:
+        now = monotonic()
+        for stream in list(self._streams.values()):
+            if stream.finished_at is not None and (
+                now - stream.finished_at > self.ttl or len(self._streams) >= self.max_streams
+            ):
+                del self._streams[stream.id]
+
+    def start(self, owner: str, source: AsyncIterator[str]) -> BufferedStream:
+        """Starts buffering `source` in the background and returns the new stream."""
+        self._evict()
+        stream = BufferedStream(token_urlsafe(12), owner, self.grace)
+        stream.task = create_task(self._pump(stream, source))
+        self._streams[stream.id] = stream
+        return stream
+
+    async def _pump(self, stream: BufferedStream, source: AsyncIterator[str]) -> None:
+        try:
+            async for line in source:
+                stream.append(line)
+        except Exception as e:
+            main_logger.error(f"Stream {stream.id} failed: {e}")
+            stream.append(
+                ServerResponseError.create(ErrorInfo(message="Server error")).to_jsonl_str()
+            )
+        finally:
+            stream.finish()
+        # Not reached when abandoned: nobody is left to resume a cancelled stream.
+        if cache_backend.shared:
+            value = dumps({"owner": stream.owner, "lines": stream.lines}, ensure_ascii=False)
+            await cache_backend.set(f"stream:{stream.id}", value, self.ttl)
+
+    def get(self, stream_id: str, owner: str) -> BufferedStream | None:
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.owner != owner:
+            return None
+        return stream
+
+    async def load(self, stream_id: str, owner: str) -> BufferedStream | None:
+        """Like `get`, falling back to a finished stream another worker saved."""
+        stream = self.get(stream_id, owner)
+        if stream is not None or not cache_backend.shared:
+            return stream
+        value = await cache_backend.get(f"stream:{stream_id}")
+        if value is None:
+            return None
+        try:
+            saved = loads(value)
+        except JSONDecodeError:
+            return None
+        if saved.get("owner") != owner:
+            return None
+        stream = BufferedStream(stream_id, owner, self.grace)
+        stream.lines = saved["lines"]
+        stream.finish()
+        return stream
+
+
+stream_store = StreamStore(
+    max_streams=Config.STREAM_STORE_MAX,
+    ttl=Config.STREAM_STORE_TTL,
+    grace=Config.STREAM_RESUME_GRACE,
+)
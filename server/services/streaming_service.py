@@ -0,0 +1,153 @@
+from asyncio import Queue, ensure_future, get_running_loop, wait, wait_for
+from typing import AsyncIterator, TypeVar
+from zlib import compressobj, Z_SYNC_FLUSH
+
+from anyio import create_task_group
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import Headers
+from starlette.types import Scope, Receive, Send
+
+from server.config import Config
+from server.models import ServerResponseAi, ServerResponseAiFlash, ServerResponseType
+
+T = TypeVar("T")
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    """
+    Stops the body as soon as the client disconnects. Under ASGI 2.4 uvicorn drops
+    messages sent after a disconnect without raising, so a plain `StreamingResponse`
+    would keep draining the upstream completion to its end.
+    """
+
+    async def _gzipped(self, body: AsyncIterator[str | bytes]) -> AsyncIterator[bytes]:
+        # A sync flush per chunk keeps every event decodable as soon as it arrives.
+        compressor = compressobj(Config.STREAM_GZIP_LEVEL, wbits=31)
+        try:
+            async for chunk in body:
+                data = chunk.encode(self.charset) if isinstance(chunk, str) else chunk
+                yield compressor.compress(data) + compressor.flush(Z_SYNC_FLUSH)
+            yield compressor.flush()
+        finally:
+            aclose = getattr(body, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if Config.STREAM_GZIP and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            self.body_iterator = self._gzipped(self.body_iterator)
+            self.headers["Content-Encoding"] = "gzip"
+            self.headers.add_vary_header("Accept-Encoding")
+
+        async with create_task_group() as task_group:
+
+            async def stream() -> None:
+                await self.stream_response(send)
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(stream)
+            await self.listen_for_disconnect(receive)
+            task_group.cancel_scope.cancel()
+
+        # The body may have been suspended at a `yield` rather than cancelled inside;
+        # close it so its cleanup (closing upstream streams, billing) runs now.
+        aclose = getattr(self.body_iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+        if self.background is not None:
+            await self.background()
+
+
+def _get_delta_key(item: object) -> ServerResponseType | None:
+    if isinstance(item, (ServerResponseAi, ServerResponseAiFlash)):
+        return item.type
+    return None
+
+
+def _merge_deltas(key: ServerResponseType, contents: list[str], stopped: bool):
+    content = "".join(contents)
+    if key == ServerResponseType.AiFlash:
+        return ServerResponseAiFlash.create(content)
+    return ServerResponseAi.create_delta(key, content, stopped)
+
+
+class _StreamEnd:
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+
+
+async def _pump(items: AsyncIterator[T], queue: "Queue[T | _StreamEnd]") -> None:
+    try:
+        async for item in items:
+            await queue.put(item)
+    except Exception as e:
+        await queue.put(_StreamEnd(e))
+    else:
+        await queue.put(_StreamEnd())
+
+
+async def coalesce_deltas(
+    items: AsyncIterator[T], interval: float, max_bytes: int
+) -> AsyncIterator[T]:
+    """
+    Merges adjacent deltas of the same type into one event, sent once `max_bytes`
+    of content are pending or the first of them has waited `interval` seconds.
+    Any other event, and the delta that stops the answer, flushes at once.
+    """
+    loop = get_running_loop()
+    pending: list[str] = []
+    pending_key: ServerResponseType | None = None
+    pending_bytes = 0
+    deadline = 0.0
+
+    def flush(stopped: bool = False):
+        nonlocal pending, pending_key, pending_bytes
+        assert pending_key is not None
+        merged = _merge_deltas(pending_key, pending, stopped)
+        pending, pending_key, pending_bytes = [], None, 0
+        return merged
+
+    # All upstream reads happen in one task, so a flush on timeout never cuts a read,
+    # and the upstream connection is cleaned up by the task that reads it.
+    queue: "Queue[T | _StreamEnd]" = Queue(maxsize=1)
+    pump = ensure_future(_pump(items, queue))
+    try:
+        while True:
+            if pending:
+                try:
+                    item = await wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                except TimeoutError:
+                    yield flush()
+                    continue
+            else:
+                item = await queue.get()
+            if isinstance(item, _StreamEnd):
+                if pending:
+                    yield flush()
+                if item.error is not None:
+                    raise item.error
+                break
+
+            key = _get_delta_key(item)
+            if pending and key != pending_key:
+                yield flush()
+            if key is None:
+                yield item
+                continue
+
+            assert isinstance(item, (ServerResponseAi, ServerResponseAiFlash))
+            content = item.data if isinstance(item, ServerResponseAiFlash) else item.data.content
+            stopped = isinstance(item, ServerResponseAi) and item.data.stopped
+            if not pending:
+                pending_key = key
+                deadline = loop.time() + interval
+            pending.append(content)
+            pending_bytes += len(content.encode("utf-8"))
+            if stopped or pending_bytes >= max_bytes or loop.time() >= deadline:
+                yield flush(stopped)
+    finally:
+        # Cancelled once and not awaited through `gather`, which would pass on every
+        # repeated cancellation of this task and cut the upstream cleanup short.
+        pump.cancel()
+        await wait({pump})
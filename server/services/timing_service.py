@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from json import dumps
+from random import random
+from time import perf_counter, time
+from typing import AsyncIterator, Iterator
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Scope, Receive, Send
+
+from server.config import Config
+from server.models import ServerResponseTiming, TimingInfo, TimingSpan
+from server.services.logging_service import request_id, trace_logger
+
+
+class RequestTiming:
+    """The spans of one request (or one query of a session), relative to its start."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = perf_counter()
+        self.spans: list[tuple[str, float, float]] = []  # (name, offset, duration)
+
+    def add(self, name: str, started: float, duration: float) -> None:
+        self.spans.append((name, started - self.started, duration))
+
+    def get_info(self) -> TimingInfo:
+        totals: dict[str, list[float]] = {}
+        for name, _, duration in self.spans:
+            total = totals.setdefault(name, [0.0, 0])
+            total[0] += duration
+            total[1] += 1
+        return TimingInfo(
+            total_ms=round((perf_counter() - self.started) * 1000, 1),
+            spans=[
+                TimingSpan(name=name, duration_ms=round(duration * 1000, 1), count=int(count))
+                for name, (duration, count) in totals.items()
+            ],
+        )
+
+    def get_server_timing(self) -> str:
+        info = self.get_info()
+        entries = [
+            f"{span.name};dur={span.duration_ms}"
+            + (f';desc="{span.count} calls"' if span.count > 1 else "")
+            for span in info.spans
+        ]
+        entries.append(f"total;dur={info.total_ms}")
+        return ", ".join(entries)
+
+    def finish(self) -> None:
+        """Appends the spans to the trace log, for a sample of requests."""
+        if Config.TIMING_TRACE_SAMPLE <= 0 or random() >= Config.TIMING_TRACE_SAMPLE:
+            return
+        trace_logger.info(
+            dumps(
+                {
+                    "name": self.name,
+                    "request_id": request_id.get(),
+                    "at": time(),
+                    "total_ms": round((perf_counter() - self.started) * 1000, 1),
+                    "spans": [
+                        [name, round(offset * 1000, 1), round(duration * 1000, 1)]
+                        for name, offset, duration in self.spans
+                    ],
+                },
+                ensure_ascii=False,
+            )
+        )
+
+
+current_timing: ContextVar[RequestTiming | None] = ContextVar("current_timing", default=None)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Records the block as a span of the current request, if any."""
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, started, perf_counter() - started)
+
+
+def record_span(name: str, started: float) -> None:
+    """Records a span that started at `started` (a `perf_counter` time) and ends now."""
+    timing = current_timing.get()
+    if timing is not None:
+        timing.add(name, started, perf_counter() - started)
+
+
+async def with_timing_event(lines: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Passes an NDJSON stream through and ends it with a `timing` event."""
+    async for line in lines:
+        yield line
+    timing = current_timing.get()
+    if timing is not None:
+        yield ServerResponseTiming.create(timing.get_info()).to_jsonl_str()
+
+
+class TimingMiddleware:
+    """
+    Pure ASGI middleware timing `/api/` requests. The spans recorded so far go out
+    as a `Server-Timing` header when the response starts, which for JSON endpoints
+    is all of them; streams end with a `timing` event instead.
+    """
+
+    API_PREFIX = "/api/"
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.API_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming(scope["path"])
+        token = current_timing.set(timing)
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", timing.get_server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timing.reset(token)
+            timing.finish()
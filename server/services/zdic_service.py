@@ -1,61 +1,130 @@
 from httpx import AsyncClient
 from bs4 import BeautifulSoup
 from urllib.parse import quote
+from json import dumps, loads
+from time import perf_counter
+from server.config import Config
 from server.services.pocketbase_service import PocketBaseService
-from server.models import ZdicResult, ZdicExplanations
+from server.services.cache_service import cache_backend
+from server.services.executor_service import run_cpu
+from server.services.recording_service import get_upstream_transport
+from server.services.http_cache_service import make_etag
+from server.services.metrics_service import zdic_lookups_total, zdic_upstream_seconds
+from server.services.timing_service import record_span, timed
+from server.models import ZdicResult, ZdicExplanations, ZdicLookup
 
-ZDIC_URL = "https://www.zdic.net/hans/"
+
+def parse_zdic_html(zdic_response: str) -> tuple[ZdicExplanations, str]:
+    """Explanations of a zdic.net page, and the same as JSON for the cache."""
+    soup = BeautifulSoup(zdic_response, "html.parser")
+
+    basic = [
+        li.get_text()
+        for li in soup.select(".zdict div.content.definitions.jnr>ol>li")  # type: ignore
+    ]
+    detailed = [
+        p.get_text() for p in soup.select("#xxjs div.content.definitions.xnr>p")  # type: ignore
+    ]
+    phrase = [
+        p.get_text() for p in soup.select(".nr-box div.content.definitions .jnr>p")  # type: ignore
+    ]
+
+    explanations = ZdicExplanations(basic=basic, detailed=detailed, phrase=phrase)
+    return explanations, explanations.model_dump_json()
 
 class ZdicService:
     def __init__(self, pb: PocketBaseService):
-        self.zdic_url = ZDIC_URL
+        self.zdic_url = Config.ZDIC_URL
         self.pb = pb
 
-    async def get_result(self, word: str) -> ZdicResult | None:
+    async def lookup(self, word: str) -> ZdicLookup | None:
+        """Finds the explanations of a word without charging for them."""
+        with timed("zdic"):
+            return await self._lookup(word)
+
+    async def _search(self, word: str) -> dict | None:
+        """The zdicCache record of a word, read through the shared cache backend."""
+        shared = await cache_backend.get(f"zdic:{word}")
+        if shared is not None:
+            return loads(shared)
         cache = await self.pb.zdc_search(word)
+        if cache is not None:
+            self._share(word, cache)
+        return cache
+
+    def _share(self, word: str, record: dict) -> None:
+        if record.get("content") is None:
+            return
+        value = dumps({key: record.get(key) for key in ("id", "updated", "content")}, ensure_ascii=False)
+        cache_backend.set_soon(f"zdic:{word}", value, Config.CACHE_ZDIC_TTL)
+
+    async def _lookup(self, word: str) -> ZdicLookup | None:
+        cache = await self._search(word)
+
+        zdic_lookups_total.inc("miss" if cache is None else "hit")
 
         if cache is None:
             response = await self.request_zdic(word)
-            explanations = self.parse_zdic_response(response)
-            await self.pb.zdc_create(
-                word, explanations.model_dump_json()
+            # html.parser is pure Python and takes tens of milliseconds on a full page.
+            explanations, content = await run_cpu(parse_zdic_html, response)
+            record = await self.pb.zdc_create(word, content)
+            self._share(word, record)
+            return ZdicLookup(
+                explanations=explanations,
+                cached=False,
+                version=f"{record.get('id')}:{record.get('updated')}",
+                size=len(content),
             )
-            cached = False
-            coins = 50 + len(explanations.model_dump_json()) // 10
-        else:
-            content = cache.get("content")
-            if content is None:
-                return None
+
+        content = cache.get("content")
+        if content is None:
+            return None
+        if len(content) <= Config.CPU_INLINE_MAX_BYTES:
             explanations = ZdicExplanations.model_validate_json(content)
-            cached = True
-            coins = 10 + len(explanations.model_dump_json()) // 50
+        else:
+            explanations = await run_cpu(ZdicExplanations.model_validate_json, content)
+        return ZdicLookup(
+            explanations=explanations,
+            cached=True,
+            version=f"{cache.get('id')}:{cache.get('updated')}",
+            size=len(content),
+        )
+
+    def get_etag(self, lookup: ZdicLookup) -> str:
+        # Weak, from the entry alone: `cached` in the body says where the response came
+        # from, so the first (uncached) response and later hits differ only in that.
+        return make_etag("zdic", lookup.version, str(lookup.size), weak=True)
+
+    async def charge(self, word: str, lookup: ZdicLookup) -> None:
+        if lookup.cached:
+            coins = 10 + lookup.size // 50
+        else:
+            coins = 50 + lookup.size // 10
 
         await self.pb.users_spend_coins(coins, reason=f"汉典查询 {word}")
 
-        return self.get_final_response(explanations, cached)
+    async def get_result(self, word: str) -> ZdicResult | None:
+        lookup = await self.lookup(word)
+        if lookup is None:
+            return None
+
+        await self.charge(word, lookup)
+
+        return self.get_final_response(lookup.explanations, lookup.cached)
 
     async def request_zdic(self, word: str):
-        async with AsyncClient() as client:
-            response = await client.get(self.zdic_url + quote(word), timeout=10)
-            if response.status_code == 200:
-                return response.text
-            return f"Error {response.status_code}: {response.text}"
-
-    def parse_zdic_response(self, zdic_response: str) -> ZdicExplanations:
-        soup = BeautifulSoup(zdic_response, "html.parser")
-
-        basic = [
-            li.get_text()
-            for li in soup.select(".zdict div.content.definitions.jnr>ol>li")  # type: ignore
-        ]
-        detailed = [
-            p.get_text() for p in soup.select("#xxjs div.content.definitions.xnr>p")  # type: ignore
-        ]
-        phrase = [
-            p.get_text() for p in soup.select(".nr-box div.content.definitions .jnr>p")  # type: ignore
-        ]
-
-        return ZdicExplanations(basic=basic, detailed=detailed, phrase=phrase)
+        started = perf_counter()
+        outcome = "error"
+        try:
+            async with AsyncClient(transport=get_upstream_transport()) as client:
+                response = await client.get(self.zdic_url + quote(word), timeout=10)
+                outcome = str(response.status_code)
+                if response.status_code == 200:
+                    return response.text
+                return f"Error {response.status_code}: {response.text}"
+        finally:
+            zdic_upstream_seconds.observe(perf_counter() - started, outcome)
+            record_span("zdic-upstream", started)
 
     def get_final_response(self, explanations: ZdicExplanations, cached: bool) -> ZdicResult:
         basic_explanations = explanations.basic
@@ -98,3 +167,10 @@ class ZdicService:
             zdic_prompt=zdic_prompt,
             cached=cached
         )
+
+    async def get_final_json(self, lookup: ZdicLookup) -> str:
+        """The final response as JSON; large ones are serialized off the loop."""
+        result = self.get_final_response(lookup.explanations, lookup.cached)
+        if lookup.size <= Config.CPU_INLINE_MAX_BYTES:
+            return result.model_dump_json()
+        return await run_cpu(result.model_dump_json)
@@ -0,0 +1,15 @@
+from os import environ
+from pathlib import Path
+from tempfile import gettempdir
+
+import pytest
+
+# Set before any server module is imported: the key pool is built at import time and
+# needs a key (no test reaches the upstream), and logs stay out of the working tree.
+environ.setdefault("API_KEY", "test")
+environ.setdefault("LOG_PATH", str(Path(gettempdir()) / "wyw-tests.log"))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
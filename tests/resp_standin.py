@@ -0,0 +1,106 @@
+"""
+`RespStandIn`, a single-process server speaking enough RESP2 for
+`RespCacheBackend`, so its tests and `bench.cache_backends` need no Redis.
+"""
+
+from asyncio import CancelledError, Server, StreamReader, StreamWriter, start_server
+from time import monotonic
+from typing import Any
+
+from server.services.cache_service import RespCacheBackend
+
+
+class RespStandIn:
+    """
+    Single-process stand-in for a Redis server: PING, AUTH, SELECT, GET, SET with
+    EX/PX/NX, DEL, and EVAL of the backend's unlock script. Expiry is lazy.
+    """
+
+    def __init__(self, password: str | None = None):
+        self.password = password
+        self.databases: dict[int, dict[bytes, tuple[bytes, float | None]]] = {}
+        self.commands = 0
+
+    @classmethod
+    def encode(cls, reply: Any) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, bytes):
+            return b"$%d\r\n%s\r\n" % (len(reply), reply)
+        if isinstance(reply, Exception):
+            return f"-{reply}\r\n".encode()
+        return f"+{reply}\r\n".encode()
+
+    async def read_command(self, reader: StreamReader) -> list[bytes] | None:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # inline command, as typed into telnet
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _get(self, db: dict, key: bytes) -> bytes | None:
+        entry = db.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= monotonic():
+            del db[key]
+            return None
+        return entry[0]
+
+    def execute(self, state: dict[str, Any], args: list[bytes]) -> Any:
+        name = args[0].upper()
+        if name == b"AUTH":
+            if args[-1].decode() != self.password:
+                return Exception("WRONGPASS invalid username-password pair")
+            state["authenticated"] = True
+            return "OK"
+        if not state["authenticated"]:
+            return Exception("NOAUTH Authentication required.")
+        db = self.databases.setdefault(state["db"], {})
+        if name == b"PING":
+            return "PONG"
+        if name == b"SELECT":
+            state["db"] = int(args[1])
+            return "OK"
+        if name == b"GET":
+            return self._get(db, args[1])
+        if name == b"SET":
+            key, value, options = args[1], args[2], [option.upper() for option in args[3:]]
+            expires = None
+            for unit, scale in ((b"EX", 1.0), (b"PX", 0.001)):
+                if unit in options:
+                    expires = monotonic() + int(options[options.index(unit) + 1]) * scale
+            if b"NX" in options and self._get(db, key) is not None:
+                return None
+            db[key] = (value, expires)
+            return "OK"
+        if name == b"DEL":
+            return sum(1 for key in args[1:] if db.pop(key, None) is not None)
+        if name == b"EVAL" and args[1].decode() == RespCacheBackend.UNLOCK_SCRIPT:
+            if self._get(db, args[3]) == args[4]:
+                del db[args[3]]
+                return 1
+            return 0
+        return Exception(f"ERR unknown command '{name.decode()}'")
+
+    async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        state = {"db": 0, "authenticated": self.password is None}
+        try:
+            while (args := await self.read_command(reader)) is not None:
+                self.commands += 1
+                writer.write(self.encode(self.execute(state, args)))
+                await writer.drain()
+        except (ConnectionError, CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, port: int) -> Server:
+        return await start_server(self.handle, "127.0.0.1", port)
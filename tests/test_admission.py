@@ -0,0 +1,86 @@
+from pytest import approx
+
+from server.config import Config, Roles
+from server.services import admission_service
+from server.services.admission_service import AdmissionController, RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission_service, "monotonic", clock)
+    bucket = TokenBucket(rate=2.0, capacity=3.0)
+
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.take() == 0.0
+    clock.now += 100
+    assert [bucket.take() for _ in range(4)][-1] > 0  # refills up to capacity only
+
+
+def test_rate_limiter_keeps_buckets_apart_and_bounded():
+    limiter = RateLimiter(max_keys=2)
+    assert limiter.take("a", 0.1, 1) == 0.0
+    assert limiter.take("a", 0.1, 1) > 0
+    assert limiter.take("b", 0.1, 1) == 0.0
+
+    limiter.take("c", 0.1, 1)  # evicts "a", the least recently used
+    assert limiter.take("a", 0.1, 1) == 0.0
+
+
+def test_unknown_tokens_share_the_guest_bucket_of_their_ip():
+    controller = AdmissionController()
+    _, capacity = Config.RATE_LIMIT_GUEST
+    for i in range(int(capacity)):
+        assert controller.evaluate("10.0.0.1", f"made-up-{i}") is None
+
+    rejection = controller.evaluate("10.0.0.1", "yet-another-token")
+    assert rejection is not None and rejection[0] == 429
+    assert controller.evaluate("10.0.0.2", "made-up-0") is None
+
+
+def test_authenticated_users_get_their_own_bucket():
+    controller = AdmissionController()
+    controller.remember_role("user-token", Roles.USER.id, share=False)
+    controller.remember_role("guest-token", Roles.GUEST.id, share=False)
+
+    assert not controller.is_guest("user-token")
+    assert controller.is_guest("guest-token")
+    assert controller.is_guest(None)
+
+    _, capacity = Config.RATE_LIMIT_GUEST
+    for _ in range(int(capacity)):
+        controller.evaluate("10.0.0.1", None)
+    assert controller.evaluate("10.0.0.1", None) is not None
+    assert controller.evaluate("10.0.0.1", "user-token") is None
+
+
+def test_guests_are_shed_first():
+    controller = AdmissionController()
+    controller.remember_role("user-token", Roles.USER.id, share=False)
+
+    controller.in_flight = Config.ADMISSION_SOFT_IN_FLIGHT
+    assert controller.evaluate("10.0.0.1", "unknown-token") == (503, "Server busy", Config.ADMISSION_RETRY_AFTER)
+    assert controller.evaluate("10.0.0.2", "user-token") is None
+
+    controller.in_flight = Config.ADMISSION_HARD_IN_FLIGHT
+    assert controller.evaluate("10.0.0.2", "user-token") is not None
+    assert controller.rejected == 2
+
+
+def test_guests_are_shed_while_the_watchdog_sees_loop_lag(monkeypatch):
+    controller = AdmissionController()
+    monkeypatch.setattr(admission_service.loop_watchdog, "get_lag", lambda: Config.ADMISSION_MAX_LOOP_LAG)
+
+    assert controller.is_saturated()
+    assert controller.evaluate("10.0.0.1", None) == (503, "Server busy", Config.ADMISSION_RETRY_AFTER)
+    assert controller.get_stats().loop_lag == Config.ADMISSION_MAX_LOOP_LAG
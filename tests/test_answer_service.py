@@ -0,0 +1,52 @@
+from server.services.answer_service import AnswerLineParser, parse_packed_answers
+
+
+def test_packed_answers_are_read_by_word():
+    content = '[{"word": "擢", "answer": "提拔"}, {"word": "之", "answer": " 代词 "}]'
+    assert parse_packed_answers(content, ["擢", "之"]) == {"擢": "提拔", "之": "代词"}
+
+
+def test_packed_answers_survive_fences_and_truncation():
+    content = '```json\n[{"word": "擢", "answer": "提拔"}, {"word": "之", "answ'
+    assert parse_packed_answers(content, ["擢", "之"]) == {"擢": "提拔"}
+
+
+def test_packed_answers_ignore_unknown_words_and_empty_answers():
+    content = '[{"word": "擢", "answer": ""}, {"word": "乎", "answer": "语气词"}, {"word": "之", "answer": 1}]'
+    assert parse_packed_answers(content, ["擢", "之"]) == {}
+
+
+def test_packed_answers_keep_the_first_answer_of_a_word():
+    content = '{"word": "擢", "answer": "提拔"} {"word": "擢", "answer": "选拔"}'
+    assert parse_packed_answers(content, ["擢"]) == {"擢": "提拔"}
+
+
+def feed_all(parser: AnswerLineParser, chunks: list[str]) -> list:
+    return [answer for answer in map(parser.feed, chunks) if answer is not None]
+
+
+def test_answer_line_is_found_across_chunks():
+    parser = AnswerLineParser()
+    answers = feed_all(parser, ["**分析**：擢，提拔。\n**", "答案**：提拔", "；被提拔", "\n后文"])
+    assert [answer.answer for answer in answers] == ["提拔；被提拔"]
+    assert answers[0].answers == ["提拔", "被提拔"]
+
+
+def test_answer_is_returned_once():
+    parser = AnswerLineParser()
+    assert parser.feed("**答案**：提拔\n") is not None
+    assert parser.feed("\n**答案**：别的\n") is None
+
+
+def test_incomplete_answer_line_waits_for_finish():
+    parser = AnswerLineParser()
+    assert feed_all(parser, ["分析\n**答案**:", " 提拔 "]) == []
+    answer = parser.finish()
+    assert answer is not None and answer.answer == "提拔"
+    assert parser.finish() is None
+
+
+def test_marker_must_start_a_line():
+    parser = AnswerLineParser()
+    assert feed_all(parser, ["见**答案**：非答案\n"]) == []
+    assert parser.finish() is None
@@ -0,0 +1,102 @@
+from contextlib import asynccontextmanager
+from json import loads
+
+import pytest
+
+from server.models import AiModel, AiUsage, BatchItem, ServerResponseAiFlash, ServerResponseAiUsage
+from server.services.batch_service import BatchService
+
+
+class FakePocketBase:
+    def __init__(self):
+        self.charges: list[str] = []
+
+    @asynccontextmanager
+    async def deferred_charges(self, reason: str):
+        yield
+        self.charges.append(reason)
+
+
+USAGE = ServerResponseAiUsage.create(
+    AiUsage(
+        prompt_tokens=10,
+        completion_tokens=5,
+        model=AiModel(base_url="http://upstream", id="model", prompt_price=1, completion_price=1),
+    )
+).to_jsonl_str()
+
+
+async def flash(context: str, q: str):
+    yield ServerResponseAiFlash.create(data=f"解{q}").to_jsonl_str()
+    yield USAGE
+
+
+async def packed(context: str, words: list[str]):
+    for word in words:
+        yield word, ServerResponseAiFlash.create(data=f"解{word}").to_jsonl_str()
+    yield None, USAGE
+
+
+async def run(items: list[BatchItem]) -> list[dict]:
+    service = BatchService(FakePocketBase(), {"flash": flash}, 4, {"flash": packed}, pack_size=3)  # type: ignore
+    return [loads(line) async for line in service.run(items)]
+
+
+def test_tag_adds_the_item_id():
+    assert BatchService.tag(["a", "b"], '{"type":"done","data":null}\n') == [
+        '{"id":"a","type":"done","data":null}\n',
+        '{"id":"b","type":"done","data":null}\n',
+    ]
+
+
+@pytest.mark.anyio
+async def test_packed_usage_is_reported_once():
+    items = [BatchItem(id=f"i{i}", context="ctx", q=q) for i, q in enumerate(["擢", "之", "乎"])]
+    lines = await run(items)
+
+    assert {line["id"]: line["data"] for line in lines if line["type"] == "ai-flash"} == {
+        "i0": "解擢",
+        "i1": "解之",
+        "i2": "解乎",
+    }
+    assert [line["id"] for line in lines if line["type"] == "ai-usage"] == ["i0"]
+    assert sorted(line["id"] for line in lines if line["type"] == "done") == ["i0", "i1", "i2"]
+
+
+@pytest.mark.anyio
+async def test_identical_items_run_once_and_report_usage_once():
+    items = [BatchItem(id=f"i{i}", context="ctx", q="擢") for i in range(3)]
+    lines = await run(items)
+
+    assert sorted(line["id"] for line in lines if line["type"] == "ai-flash") == ["i0", "i1", "i2"]
+    assert len([line for line in lines if line["type"] == "ai-usage"]) == 1
+
+
+class ChargingPocketBase(FakePocketBase):
+    def __init__(self):
+        super().__init__()
+        self.spent = 0
+
+    def get_deferred_coins(self) -> int:
+        return self.spent
+
+
+@pytest.mark.anyio
+async def test_jobs_stop_starting_once_the_balance_is_spent():
+    pb = ChargingPocketBase()
+
+    async def thinking(context: str, q: str):
+        pb.spent += 3
+        yield ServerResponseAiFlash.create(data=f"解{q}").to_jsonl_str()
+
+    service = BatchService(pb, {"thinking": thinking}, 1, balance=5)  # type: ignore
+    items = [BatchItem(id=f"i{i}", context="ctx", q=q, mode="thinking") for i, q in enumerate("擢之乎者")]
+    lines = [loads(line) async for line in service.run(items)]
+
+    # The second job overspends the balance; it still completes, the rest are refused.
+    assert [line["id"] for line in lines if line["type"] == "ai-flash"] == ["i0", "i1"]
+    errors = [line for line in lines if line["type"] == "error"]
+    assert [line["id"] for line in errors] == ["i2", "i3"]
+    assert errors[0]["data"]["message"] == "Not enough balance"
+    assert sorted(line["id"] for line in lines if line["type"] == "done") == ["i0", "i1", "i2", "i3"]
+    assert pb.charges == ["批量查询 4 项"]
@@ -0,0 +1,88 @@
+from asyncio import gather, sleep
+
+import pytest
+
+from server.services.cache_service import (
+    CacheBackend,
+    LockTimeoutError,
+    MemoryCacheBackend,
+    RespCacheBackend,
+    SqliteCacheBackend,
+)
+from tests.resp_standin import RespStandIn
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(params=["memory", "sqlite", "resp"])
+async def backends(request, tmp_path):
+    """Two handles on one backend, as two workers would hold (one for the per-process memory backend)."""
+    if request.param == "memory":
+        memory = MemoryCacheBackend(100)
+        yield memory, memory
+    elif request.param == "sqlite":
+        path = str(tmp_path / "cache.db")
+        yield SqliteCacheBackend(path), SqliteCacheBackend(path)
+    else:
+        server = await RespStandIn(password="test").start(0)
+        port = server.sockets[0].getsockname()[1]
+        url = f"redis://:test@127.0.0.1:{port}/1"
+        yield RespCacheBackend(url, 2, 1.0), RespCacheBackend(url, 2, 1.0)
+        server.close()
+
+
+async def is_held(backend: CacheBackend, name: str) -> bool:
+    try:
+        token = await backend.acquire(name, 5, 0.05)
+    except LockTimeoutError:
+        return True
+    assert token is not None
+    await backend.release(name, token)
+    return False
+
+
+async def test_lease_excludes_others_until_released(backends):
+    first, second = backends
+    token = await first.acquire("lock:a", 5, 1)
+    assert token is not None
+
+    assert await is_held(second, "lock:a")
+    assert not await is_held(second, "lock:b")
+
+    await second.release("lock:a", "not-the-owner")
+    assert await is_held(second, "lock:a")
+
+    await first.release("lock:a", token)
+    assert not await is_held(second, "lock:a")
+
+
+async def test_lease_expires(backends):
+    first, second = backends
+    token = await first.acquire("lock:a", 0.05, 1)
+    assert token is not None
+    await sleep(0.1)
+
+    taken = await second.acquire("lock:a", 5, 0.05)
+    assert taken is not None and taken != token
+    # The first holder's late release leaves the new lease alone.
+    await first.release("lock:a", token)
+    assert await is_held(first, "lock:a")
+
+
+async def test_acquire_waits_for_release(backends):
+    first, second = backends
+    token = await first.acquire("lock:a", 5, 1)
+    assert token is not None
+
+    async def release_soon():
+        await sleep(0.05)
+        await first.release("lock:a", token)
+
+    _, taken = await gather(release_soon(), second.acquire("lock:a", 5, 1))
+    assert taken is not None
+
+
+async def test_unreachable_resp_server_gives_no_lease():
+    backend = RespCacheBackend("redis://127.0.0.1:1/0", 1, 0.2)
+    assert await backend.acquire("lock:a", 5, 1) is None
+    assert await backend.get("key") is None
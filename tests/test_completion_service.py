@@ -0,0 +1,116 @@
+from time import perf_counter
+
+import pytest
+from openai.types.chat import ChatCompletionChunk
+
+from server.models import AiModel, ServerResponseType
+from server.services.completion_service import CompletionService, OpenedStream, completion_tracker
+from server.services.key_pool_service import ApiKeyPool, PooledKey
+
+pytestmark = pytest.mark.anyio
+
+MODEL = AiModel(base_url="http://upstream/v1", id="model", prompt_price=1, completion_price=1)
+
+
+class FakePocketBase:
+    latest_auth_result = None
+
+    def __init__(self):
+        self.spent: list[tuple[int, str]] = []
+
+    async def users_spend_coins(self, coins: int, reason: str) -> None:
+        self.spent.append((coins, reason))
+
+
+class FakeStream:
+    def __init__(self, chunks: list[ChatCompletionChunk], error: Exception | None = None):
+        self.chunks = chunks
+        self.error = error
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def make_chunk(content: str | None = None, usage: tuple[int, int] | None = None) -> ChatCompletionChunk:
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": "chunk",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": MODEL.id,
+            "choices": [] if content is None else [{"index": 0, "delta": {"content": content}}],
+            "usage": None if usage is None else {
+                "prompt_tokens": usage[0],
+                "completion_tokens": usage[1],
+                "total_tokens": sum(usage),
+            },
+        }
+    )
+
+
+def make_response(stream: FakeStream) -> OpenedStream:
+    key = PooledKey("key", MODEL.base_url, 600, 100000)
+    return OpenedStream(MODEL, key, 100, 10, stream, None, perf_counter())  # type: ignore
+
+
+def process(stream: FakeStream, pb: FakePocketBase):
+    service = CompletionService(pb, ApiKeyPool([PooledKey("key", MODEL.base_url, 600, 100000)]))  # type: ignore
+    return service._process_response(make_response(stream), ServerResponseType.AiThinking, "test")
+
+
+async def test_usage_chunk_is_billed_as_reported():
+    before = completion_tracker.get_stats()
+    pb = FakePocketBase()
+    events = [event async for event in process(FakeStream([make_chunk("之"), make_chunk(usage=(10, 1))]), pb)]
+
+    usage = [event for event in events if event.type == ServerResponseType.AiUsage]
+    assert len(usage) == 1 and not usage[0].data.estimated
+    assert len(pb.spent) == 1
+    assert completion_tracker.get_stats().completed == before.completed + 1
+
+
+async def test_stream_ending_without_usage_counts_as_completed():
+    before = completion_tracker.get_stats()
+    pb = FakePocketBase()
+    events = [event async for event in process(FakeStream([make_chunk("之乎"), make_chunk("者也")]), pb)]
+
+    usage = [event for event in events if event.type == ServerResponseType.AiUsage]
+    assert len(usage) == 1
+    assert usage[0].data.estimated and usage[0].data.completion_tokens == 4
+    assert len(pb.spent) == 1
+    after = completion_tracker.get_stats()
+    assert after.completed == before.completed + 1
+    assert after.cancelled == before.cancelled
+
+
+async def test_client_leaving_bills_an_estimate_and_counts_as_cancelled():
+    before = completion_tracker.get_stats()
+    stream = FakeStream([make_chunk("之"), make_chunk("乎"), make_chunk(usage=(10, 2))])
+    pb = FakePocketBase()
+    events = process(stream, pb)
+    await anext(events)
+    await events.aclose()
+
+    assert stream.closed
+    assert len(pb.spent) == 1
+    assert completion_tracker.get_stats().cancelled == before.cancelled + 1
+
+
+async def test_upstream_failure_is_billed_but_not_counted_as_cancelled():
+    before = completion_tracker.get_stats()
+    pb = FakePocketBase()
+    with pytest.raises(ConnectionError):
+        async for _ in process(FakeStream([make_chunk("之")], error=ConnectionError("reset")), pb):
+            pass
+
+    assert len(pb.spent) == 1
+    after = completion_tracker.get_stats()
+    assert after.cancelled == before.cancelled
+    assert after.completed == before.completed
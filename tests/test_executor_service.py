@@ -0,0 +1,25 @@
+from asyncio import sleep
+from time import sleep as block
+
+import pytest
+
+from server.services.executor_service import LoopWatchdog
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_watchdog_measures_how_long_the_loop_was_blocked():
+    watchdog = LoopWatchdog(threshold=0, interval=0.01)
+    assert watchdog.get_lag() == 0.0
+    watchdog.start()
+    try:
+        await sleep(0.03)
+        block(0.1)
+        # Seen while the heartbeat is still pending, then measured once it fires.
+        assert watchdog.get_lag() >= 0.08
+        await sleep(0.001)
+        assert watchdog.get_lag() >= 0.08
+        await sleep(0.05)
+        assert watchdog.get_lag() < 0.08
+    finally:
+        watchdog.stop()
@@ -0,0 +1,94 @@
+from server.services.extract_service import ExtractRowMerger, parse_extract_rows, split_exam_blocks
+from server.models import ExtractRow
+
+SINGLE = """阅读下面的文言文，完成1～3题。
+六年，擢四川按察使。
+①擢：提拔。
+1. 解释加点的词：擢
+2. 下列断句正确的一项是
+3. 把文中画线的句子翻译成现代汉语。
+参考答案
+1. 提拔
+3. 六年后被提拔为四川按察使。
+"""
+
+TWO_PASSAGES = """文言文阅读（一）
+六年，擢四川按察使。
+6. 解释加点的词：擢
+7. 下列断句正确的一项是
+文言文阅读（二）
+学而时习之，不亦说乎？
+10. 解释加点的词：说
+11. 把“学而时习之”翻译成现代汉语。
+参考答案
+6. 提拔
+10. 通“悦”，高兴
+11. 学了又按时温习。
+"""
+
+
+def test_single_passage_blocks_carry_the_passage_and_answers():
+    blocks = split_exam_blocks(SINGLE)
+    assert len(blocks) == 3  # two relevant questions, and the notes
+    assert blocks[0].startswith("阅读下面的文言文") and "1. 解释加点的词：擢" in blocks[0]
+    assert blocks[0].endswith("答案：\n1. 提拔")
+    assert "断句" not in "".join(blocks)
+    assert blocks[1].endswith("答案：\n3. 六年后被提拔为四川按察使。")
+    assert blocks[2].endswith("（本题块只处理原文下的注释。）")
+
+
+def test_each_passage_gets_its_own_blocks():
+    blocks = split_exam_blocks(TWO_PASSAGES)
+    assert len(blocks) == 3
+    first, second, third = blocks
+    assert "擢四川" in first and "学而时习之" not in first
+    assert first.endswith("答案：\n6. 提拔")
+    assert second.startswith("文言文阅读（二）\n学而时习之") and "擢" not in second
+    assert second.endswith("答案：\n10. 通“悦”，高兴")
+    assert third.endswith("答案：\n11. 学了又按时温习。")
+
+
+def test_answers_grouped_by_passage_stay_answers():
+    paper = TWO_PASSAGES.replace("参考答案\n6. 提拔\n", "参考答案\n文言文阅读（一）\n6. 提拔\n文言文阅读（二）\n")
+    blocks = split_exam_blocks(paper)
+    assert len(blocks) == 3
+    assert blocks[0].endswith("答案：\n6. 提拔")
+    assert blocks[1].endswith("答案：\n10. 通“悦”，高兴")
+
+
+def test_numbering_may_start_over_with_each_passage():
+    paper = TWO_PASSAGES.replace("6.", "1.").replace("7.", "2.").replace("10.", "1.").replace("11.", "2.")
+    paper = paper.split("参考答案")[0]
+    blocks = split_exam_blocks(paper)
+    assert len(blocks) == 3
+    assert "1. 解释加点的词：说" in blocks[1]
+
+
+def test_papers_without_numbered_questions_give_no_blocks():
+    assert split_exam_blocks("学而时习之，不亦说乎？\n说：通“悦”。") == []
+
+
+def test_rows_come_from_the_last_csv_block():
+    text = """分析……
+```csv
+type,context,query,answer
+注释,六年，擢四川按察使,擢,提拔
+```
+修正后：
+```csv
+type,context,query,answer
+注释,六年,擢四川按察使,擢,提拔
+翻译,,缺语境,无
+```"""
+    assert parse_extract_rows(text) == [
+        ExtractRow(type="注释", context="六年,擢四川按察使", query="擢", answer="提拔")
+    ]
+    assert parse_extract_rows("no code block") == []
+
+
+def test_merger_keeps_each_question_once():
+    merger = ExtractRowMerger()
+    row = ExtractRow(type="注释", context="六年，擢四川按察使。", query="擢", answer="提拔")
+    assert merger.add([row]) == [row]
+    assert merger.add([row.model_copy(update={"context": "六年，擢四川按察使"})]) == []
+    assert merger.to_csv() == "type,context,query,answer\n注释,六年，擢四川按察使。,擢,提拔\n"
@@ -0,0 +1,68 @@
+from server.services.http_cache_service import ETagRegistry, etag_matches, make_etag
+
+
+def test_make_etag_depends_only_on_its_parts():
+    etag = make_etag("zdic", "3", "42")
+    assert etag == make_etag("zdic", "3", "42")
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag != make_etag("zdic", "4", "42")
+    assert make_etag("a", "bc") != make_etag("ab", "c")
+
+
+def test_weak_etag_compares_equal_to_its_strong_form():
+    strong, weak = make_etag("zdic", "3"), make_etag("zdic", "3", weak=True)
+    assert weak == "W/" + strong
+    assert etag_matches(weak, weak)
+    assert etag_matches(strong, weak)
+    assert etag_matches(weak, strong)
+    assert not etag_matches(make_etag("zdic", "4", weak=True), weak)
+
+
+def test_etag_matches_lists_and_wildcard():
+    etag = make_etag("x")
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
+
+
+def test_registry_answers_304_for_the_remembered_etag():
+    registry = ETagRegistry(max_size=8)
+    etag = make_etag("freq", "1")
+    registry.remember("freq", "/api/query/freq-info", "q=之&page=1", etag, "max-age=60")
+
+    # Parameter order does not matter.
+    response = registry.match("/api/query/freq-info", "page=1&q=之", etag)
+    assert response is not None
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.headers["Cache-Control"] == "max-age=60"
+
+    assert registry.match("/api/query/freq-info", "q=之&page=1", '"stale"') is None
+    assert registry.match("/api/query/freq-info", "q=之&page=1", None) is None
+    assert registry.match("/api/query/freq-info", "q=之&page=2", etag) is None
+
+
+def test_registry_evicts_least_recently_remembered():
+    registry = ETagRegistry(max_size=2)
+    for page in ("1", "2", "3"):
+        registry.remember("freq", "/f", f"page={page}", make_etag(page), "no-cache")
+
+    assert registry.match("/f", "page=1", make_etag("1")) is None
+    assert registry.match("/f", "page=2", make_etag("2")) is not None
+    assert registry.match("/f", "page=3", make_etag("3")) is not None
+
+
+def test_invalidate_scope_drops_its_entries_and_bumps_its_epoch():
+    registry = ETagRegistry(max_size=8)
+    freq_epoch, zdic_epoch = registry.get_epoch("freq"), registry.get_epoch("zdic")
+    registry.remember("freq", "/f", "q=a", make_etag("f"), "no-cache")
+    registry.remember("zdic", "/z", "q=a", make_etag("z"), "no-cache")
+
+    registry.invalidate_scope("freq")
+
+    assert registry.match("/f", "q=a", make_etag("f")) is None
+    assert registry.match("/z", "q=a", make_etag("z")) is not None
+    assert registry.get_epoch("freq") != freq_epoch
+    assert registry.get_epoch("zdic") == zdic_epoch
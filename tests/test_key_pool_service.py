@@ -0,0 +1,66 @@
+from asyncio import Event, create_task, sleep
+
+import pytest
+from pytest import approx
+
+from server.services import key_pool_service
+from server.services.key_pool_service import ApiKeyPool, PooledKey
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(key_pool_service, "monotonic", clock)
+    monkeypatch.setattr(key_pool_service, "sleep", clock.sleep)
+    return clock
+
+
+def make_pool(count: int) -> ApiKeyPool:
+    return ApiKeyPool([PooledKey(f"key-{i}", "http://upstream/v1", 600, 100000) for i in range(count)])
+
+
+async def test_acquire_waits_out_the_shortest_cooldown(clock):
+    pool = make_pool(2)
+    pool.keys[0].cooldown_until = clock.now + 20
+    pool.keys[1].cooldown_until = clock.now + 5
+
+    key = await pool.acquire(100, set())
+
+    assert key is pool.keys[1]
+    assert sum(clock.slept) == approx(5)
+    assert not key.is_cooling_down()
+
+
+async def test_cancelled_call_returns_its_token_reservation(clock):
+    pool = make_pool(1)
+    key = pool.keys[0]
+    available = key.tokens.get_available()
+    sent = Event()
+
+    async def send(key: PooledKey) -> None:
+        sent.set()
+        await Event().wait()
+
+    task = create_task(pool.call(1000, send))
+    await sent.wait()
+    assert key.tokens.get_available() == approx(available - 1000)
+
+    task.cancel()
+    await sleep(0)
+    assert task.cancelled()
+    assert key.tokens.get_available() == approx(available)
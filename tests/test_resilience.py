@@ -0,0 +1,213 @@
+from asyncio import CancelledError, Event, create_task, sleep, wait_for
+
+import pytest
+from httpx import Request, Response
+from openai import APIConnectionError, RateLimitError
+
+from server.models import AiModel
+from server.services import resilience_service
+from server.services.resilience_service import CircuitBreaker, ModelHealth, UpstreamUnavailableError
+from server.services.scheduler_service import UpstreamQueueTimeoutError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(resilience_service, "monotonic", clock)
+    return clock
+
+
+def make_model(model_id: str, **kwargs) -> AiModel:
+    return AiModel(base_url="http://upstream", id=model_id, prompt_price=1, completion_price=1, **kwargs)
+
+
+def make_rate_limit_error() -> RateLimitError:
+    response = Response(429, request=Request("POST", "http://upstream/chat/completions"))
+    return RateLimitError("rate limited", response=response, body=None)
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.get_state() == "closed"
+    breaker.record_failure()
+    assert breaker.get_state() == "open"
+    assert not breaker.allow()
+
+
+def test_half_open_breaker_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.get_state() == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.get_state() == "open"
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.get_state() == "closed"
+
+
+def test_released_trial_can_be_retried(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release_trial()
+    assert breaker.get_state() == "half-open"
+    assert breaker.allow()
+
+
+@pytest.mark.anyio
+async def test_fallback_chain_skips_failing_models():
+    backup = make_model("backup")
+    primary = make_model("primary", fallback=backup, breaker_failures=1)
+    health = ModelHealth()
+
+    async def call(model: AiModel) -> str:
+        if model.id == "primary":
+            raise APIConnectionError(request=Request("POST", "http://upstream"))
+        return model.id
+
+    assert await health.call_with_fallback(primary, call) == (backup, "backup")
+    assert health.get_breaker(primary).get_state() == "open"
+    assert await health.call_with_fallback(primary, call) == (backup, "backup")
+    assert health.get_stats()["primary"].fallbacks == 2
+
+
+@pytest.mark.anyio
+async def test_rate_limits_do_not_count_against_the_model():
+    model = make_model("primary", breaker_failures=1)
+    health = ModelHealth()
+
+    async def call(model: AiModel) -> str:
+        raise make_rate_limit_error()
+
+    with pytest.raises(UpstreamUnavailableError):
+        await health.call_with_fallback(model, call)
+    assert health.get_breaker(model).get_state() == "closed"
+
+
+@pytest.mark.anyio
+async def test_busy_fallback_slot_does_not_count_against_the_model():
+    fallback = make_model("fallback", breaker_failures=1)
+    model = make_model("primary", breaker_failures=1, fallback=fallback)
+    health = ModelHealth()
+
+    async def call(candidate: AiModel) -> str:
+        if candidate is fallback:
+            raise UpstreamQueueTimeoutError(candidate.id, 30.0)
+        raise APIConnectionError(request=Request("POST", "http://upstream/chat/completions"))
+
+    with pytest.raises(UpstreamUnavailableError):
+        await health.call_with_fallback(model, call)
+    assert health.get_breaker(model).get_state() == "open"
+    assert health.get_breaker(fallback).get_state() == "closed"
+
+
+@pytest.mark.anyio
+async def test_other_errors_count_as_failures():
+    model = make_model("primary", breaker_failures=1)
+    health = ModelHealth()
+
+    async def call(model: AiModel) -> str:
+        raise ValueError("unexpected")
+
+    with pytest.raises(ValueError):
+        await health.call_with_fallback(model, call)
+    assert health.get_breaker(model).get_state() == "open"
+
+
+@pytest.mark.anyio
+async def test_cancelled_trial_frees_the_breaker(clock):
+    model = make_model("primary", breaker_failures=1, breaker_cooldown=10)
+    health = ModelHealth()
+    breaker = health.get_breaker(model)
+    breaker.record_failure()
+    clock.now += 10
+    started = Event()
+
+    async def hang(model: AiModel) -> str:
+        started.set()
+        await Event().wait()
+        return "never"
+
+    task = create_task(health.call_with_fallback(model, hang))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(CancelledError):
+        await task
+
+    assert not breaker.trial_running
+    assert breaker.allow()
+
+
+@pytest.mark.anyio
+async def test_first_token_timeout_pauses_while_waiting_for_quota():
+    model = make_model("primary", first_token_timeout=0.05)
+    health = ModelHealth()
+
+    async def call(model: AiModel) -> str:
+        deadline = resilience_service.upstream_deadline.get()
+        assert deadline is not None
+        deadline.pause()
+        await sleep(0.1)  # waiting for a key, longer than the timeout
+        deadline.restart()
+        await sleep(0.01)
+        return "answer"
+
+    assert await health.call_with_fallback(model, call) == (model, "answer")
+
+
+@pytest.mark.anyio
+async def test_hedged_returns_the_first_result_and_cancels_the_rest(monkeypatch):
+    model = make_model("primary", hedge=True)
+    health = ModelHealth()
+    monkeypatch.setattr(health, "get_hedge_delay", lambda model: 0.01)
+    calls: list[int] = []
+    cancelled: list[int] = []
+
+    async def call() -> int:
+        number = len(calls)
+        calls.append(number)
+        try:
+            await sleep(0.2 if number == 0 else 0.01)
+        except CancelledError:
+            cancelled.append(number)
+            raise
+        return number
+
+    assert await health.hedged(model, call) == 1
+    await sleep(0)  # lets the cancellation land
+    assert cancelled == [0]
+
+
+@pytest.mark.anyio
+async def test_hedged_cancels_the_first_call_with_its_caller():
+    model = make_model("primary", hedge=True)
+    health = ModelHealth()
+    cancelled = Event()
+
+    async def call() -> None:
+        try:
+            await Event().wait()
+        except CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(TimeoutError):
+        await wait_for(health.hedged(model, call), 0.01)
+    await wait_for(cancelled.wait(), 1)
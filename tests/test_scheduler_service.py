@@ -0,0 +1,61 @@
+from asyncio import Event, create_task, sleep
+
+import pytest
+
+from server.models import AiModel
+from server.services.scheduler_service import UpstreamScheduler
+
+pytestmark = pytest.mark.anyio
+
+
+def make_model(model_id: str, **kwargs) -> AiModel:
+    return AiModel(base_url="http://upstream", id=model_id, prompt_price=1, completion_price=1, **kwargs)
+
+
+async def hold(scheduler: UpstreamScheduler, model: AiModel, release):
+    async with scheduler.slot(model, None) as ticket:
+        async for _ in ticket.wait():
+            pass
+        await release.wait()
+
+
+async def test_slot_waits_for_the_model_cap():
+    scheduler = UpstreamScheduler(max_concurrency=10, default_model_concurrency=1)
+    model = make_model("primary")
+    release = Event()
+    holder = create_task(hold(scheduler, model, release))
+    await sleep(0)
+
+    async with scheduler.slot(model, None) as ticket:
+        assert scheduler.get_position(ticket) == 1
+        release.set()
+        async for _ in ticket.wait():
+            pass
+        assert scheduler.get_stats().active_by_model == {"primary": 1}
+    await holder
+    assert scheduler.get_stats().active == 0
+
+
+async def test_move_takes_a_slot_of_the_fallback():
+    scheduler = UpstreamScheduler(max_concurrency=10, default_model_concurrency=4)
+    primary, fallback = make_model("primary"), make_model("fallback", max_concurrency=1)
+    release = Event()
+    holder = create_task(hold(scheduler, fallback, release))
+    await sleep(0)
+
+    async with scheduler.slot(primary, None) as ticket:
+        async for _ in ticket.wait():
+            pass
+        move = create_task(scheduler.move(ticket, fallback))
+        await sleep(0.01)
+        # The primary's slot is handed back while the fallback is at its cap.
+        assert not move.done()
+        assert scheduler.get_stats().active_by_model == {"primary": 0, "fallback": 1}
+        assert scheduler.get_stats().queued_by_model == {"fallback": 1}
+
+        release.set()
+        await move
+        assert scheduler.get_stats().active_by_model == {"primary": 0, "fallback": 1}
+    await holder
+    assert scheduler.get_stats().active == 0
+    assert scheduler.get_stats().active_by_model == {"primary": 0, "fallback": 0}
@@ -5,7 +5,7 @@ Should take 2h unless cached.
 
 from dotenv import load_dotenv
 from os import getenv
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from httpx import AsyncClient
 from tqdm import tqdm
 from typing import Coroutine, Any
@@ -32,12 +32,15 @@ from train.models import (
     BatchRequest,
 )
 from train.utils import IntermediateFiles, JsonlWriter
+from server.services.recording_service import get_upstream_transport
 
 load_dotenv(".env")
 
+# UPSTREAM_RECORDING=auto makes reruns offline and repeatable.
 client = AsyncOpenAI(
     api_key=getenv("API_KEY"),
     base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+    http_client=DefaultAsyncHttpxClient(transport=get_upstream_transport()),
 )
 
 httpx_client = AsyncClient()